@@ -1,160 +1,139 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, abort, send_file
+from werkzeug.middleware.proxy_fix import ProxyFix
+import click
 import os
-import sqlite3
 import hashlib
 from datetime import datetime
 
+import assets
+import backup
+import branch_finder
+import compression
+import content_io
+import content_summary
+import db
+import feeds
+import freeze
+import images
+import jobs
+import media
+import metrics
+import migrations
+import page_cache
+import pagination
+import recurrence
+import rotation
+import search
+import streaming
+import warmup
+import query_plans
+import ratelimit
+from db import DATABASE, get_db, get_pool
+from page_cache import cached
+from pagination import Listing, OffsetPage, wants_json
+from ratelimit import rate_limited
+
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
 
+# Proxies in front of the app (1 behind the Render/Heroku router). request.remote_addr, and with it
+# the rate limit buckets and the metrics allowlist, comes from their X-Forwarded-For
+app.config['TRUSTED_PROXY_HOPS'] = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+if app.config['TRUSTED_PROXY_HOPS']:
+    hops = app.config['TRUSTED_PROXY_HOPS']
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops)
+
 # Database configuration
-DATABASE = 'database/database.db'
+app.config['DATABASE'] = os.environ.get('DATABASE', DATABASE)
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 8))
+db.init_app(app)
+
+# Listing pagination
+app.config['PAGE_SIZE'] = int(os.environ.get('PAGE_SIZE', 12))
+app.config['MAX_PAGE_SIZE'] = int(os.environ.get('MAX_PAGE_SIZE', 100))
+app.config['EVENT_HORIZON_DAYS'] = int(os.environ.get('EVENT_HORIZON_DAYS', 365))
+app.config['API_MAX_WINDOW_DAYS'] = 92
+SERMON_LISTING = Listing('sermons', key='date', descending=True)
+EVENT_LISTING = Listing('events', key='date', descending=False)
+OCCURRENCE_LISTING = Listing('event_occurrence_details', key='date', descending=False,
+                             where="date >= date('now')")
+BRANCH_LISTING = Listing('branches', key=None, descending=False)
+INSPIRATION_LISTING = Listing('daily_inspiration', key='date', descending=True)
+# What was shown each day, from the rotation schedule
+INSPIRATION_ARCHIVE_LISTING = Listing('inspiration_archive', key='date', descending=True,
+                                      where="date <= date('now')")
+
+# Rendered page cache for public routes
+app.config['PAGE_CACHE_SIZE'] = int(os.environ.get('PAGE_CACHE_SIZE', 256))
+app.config['PAGE_CACHE_TTL'] = int(os.environ.get('PAGE_CACHE_TTL', 300))
+page_cache.init_app(app)
+content_summary.init_app(app)
+
+# Daily inspiration: a year-ahead rotation that shows no entry twice within the window
+app.config['INSPIRATION_SCHEDULE_DAYS'] = int(os.environ.get('INSPIRATION_SCHEDULE_DAYS', 365))
+app.config['INSPIRATION_NO_REPEAT_DAYS'] = int(os.environ.get('INSPIRATION_NO_REPEAT_DAYS', 60))
+rotation.init_app(app)
+
+# Sermon media uploads; form parsing spools large files to disk, never whole into memory
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', media.DEFAULT_UPLOAD_FOLDER)
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 1024)) * 1024 * 1024
+media.init_app(app)
+
+# Responsive image variants, rendered in a process pool off the request path
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))
+images.init_app(app)
+
+# Pre-rendered sermon podcast feeds
+app.config['FEED_SIZE'] = int(os.environ.get('FEED_SIZE', 50))
+feeds.init_app(app)
+
+# Static export of the public pages
+app.config['SITE_URL'] = os.environ.get('SITE_URL', 'http://localhost')
+freeze.init_app(app)
+
+# Minified, fingerprinted CSS/JS bundles (`flask assets build`)
+assets.init_app(app)
+
+# Long listing pages stream as they render (opt-in); text responses are gzip/brotli encoded
+app.config['STREAM_TEMPLATES'] = os.environ.get('STREAM_TEMPLATES', '0') == '1'
+app.config['COMPRESS_ENABLED'] = os.environ.get('COMPRESS', '1') == '1'
+streaming.init_app(app)
+compression.init_app(app)
+
+# Request latency, sampled SQL/template timings and the slow request log
+app.config['METRICS_SLOW_MS'] = int(os.environ.get('METRICS_SLOW_MS', 500))
+app.config['METRICS_SAMPLE_RATE'] = float(os.environ.get('METRICS_SAMPLE_RATE', 0.1))
+app.config['METRICS_ALLOWLIST'] = [ip for ip in os.environ.get('METRICS_ALLOWLIST', '').split(',') if ip]
+metrics.init_app(app)
+
+# Token-bucket rate limits per client IP (and per username for login), e.g. RATE_LIMITS="login=10/minute,listing=2/second"
+app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT', '1') == '1'
+app.config['RATE_LIMITS'] = dict(item.split('=', 1) for item in os.environ.get('RATE_LIMITS', '').split(',') if '=' in item)
+ratelimit.init_app(app)
+
+# Worker start-up: compiled templates shared on disk (empty JINJA_CACHE_FOLDER turns it off), optional warm-up
+app.config['JINJA_CACHE_FOLDER'] = os.environ.get('JINJA_CACHE_FOLDER',
+                                                  os.path.join(os.path.dirname(app.config['DATABASE']) or '.', 'jinja-cache'))
+app.config['WARM_UP'] = os.environ.get('WARM_UP', '0') == '1'
+warmup.init_app(app)
+
+# Background jobs, run by `flask jobs run` next to the web workers; JOBS_EAGER=1 runs them in the request instead
+app.config['JOBS_CONCURRENCY'] = int(os.environ.get('JOBS_CONCURRENCY', 2))
+app.config['JOBS_EAGER'] = os.environ.get('JOBS_EAGER', '0') == '1'
+app.config['JOBS_STALL_SECONDS'] = int(os.environ.get('JOBS_STALL_SECONDS', 300))
+jobs.init_app(app)
+
+# Online database snapshots (`flask backup create`), also taken every BACKUP_INTERVAL seconds by the job worker
+app.config['BACKUP_FOLDER'] = os.environ.get('BACKUP_FOLDER',
+                                             os.path.join(os.path.dirname(app.config['DATABASE']) or '.', 'backups'))
+app.config['BACKUP_INTERVAL'] = int(os.environ.get('BACKUP_INTERVAL', 86400))
+app.config['BACKUP_KEEP_LAST'] = int(os.environ.get('BACKUP_KEEP_LAST', 7))
+app.config['BACKUP_KEEP_DAYS'] = int(os.environ.get('BACKUP_KEEP_DAYS', 30))
+backup.init_app(app)
 
 def init_db():
-    """Initialize the database with tables"""
-    # Ensure database directory exists
-    os.makedirs('database', exist_ok=True)
-    
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    # Create users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            email TEXT,
-            role TEXT DEFAULT 'user'
-        )
-    ''')
-    
-    # Create sermons table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sermons (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            speaker TEXT NOT NULL,
-            date TEXT NOT NULL,
-            scripture TEXT,
-            description TEXT
-        )
-    ''')
-    
-    # Create events table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            description TEXT,
-            date TEXT NOT NULL,
-            time TEXT,
-            location TEXT,
-            registration_required INTEGER DEFAULT 0
-        )
-    ''')
-    
-    # Create branches table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS branches (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            address TEXT NOT NULL,
-            phone TEXT,
-            email TEXT,
-            service_times TEXT
-        )
-    ''')
-    
-    # Create daily inspiration table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS daily_inspiration (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            scripture TEXT NOT NULL,
-            quote TEXT,
-            author TEXT,
-            date TEXT UNIQUE NOT NULL
-        )
-    ''')
-    
-    # Insert default admin user if not exists
-    cursor.execute('SELECT * FROM users WHERE username = ?', ('admin',))
-    if not cursor.fetchone():
-        password_hash = hashlib.sha256('admin123'.encode()).hexdigest()
-        cursor.execute('''
-            INSERT INTO users (username, password_hash, email, role)
-            VALUES (?, ?, ?, ?)
-        ''', ('admin', password_hash, 'admin@church.com', 'admin'))
-    
-    # Insert sample data
-    insert_sample_data(cursor)
-    
-    conn.commit()
-    conn.close()
-    print(f"Database initialized successfully at {DATABASE}")
-
-def insert_sample_data(cursor):
-    """Insert sample data for demonstration"""
-    # Sample sermons
-    sample_sermons = [
-        ('The Power of Faith', 'Pastor John', '2024-01-15', 'Hebrews 11:1', 'Understanding the essence of faith'),
-        ('Love Your Neighbor', 'Pastor Sarah', '2024-01-22', 'Matthew 22:39', 'Practicing love in daily life'),
-        ('Hope in Christ', 'Pastor John', '2024-01-29', 'Romans 15:13', 'Finding hope through Jesus')
-    ]
-    
-    for sermon in sample_sermons:
-        cursor.execute('''
-            INSERT OR IGNORE INTO sermons (title, speaker, date, scripture, description)
-            VALUES (?, ?, ?, ?, ?)
-        ''', sermon)
-    
-    # Sample events
-    sample_events = [
-        ('Sunday Service', 'Weekly Sunday worship service', '2024-02-04', '09:00', 'Main Sanctuary', 0),
-        ('Bible Study', 'Weekly Bible study group', '2024-02-06', '19:00', 'Fellowship Hall', 0),
-        ('Youth Ministry', 'Youth group meeting', '2024-02-08', '18:00', 'Youth Center', 0)
-    ]
-    
-    for event in sample_events:
-        cursor.execute('''
-            INSERT OR IGNORE INTO events (title, description, date, time, location, registration_required)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', event)
-    
-    # Sample branches
-    sample_branches = [
-        ('Main Campus', '123 Church Street, City', '+1-555-0123', 'main@church.com', 'Sunday 9:00 AM, 11:00 AM'),
-        ('North Branch', '456 North Avenue, City', '+1-555-0456', 'north@church.com', 'Sunday 10:00 AM'),
-        ('South Branch', '789 South Road, City', '+1-555-0789', 'south@church.com', 'Sunday 10:30 AM')
-    ]
-    
-    for branch in sample_branches:
-        cursor.execute('''
-            INSERT OR IGNORE INTO branches (name, address, phone, email, service_times)
-            VALUES (?, ?, ?, ?, ?)
-        ''', branch)
-    
-    # Sample daily inspiration
-    sample_inspiration = [
-        ('For I know the plans I have for you, declares the Lord, plans to prosper you and not to harm you, plans to give you hope and a future.', 'Jeremiah 29:11', 'Jeremiah', '2024-02-01'),
-        ('I can do all things through Christ who strengthens me.', 'Philippians 4:13', 'Paul', '2024-02-02'),
-        ('Be strong and courageous. Do not be afraid; do not be discouraged, for the Lord your God will be with you wherever you go.', 'Joshua 1:9', 'Joshua', '2024-02-03')
-    ]
-    
-    for inspiration in sample_inspiration:
-        cursor.execute('''
-            INSERT OR IGNORE INTO daily_inspiration (scripture, quote, author, date)
-            VALUES (?, ?, ?, ?)
-        ''', inspiration)
-
-def get_db_connection():
-    """Get a database connection"""
-    # Ensure database directory exists
-    os.makedirs('database', exist_ok=True)
-    
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Bring the database schema up to date"""
+    migrations.migrate(app.config['DATABASE'])
 
 def require_admin(f):
     """Decorator to require admin access"""
@@ -166,47 +145,105 @@ def require_admin(f):
     decorated_function.__name__ = f.__name__
     return decorated_function
 
-# Initialize database when app starts
-init_db()
+@app.cli.command('check-plans')
+def check_plans_command():
+    """Fail if any query in the app sorts with a temporary B-tree"""
+    with get_pool().connection() as conn:
+        results = query_plans.check_plans(conn, query_plans.source_files(app.root_path))
+
+    failures = 0
+    for location, sql, plan, ok in results:
+        status = 'ok  ' if ok else 'FAIL'
+        print(f"{status} {location}  {sql[:70]}")
+        for detail in plan:
+            print(f"       {detail}")
+        if not ok:
+            failures += 1
+
+    print(f"{len(results)} queries checked, {failures} sorting with a temp B-tree")
+    if failures:
+        raise SystemExit(1)
+
+@app.cli.command('materialize-events')
+def materialize_events_command():
+    """Extend recurring event occurrences up to the rolling horizon"""
+    with get_pool().connection() as conn:
+        added = recurrence.extend(conn)
+    print(f"Materialized {added} event occurrences")
+
+@app.cli.command('process-images')
+@click.option('--failed', is_flag=True, help='Also retry images whose conversion failed.')
+def process_images_command(failed):
+    """Render variants for images left pending, e.g. by a restart mid-conversion"""
+    with get_pool().connection() as conn:
+        futures = images.requeue(conn, ('pending', 'failed') if failed else ('pending',))
+    for future in futures:
+        try:
+            future.result()
+        except Exception:
+            pass
+    images.get_pipeline().shutdown()
+    print(f"Processed {len(futures)} images")
+
+@app.cli.command('freeze')
+@click.option('--output', type=click.Path(file_okay=False), help='Defaults to FREEZE_FOLDER.')
+@click.option('--base-url', help='Public URL of the static site, for feed links. Defaults to SITE_URL.')
+@click.option('--full', is_flag=True, help='Re-render every page instead of only changed sections.')
+def freeze_command(output, base_url, full):
+    """Export the public pages as static files for CDN hosting"""
+    stats = freeze.freeze(app, output, base_url, full)
+    print(f"Rendered {stats['rendered']} pages ({stats['skipped_sections']} sections unchanged), "
+          f"wrote {stats['written']} files, {stats['unchanged']} identical, removed {stats['removed']}")
+
+content_io.register_commands(app)
+branch_finder.register_commands(app)
+rotation.register_commands(app)
+
+# Background tasks
+@jobs.task('search.rebuild')
+def rebuild_search_job(conn):
+    """Rebuild the full-text search indexes"""
+    search.rebuild(conn)
+
+@jobs.task('feeds.rebuild')
+def rebuild_feeds_job(conn):
+    """Re-render the sermon feed files that changed"""
+    feeds.rebuild(conn)
+
+@jobs.task('events.materialize', every=86400)
+def materialize_events_job(conn):
+    """Extend recurring event occurrences up to the rolling horizon"""
+    recurrence.extend(conn)
+
+@jobs.task('inspiration.schedule', every=86400)
+def schedule_inspiration_job(conn):
+    """Keep the daily inspiration calendar a year ahead"""
+    rotation.ensure_schedule(conn)
+
+@jobs.task('backup.create', max_attempts=3, every=app.config['BACKUP_INTERVAL'] or None)
+def backup_job(conn):
+    """Take a scheduled database snapshot"""
+    backup.create(app)
+
+jobs.register_commands(app)
+backup.register_commands(app)
+
+# Migrations run before the pool opens its first connection, so importing the app does no I/O
+get_pool(app).prepare = init_db
 
 # Routes
 @app.route('/')
+@rate_limited('listing')
+@cached('events', 'inspiration', 'sermons', daily=True)
 def index():
     """Homepage"""
-    conn = get_db_connection()
-    
-    # Get upcoming events
-    cursor = conn.execute('''
-        SELECT * FROM events 
-        WHERE date >= date('now') 
-        ORDER BY date ASC 
-        LIMIT 3
-    ''')
-    upcoming_events = cursor.fetchall()
-    
-    # Get today's inspiration
-    cursor = conn.execute('''
-        SELECT * FROM daily_inspiration 
-        WHERE date = date('now')
-    ''')
-    today_inspiration = cursor.fetchone()
-    
-    # Get recent sermons
-    cursor = conn.execute('''
-        SELECT * FROM sermons 
-        ORDER BY date DESC 
-        LIMIT 3
-    ''')
-    recent_sermons = cursor.fetchall()
-    
-    conn.close()
-    
-    return render_template('index.html', 
-                         upcoming_events=upcoming_events,
-                         today_inspiration=today_inspiration,
-                         recent_sermons=recent_sermons)
+    bundle = content_summary.homepage(get_db())
+    
+    return render_template('index.html', **bundle)
 
 @app.route('/login', methods=['GET', 'POST'])
+@rate_limited('login', methods=('POST',))
+@rate_limited('login_username', key=ratelimit.form_username, methods=('POST',))
 def login():
     """User login"""
     if request.method == 'POST':
@@ -214,11 +251,10 @@ def login():
         password = request.form.get('password', '')
         
         # Check against database
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute('SELECT id, username, password_hash, role FROM users WHERE username = ?', (username,))
         user = cursor.fetchone()
-        conn.close()
         
         if user and user[2] == hashlib.sha256(password.encode()).hexdigest():
             session['user_id'] = user[0]
@@ -243,39 +279,59 @@ def logout():
 @require_admin
 def admin_dashboard():
     """Admin dashboard main page"""
-    conn = get_db_connection()
-    
-    # Get counts for dashboard
-    cursor = conn.execute('SELECT COUNT(*) FROM sermons')
-    sermon_count = cursor.fetchone()[0]
-    
-    cursor = conn.execute('SELECT COUNT(*) FROM events')
-    event_count = cursor.fetchone()[0]
-    
-    cursor = conn.execute('SELECT COUNT(*) FROM branches')
-    branch_count = cursor.fetchone()[0]
-    
-    cursor = conn.execute('SELECT COUNT(*) FROM daily_inspiration')
-    inspiration_count = cursor.fetchone()[0]
-    
-    conn.close()
+    conn = get_db()
+    counts = content_summary.counts(conn)
     
     return render_template('admin/dashboard.html',
-                         sermon_count=sermon_count,
-                         event_count=event_count,
-                         branch_count=branch_count,
-                         inspiration_count=inspiration_count)
+                         sermon_count=counts.get('sermons', 0),
+                         event_count=counts.get('events', 0),
+                         branch_count=counts.get('branches', 0),
+                         inspiration_count=counts.get('inspiration', 0),
+                         jobs=jobs.stats(conn))
+
+@app.route('/admin/stats/db')
+@require_admin
+def admin_db_stats():
+    """Database connection pool statistics"""
+    return jsonify(get_pool().stats())
+
+@app.route('/admin/stats/cache')
+@require_admin
+def admin_cache_stats():
+    """Rendered page cache statistics"""
+    return jsonify(page_cache.get_cache().stats())
+
+@app.route('/admin/stats/jobs')
+@require_admin
+def admin_jobs_stats():
+    """Background job queue depth and latency"""
+    return jsonify(jobs.stats(get_db()))
+
+@app.route('/admin/stats/ratelimit')
+@require_admin
+def admin_ratelimit_stats():
+    """Rate limiter counters for this worker"""
+    return jsonify(ratelimit.get_limiter().stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint; addresses on METRICS_ALLOWLIST need no admin login"""
+    if request.remote_addr in app.config['METRICS_ALLOWLIST']:
+        return metrics.exposition()
+    return require_admin(metrics.exposition)()
 
 @app.route('/admin/sermons')
 @require_admin
 def admin_sermons():
     """Admin sermons management"""
-    conn = get_db_connection()
-    cursor = conn.execute('SELECT * FROM sermons ORDER BY date DESC')
-    sermons = cursor.fetchall()
-    conn.close()
+    conn = get_db()
+    page = SERMON_LISTING.page_from_request(conn)
+    if wants_json():
+        return jsonify(page.as_dict())
+    
+    totals = content_summary.totals(conn, 'sermons')
     
-    return render_template('admin/sermons.html', sermons=sermons)
+    return render_template('admin/sermons.html', sermons=page.items, page=page, totals=totals)
 
 @app.route('/admin/sermons/add', methods=['GET', 'POST'])
 @require_admin
@@ -288,15 +344,21 @@ def admin_add_sermon():
         scripture = request.form['scripture']
         description = request.form['description']
         
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute('''
             INSERT INTO sermons (title, speaker, date, scripture, description)
             VALUES (?, ?, ?, ?, ?)
         ''', (title, speaker, date, scripture, description))
+        sermon_id = cursor.lastrowid
+        attached, errors = media.attach_all(conn, sermon_id, request.files.getlist('media'))
+        picture, error = images.save_upload(conn, 'sermons', sermon_id, request.files.get('image'))
         conn.commit()
-        conn.close()
+        images.process(conn, picture)
+        jobs.enqueue(conn, 'feeds.rebuild', dedupe_key='feeds.rebuild')
         
+        for error in errors + ([error] if error else []):
+            flash(error, 'error')
         flash('Sermon added successfully!', 'success')
         return redirect(url_for('admin_sermons'))
     
@@ -306,7 +368,7 @@ def admin_add_sermon():
 @require_admin
 def admin_edit_sermon(id):
     """Edit sermon"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     
     if request.method == 'POST':
@@ -320,45 +382,74 @@ def admin_edit_sermon(id):
             UPDATE sermons SET title=?, speaker=?, date=?, scripture=?, description=?
             WHERE id=?
         ''', (title, speaker, date, scripture, description, id))
+        attached, errors = media.attach_all(conn, id, request.files.getlist('media'))
+        picture, error = images.save_upload(conn, 'sermons', id, request.files.get('image'))
         conn.commit()
-        conn.close()
+        images.process(conn, picture)
+        jobs.enqueue(conn, 'feeds.rebuild', dedupe_key='feeds.rebuild')
         
+        for error in errors + ([error] if error else []):
+            flash(error, 'error')
         flash('Sermon updated successfully!', 'success')
         return redirect(url_for('admin_sermons'))
     
     cursor.execute('SELECT * FROM sermons WHERE id = ?', (id,))
     sermon = cursor.fetchone()
-    conn.close()
     
     if not sermon:
         flash('Sermon not found', 'error')
         return redirect(url_for('admin_sermons'))
     
-    return render_template('admin/edit_sermon.html', sermon=sermon)
+    attachments = media.for_sermons(conn, [id]).get(id, [])
+    return render_template('admin/edit_sermon.html', sermon=sermon, attachments=attachments)
 
 @app.route('/admin/sermons/delete/<int:id>')
 @require_admin
 def admin_delete_sermon(id):
     """Delete sermon"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
+    hashes = media.hashes_for_sermon(conn, id)
+    image_hashes = images.hashes_for(conn, 'sermons', id)
     cursor.execute('DELETE FROM sermons WHERE id = ?', (id,))
     conn.commit()
-    conn.close()
+    media.prune(conn, hashes)
+    images.prune(conn, image_hashes)
+    jobs.enqueue(conn, 'feeds.rebuild', dedupe_key='feeds.rebuild')
     
     flash('Sermon deleted successfully!', 'success')
     return redirect(url_for('admin_sermons'))
 
+@app.route('/admin/media/delete/<int:id>')
+@require_admin
+def admin_delete_media(id):
+    """Remove a sermon attachment"""
+    conn = get_db()
+    item = conn.execute('SELECT sermon_id, sha256 FROM sermon_media WHERE id = ?', (id,)).fetchone()
+    if not item:
+        flash('File not found', 'error')
+        return redirect(url_for('admin_sermons'))
+    
+    conn.execute('DELETE FROM sermon_media WHERE id = ?', (id,))
+    conn.commit()
+    media.prune(conn, [item['sha256']])
+    jobs.enqueue(conn, 'feeds.rebuild', dedupe_key='feeds.rebuild')
+    
+    flash('File removed successfully!', 'success')
+    return redirect(url_for('admin_edit_sermon', id=item['sermon_id']))
+
 @app.route('/admin/events')
 @require_admin
 def admin_events():
     """Admin events management"""
-    conn = get_db_connection()
-    cursor = conn.execute('SELECT * FROM events ORDER BY date ASC')
-    events = cursor.fetchall()
-    conn.close()
+    conn = get_db()
+    page = EVENT_LISTING.page_from_request(conn)
+    if wants_json():
+        return jsonify(page.as_dict())
+    
+    totals = content_summary.totals(conn, 'events')
     
-    return render_template('admin/events.html', events=events)
+    return render_template('admin/events.html', events=page.items, page=page, totals=totals)
 
 @app.route('/admin/events/add', methods=['GET', 'POST'])
 @require_admin
@@ -371,16 +462,23 @@ def admin_add_event():
         time = request.form['time']
         location = request.form['location']
         registration_required = 1 if request.form.get('registration_required') else 0
+        rule, exceptions = recurrence.form_values(request.form)
         
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT INTO events (title, description, date, time, location, registration_required)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (title, description, date, time, location, registration_required))
+            INSERT INTO events (title, description, date, time, location, registration_required,
+                                recurrence, recurrence_interval, recurrence_until)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (title, description, date, time, location, registration_required,
+              rule['recurrence'], rule['recurrence_interval'], rule['recurrence_until']))
+        recurrence.sync_event(conn, cursor.lastrowid, exceptions)
+        picture, error = images.save_upload(conn, 'events', cursor.lastrowid, request.files.get('image'))
         conn.commit()
-        conn.close()
+        images.process(conn, picture)
         
+        if error:
+            flash(error, 'error')
         flash('Event added successfully!', 'success')
         return redirect(url_for('admin_events'))
     
@@ -390,7 +488,7 @@ def admin_add_event():
 @require_admin
 def admin_edit_event(id):
     """Edit event"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     
     if request.method == 'POST':
@@ -400,36 +498,46 @@ def admin_edit_event(id):
         time = request.form['time']
         location = request.form['location']
         registration_required = 1 if request.form.get('registration_required') else 0
+        rule, exceptions = recurrence.form_values(request.form)
         
         cursor.execute('''
-            UPDATE events SET title=?, description=?, date=?, time=?, location=?, registration_required=?
+            UPDATE events SET title=?, description=?, date=?, time=?, location=?, registration_required=?,
+                              recurrence=?, recurrence_interval=?, recurrence_until=?
             WHERE id=?
-        ''', (title, description, date, time, location, registration_required, id))
+        ''', (title, description, date, time, location, registration_required,
+              rule['recurrence'], rule['recurrence_interval'], rule['recurrence_until'], id))
+        recurrence.sync_event(conn, id, exceptions)
+        picture, error = images.save_upload(conn, 'events', id, request.files.get('image'))
         conn.commit()
-        conn.close()
+        images.process(conn, picture)
         
+        if error:
+            flash(error, 'error')
         flash('Event updated successfully!', 'success')
         return redirect(url_for('admin_events'))
     
     cursor.execute('SELECT * FROM events WHERE id = ?', (id,))
     event = cursor.fetchone()
-    conn.close()
     
     if not event:
         flash('Event not found', 'error')
         return redirect(url_for('admin_events'))
     
-    return render_template('admin/edit_event.html', event=event)
+    cursor.execute('SELECT date FROM event_exceptions WHERE event_id = ? ORDER BY date', (id,))
+    exceptions = ', '.join(row['date'] for row in cursor.fetchall())
+    
+    return render_template('admin/edit_event.html', event=event, exceptions=exceptions)
 
 @app.route('/admin/events/delete/<int:id>')
 @require_admin
 def admin_delete_event(id):
     """Delete event"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
+    image_hashes = images.hashes_for(conn, 'events', id)
     cursor.execute('DELETE FROM events WHERE id = ?', (id,))
     conn.commit()
-    conn.close()
+    images.prune(conn, image_hashes)
     
     flash('Event deleted successfully!', 'success')
     return redirect(url_for('admin_events'))
@@ -438,12 +546,11 @@ def admin_delete_event(id):
 @require_admin
 def admin_branches():
     """Admin branches management"""
-    conn = get_db_connection()
-    cursor = conn.execute('SELECT * FROM branches')
-    branches = cursor.fetchall()
-    conn.close()
+    page = BRANCH_LISTING.page_from_request(get_db())
+    if wants_json():
+        return jsonify(page.as_dict())
     
-    return render_template('admin/branches.html', branches=branches)
+    return render_template('admin/branches.html', branches=page.items, page=page)
 
 @app.route('/admin/branches/add', methods=['GET', 'POST'])
 @require_admin
@@ -455,16 +562,22 @@ def admin_add_branch():
         phone = request.form['phone']
         email = request.form['email']
         service_times = request.form['service_times']
+        latitude, longitude, location_error = branch_finder.form_coordinates(request.form)
         
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT INTO branches (name, address, phone, email, service_times)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (name, address, phone, email, service_times))
+            INSERT INTO branches (name, address, phone, email, service_times, latitude, longitude)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (name, address, phone, email, service_times, latitude, longitude))
+        branch_finder.sync_branch(conn, cursor.lastrowid)
+        picture, error = images.save_upload(conn, 'branches', cursor.lastrowid, request.files.get('image'))
         conn.commit()
-        conn.close()
+        images.process(conn, picture)
         
+        for message in (location_error, error):
+            if message:
+                flash(message, 'error')
         flash('Branch added successfully!', 'success')
         return redirect(url_for('admin_branches'))
     
@@ -474,7 +587,7 @@ def admin_add_branch():
 @require_admin
 def admin_edit_branch(id):
     """Edit branch"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     
     if request.method == 'POST':
@@ -483,20 +596,27 @@ def admin_edit_branch(id):
         phone = request.form['phone']
         email = request.form['email']
         service_times = request.form['service_times']
+        latitude, longitude, location_error = branch_finder.form_coordinates(request.form)
         
         cursor.execute('''
             UPDATE branches SET name=?, address=?, phone=?, email=?, service_times=?
             WHERE id=?
         ''', (name, address, phone, email, service_times, id))
+        if not location_error:
+            cursor.execute('UPDATE branches SET latitude=?, longitude=? WHERE id=?', (latitude, longitude, id))
+        branch_finder.sync_branch(conn, id)
+        picture, error = images.save_upload(conn, 'branches', id, request.files.get('image'))
         conn.commit()
-        conn.close()
+        images.process(conn, picture)
         
+        for message in (location_error, error):
+            if message:
+                flash(message, 'error')
         flash('Branch updated successfully!', 'success')
         return redirect(url_for('admin_branches'))
     
     cursor.execute('SELECT * FROM branches WHERE id = ?', (id,))
     branch = cursor.fetchone()
-    conn.close()
     
     if not branch:
         flash('Branch not found', 'error')
@@ -508,11 +628,12 @@ def admin_edit_branch(id):
 @require_admin
 def admin_delete_branch(id):
     """Delete branch"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
+    image_hashes = images.hashes_for(conn, 'branches', id)
     cursor.execute('DELETE FROM branches WHERE id = ?', (id,))
     conn.commit()
-    conn.close()
+    images.prune(conn, image_hashes)
     
     flash('Branch deleted successfully!', 'success')
     return redirect(url_for('admin_branches'))
@@ -521,12 +642,11 @@ def admin_delete_branch(id):
 @require_admin
 def admin_inspiration():
     """Admin daily inspiration management"""
-    conn = get_db_connection()
-    cursor = conn.execute('SELECT * FROM daily_inspiration ORDER BY date DESC')
-    inspirations = cursor.fetchall()
-    conn.close()
+    page = INSPIRATION_LISTING.page_from_request(get_db())
+    if wants_json():
+        return jsonify(page.as_dict())
     
-    return render_template('admin/inspiration.html', inspirations=inspirations)
+    return render_template('admin/inspiration.html', inspirations=page.items, page=page)
 
 @app.route('/admin/inspiration/add', methods=['GET', 'POST'])
 @require_admin
@@ -538,14 +658,14 @@ def admin_add_inspiration():
         author = request.form['author']
         date = request.form['date']
         
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute('''
             INSERT INTO daily_inspiration (scripture, quote, author, date)
             VALUES (?, ?, ?, ?)
         ''', (scripture, quote, author, date))
         conn.commit()
-        conn.close()
+        jobs.enqueue(conn, 'inspiration.schedule', dedupe_key='inspiration.schedule')
         
         flash('Daily inspiration added successfully!', 'success')
         return redirect(url_for('admin_inspiration'))
@@ -556,7 +676,7 @@ def admin_add_inspiration():
 @require_admin
 def admin_edit_inspiration(id):
     """Edit daily inspiration"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     
     if request.method == 'POST':
@@ -570,14 +690,13 @@ def admin_edit_inspiration(id):
             WHERE id=?
         ''', (scripture, quote, author, date, id))
         conn.commit()
-        conn.close()
+        jobs.enqueue(conn, 'inspiration.schedule', dedupe_key='inspiration.schedule')
         
         flash('Daily inspiration updated successfully!', 'success')
         return redirect(url_for('admin_inspiration'))
     
     cursor.execute('SELECT * FROM daily_inspiration WHERE id = ?', (id,))
     inspiration = cursor.fetchone()
-    conn.close()
     
     if not inspiration:
         flash('Daily inspiration not found', 'error')
@@ -589,58 +708,248 @@ def admin_edit_inspiration(id):
 @require_admin
 def admin_delete_inspiration(id):
     """Delete daily inspiration"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('DELETE FROM daily_inspiration WHERE id = ?', (id,))
     conn.commit()
-    conn.close()
+    jobs.enqueue(conn, 'inspiration.schedule', dedupe_key='inspiration.schedule')
     
     flash('Daily inspiration deleted successfully!', 'success')
     return redirect(url_for('admin_inspiration'))
 
+@app.route('/search')
+@rate_limited('listing')
+@cached('sermons', 'events', 'inspiration')
+def site_search():
+    """Full-text search across sermons, events and daily inspiration"""
+    query = request.args.get('q', '').strip()
+    kind = request.args.get('type', '')
+    kinds = [kind] if kind in search.SOURCES else None
+    number = pagination.page_number()
+    per_page = pagination.page_size()
+    
+    results, has_more = search.search(get_db(), query, kinds, number, per_page)
+    results = [dict(row, snippet=search.highlight(row['snippet'])) for row in results]
+    page = OffsetPage(results, per_page, number, has_more)
+    
+    if wants_json():
+        return jsonify({
+            'query': query,
+            'items': [dict(item, snippet=str(item['snippet'])) for item in results],
+            'per_page': per_page,
+            'next': page.next_url,
+            'prev': page.prev_url,
+        })
+    
+    return render_template('search.html', query=query, kind=kind, results=results,
+                           page=page, sources=search.SOURCES)
+
+@app.route('/admin/search/rebuild', methods=['POST'])
+@require_admin
+def admin_rebuild_search():
+    """Queue a rebuild of the full-text search indexes, e.g. after a bulk import"""
+    jobs.enqueue(get_db(), 'search.rebuild', dedupe_key='search.rebuild')
+    
+    flash('Search index rebuild queued', 'success')
+    return redirect(url_for('admin_dashboard'))
+
 @app.route('/sermons')
+@rate_limited('listing')
+@cached('sermons')
 def sermons():
     """Sermon archives"""
-    conn = get_db_connection()
-    cursor = conn.execute('SELECT * FROM sermons ORDER BY date DESC')
-    sermons = cursor.fetchall()
-    conn.close()
+    conn = get_db()
+    page = SERMON_LISTING.page_from_request(conn)
+    if wants_json():
+        return jsonify(page.as_dict())
+    
+    ids = [sermon['id'] for sermon in page.items]
+    return streaming.render_listing('sermons.html', page.items, sermons=page.items, page=page,
+                                    attachments=media.for_sermons(conn, ids),
+                                    pictures=images.for_owners(conn, 'sermons', ids))
+
+@app.route('/sermons/feed.xml')
+def sermon_feed():
+    """Podcast RSS feed of the latest sermons"""
+    return feeds.serve(get_db(), 'rss')
+
+@app.route('/sermons/feed/<int:page>.xml')
+def sermon_feed_archive(page):
+    """Older sermons as paged RSS archives"""
+    return feeds.serve(get_db(), 'rss', page)
+
+@app.route('/sermons/atom.xml')
+def sermon_atom():
+    """Atom feed of the latest sermons"""
+    return feeds.serve(get_db(), 'atom')
+
+@app.route('/sermons/atom/<int:page>.xml')
+def sermon_atom_archive(page):
+    """Older sermons as paged Atom archives"""
+    return feeds.serve(get_db(), 'atom', page)
+
+@app.route('/media/<int:id>')
+def sermon_media(id):
+    """Serve a sermon attachment; Range requests let players seek without a full download"""
+    item = get_db().execute('SELECT * FROM sermon_media WHERE id = ?', (id,)).fetchone()
+    if not item:
+        abort(404)
+    
+    path = media.blob_path(item['sha256'])
+    if not os.path.exists(path):
+        abort(404)
+    
+    return send_file(path, mimetype=item['mime_type'], download_name=item['filename'],
+                     as_attachment='download' in request.args, conditional=True,
+                     etag=item['sha256'], max_age=media.MAX_AGE)
+
+@app.route('/images/<sha256>')
+@app.route('/images/<sha256>/<int:width>.<any(webp, jpeg):fmt>')
+def image_file(sha256, width=None, fmt=None):
+    """Serve an uploaded original or one of its resized variants"""
+    if not images.is_digest(sha256):
+        abort(404)
+    
+    if width is None:
+        item = get_db().execute('SELECT mime_type FROM images WHERE sha256 = ? LIMIT 1', (sha256,)).fetchone()
+        if not item:
+            abort(404)
+        path, mimetype = media.blob_path(sha256), item['mime_type']
+    else:
+        path, mimetype = images.variant_path(images.variants_folder(), sha256, width, fmt), images.FORMATS[fmt][2]
     
-    return render_template('sermons.html', sermons=sermons)
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(path, mimetype=mimetype, conditional=True, max_age=media.MAX_AGE)
+
+@app.route('/static/dist/<path:filename>')
+def static_asset(filename):
+    """Serve a fingerprinted bundle; its name changes with its content, so it is cached for good"""
+    return assets.serve(filename)
 
 @app.route('/events')
+@rate_limited('listing')
+@cached('events', daily=True)
 def events():
-    """Church events"""
-    conn = get_db_connection()
-    cursor = conn.execute('SELECT * FROM events ORDER BY date ASC')
-    events = cursor.fetchall()
-    conn.close()
-    
-    return render_template('events.html', events=events)
+    """Upcoming church events, one entry per occurrence"""
+    conn = get_db()
+    recurrence.ensure_horizon(conn)
+    page = OCCURRENCE_LISTING.page_from_request(conn)
+    if wants_json():
+        return jsonify(page.as_dict())
+    
+    pictures = images.for_owners(conn, 'events', {event['id'] for event in page.items})
+    return streaming.render_listing('events.html', page.items, events=page.items, page=page, pictures=pictures)
+
+@app.route('/api/events')
+@rate_limited('listing')
+@cached('events', max_age=300)
+def api_events():
+    """Event occurrences in a date window, for the calendar"""
+    start = recurrence.parse_date(request.args.get('from'))
+    end = recurrence.parse_date(request.args.get('to'))
+    if not start or not end or end < start:
+        return jsonify({'error': 'from and to must be ISO dates with from <= to'}), 400
+    if (end - start).days > app.config['API_MAX_WINDOW_DAYS']:
+        return jsonify({'error': f"window is limited to {app.config['API_MAX_WINDOW_DAYS']} days"}), 400
+    
+    # Read-only: the events.materialize job extends occurrences, so no visitor's GET writes
+    horizon = recurrence.horizon_end()
+    cursor = get_db().execute('''
+        SELECT id, date, title, time, location, registration_required
+        FROM event_occurrence_details
+        WHERE date BETWEEN ? AND ?
+        ORDER BY date ASC, id ASC
+    ''', (start.isoformat(), min(end, horizon).isoformat()))
+    
+    return jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'horizon': horizon.isoformat(),
+        'events': [dict(row) for row in cursor],
+    })
 
 @app.route('/branches')
+@rate_limited('listing')
+@cached('branches')
 def branches():
     """Branch information"""
-    conn = get_db_connection()
-    cursor = conn.execute('SELECT * FROM branches')
-    branches = cursor.fetchall()
-    conn.close()
-    
-    return render_template('branches.html', branches=branches)
+    conn = get_db()
+    page = BRANCH_LISTING.page_from_request(conn)
+    if wants_json():
+        return jsonify(page.as_dict())
+    
+    pictures = images.for_owners(conn, 'branches', [branch['id'] for branch in page.items])
+    return streaming.render_listing('branches.html', page.items, branches=page.items, page=page,
+                                    pictures=pictures)
+
+@app.route('/branches/near')
+@rate_limited('listing')
+def branches_near():
+    """Branches nearest to lat/lon, optionally only those with a service on a day between from and to"""
+    lat = branch_finder.parse_coordinate(request.args.get('lat'), 90)
+    lon = branch_finder.parse_coordinate(request.args.get('lon'), 180)
+    if lat is None or lon is None:
+        return jsonify({'error': 'lat and lon must be decimal degrees'}), 400
+    try:
+        day, start, end = branch_finder.parse_window(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    count = min(max(request.args.get('k', branch_finder.DEFAULT_NEAREST, type=int), 1), branch_finder.MAX_NEAREST)
+    
+    return jsonify({
+        'lat': lat,
+        'lon': lon,
+        'branches': branch_finder.nearest(get_db(), lat, lon, count, day, start, end),
+    })
+
+@app.route('/branches/services')
+@rate_limited('listing')
+@cached('branches', max_age=300)
+def branches_services():
+    """Services by day and time, e.g. ?day=sunday&from=9am&to=noon"""
+    try:
+        day, start, end = branch_finder.parse_window(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = min(max(request.args.get('limit', branch_finder.DEFAULT_SERVICES_LIMIT, type=int), 1),
+                branch_finder.MAX_SERVICES_LIMIT)
+    
+    return jsonify({
+        'day': branch_finder.DAY_NAMES[day] if day is not None else None,
+        'from': branch_finder.format_clock(start),
+        'to': branch_finder.format_clock(end),
+        'services': branch_finder.services(get_db(), day, start, end, limit),
+    })
 
 @app.route('/inspiration')
+@rate_limited('listing')
+@cached('inspiration', daily=True)
 def inspiration():
     """Daily biblical inspiration"""
-    conn = get_db_connection()
-    cursor = conn.execute('SELECT * FROM daily_inspiration ORDER BY date DESC')
-    inspirations = cursor.fetchall()
-    conn.close()
-    
-    return render_template('inspiration.html', inspirations=inspirations)
+    conn = get_db()
+    today = rotation.today(conn)
+    page = INSPIRATION_ARCHIVE_LISTING.page_from_request(conn)
+    if wants_json():
+        return jsonify(page.as_dict())
+    
+    return render_template('inspiration.html', today_inspiration=today, inspirations=page.items, page=page)
+
+def create_app(warm_up=None):
+    """WSGI entry point for workers, e.g. gunicorn 'app:create_app()'
+
+    Installs the shared template bytecode cache and, with WARM_UP, compiles
+    every template and opens the database connections before the worker
+    takes its first request.
+    """
+    warmup.install_bytecode_cache(app)
+    if app.config['WARM_UP'] if warm_up is None else warm_up:
+        warmup.warm_up(app)
+    return app
 
 if __name__ == '__main__':
     # Ensure uploads directory exists
-    os.makedirs('uploads', exist_ok=True)
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     
     print("Church Website is running!")
     print("Default admin credentials: username: admin, password: admin123")
@@ -654,4 +963,4 @@ if __name__ == '__main__':
         pass
     else:
         # Development environment - run locally
-        app.run(debug=True, host='0.0.0.0', port=5000)
+        create_app().run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,184 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+
+import click
+from flask import abort, current_app, request, send_file, url_for
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; .gz siblings are always written
+    brotli = None
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+# Hashed names never change content, so browsers need not revalidate them
+MAX_AGE = 365 * 24 * 3600
+
+# Bundle name -> source files under static/, in page order
+BUNDLES = {
+    'css/site.css': ('css/style.css', 'css/responsive.css'),
+    'js/site.js': ('js/main.js', 'js/auth.js'),
+}
+
+MIMETYPES = {'.css': 'text/css', '.js': 'text/javascript'}
+
+# Precompressed siblings, best first: Accept-Encoding token -> file suffix
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+CSS_STRING_RE = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')''')
+CSS_COMMENT_RE = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|/\*.*?\*/''', re.S)
+CSS_PUNCTUATION_RE = re.compile(r'\s*([{};,])\s*|(:)\s+')
+
+
+def hashed_name(name, data):
+    """`css/site.css` -> `css/site.<sha1 prefix>.css`"""
+    stem, extension = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha1(data).hexdigest()[:10]}{extension}'
+
+
+def minify_css(text):
+    """Drop comments and collapse whitespace, leaving quoted strings alone"""
+    text = CSS_COMMENT_RE.sub(lambda match: match.group(1) or '', text)
+    # Splitting on a capturing group leaves the strings at the odd indexes
+    parts = CSS_STRING_RE.split(text)
+    for i in range(0, len(parts), 2):
+        parts[i] = CSS_PUNCTUATION_RE.sub(lambda match: match.group(1) or match.group(2), re.sub(r'\s+', ' ', parts[i]))
+    return ''.join(parts).replace(';}', '}').strip()
+
+
+def minify_js(text):
+    """Strip indentation, blank lines and whole-line comments; no renaming, so no parser needed"""
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+
+def _bundle(static_folder, name, sources):
+    minify = minify_css if name.endswith('.css') else minify_js
+    chunks = []
+    for source in sources:
+        with open(os.path.join(static_folder, source), encoding='utf-8') as f:
+            chunks.append(minify(f.read()))
+    # A separate statement per file, as if each were its own <script>
+    return ('\n' if name.endswith('.css') else ';\n').join(chunks).encode('utf-8')
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def _load_manifest(folder):
+    try:
+        with open(os.path.join(folder, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def build(static_folder):
+    """Write minified, hashed bundles with .gz/.br siblings; returns the new manifest"""
+    out = os.path.join(static_folder, DIST)
+    previous = _load_manifest(out)
+    manifest = {}
+    for name, sources in BUNDLES.items():
+        data = _bundle(static_folder, name, sources)
+        hashed = hashed_name(name, data)
+        manifest[name] = hashed
+        path = os.path.join(out, hashed)
+        if os.path.exists(path):
+            continue
+        _write(path, data)
+        _write(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write(path + '.br', brotli.compress(data, quality=11))
+
+    _write(os.path.join(out, MANIFEST), json.dumps(manifest, indent=1, sort_keys=True).encode())
+
+    # Keep the previous build too, for pages still cached with its names
+    keep = set(manifest.values()) | set(previous.values())
+    for root, _, files in os.walk(out):
+        for file in files:
+            relative = os.path.relpath(os.path.join(root, file), out).replace(os.sep, '/')
+            base = relative.removesuffix('.gz').removesuffix('.br')
+            if relative != MANIFEST and base not in keep:
+                os.remove(os.path.join(root, file))
+    return manifest
+
+
+def get_manifest():
+    manifest = current_app.extensions['assets']
+    if manifest is None:
+        # Read on first use, so importing the app stays free of file I/O
+        manifest = current_app.extensions['assets'] = _load_manifest(os.path.join(current_app.static_folder, DIST))
+    return manifest
+
+
+def asset_url(filename, **values):
+    """Like url_for('static', filename=...), but resolves built bundles to their hashed names"""
+    hashed = get_manifest().get(filename)
+    if hashed:
+        return url_for('static_asset', filename=hashed, **values)
+    return url_for('static', filename=filename, **values)
+
+
+def asset_urls(bundle):
+    """The hashed bundle, or its separate source files when `flask assets build` hasn't run"""
+    if bundle in get_manifest():
+        return [asset_url(bundle)]
+    return [url_for('static', filename=source) for source in BUNDLES[bundle]]
+
+
+def serve(filename):
+    """Send a hashed bundle, picking the precompressed sibling the client accepts"""
+    folder = os.path.join(current_app.static_folder, DIST)
+    path = os.path.join(folder, filename)
+    if filename == MANIFEST or '..' in filename.split('/') or not os.path.isfile(path):
+        abort(404)
+
+    encoding = None
+    for token, suffix in ENCODINGS:
+        if request.accept_encodings[token] and os.path.isfile(path + suffix):
+            encoding, path = token, path + suffix
+            break
+
+    mimetype = MIMETYPES.get(os.path.splitext(filename)[1], 'application/octet-stream')
+    response = send_file(path, mimetype=mimetype, conditional=True, max_age=MAX_AGE,
+                         etag=f'{filename}:{encoding or "identity"}')
+    response.cache_control.immutable = True
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.content_encoding = encoding
+    return response
+
+
+def register_commands(app):
+    """Add the `flask assets build` command"""
+
+    @app.cli.group('assets')
+    def assets():
+        """Static asset bundles"""
+
+    @assets.command('build')
+    def build_command():
+        """Minify and fingerprint the CSS/JS bundles into static/dist"""
+        manifest = build(app.static_folder)
+        app.extensions['assets'] = manifest
+        for name, hashed in sorted(manifest.items()):
+            path = os.path.join(app.static_folder, DIST, hashed)
+            sizes = [f'{os.path.getsize(path):,} B']
+            for token, suffix in ENCODINGS:
+                if os.path.exists(path + suffix):
+                    sizes.append(f'{token} {os.path.getsize(path + suffix):,} B')
+            click.echo(f'{name} -> {DIST}/{hashed} ({", ".join(sizes)})')
+
+
+def init_app(app):
+    app.extensions['assets'] = None
+    app.jinja_env.globals.update(asset_url=asset_url, asset_urls=asset_urls)
+    register_commands(app)
@@ -0,0 +1,353 @@
+import glob
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import current_app
+
+import db
+import migrations
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows development machines
+    fcntl = None
+
+# Pages copied per backup step, and the pause between steps that lets other connections in
+DEFAULT_PAGES_PER_STEP = 512
+DEFAULT_STEP_PAUSE = 0.01
+# Writes between steps restart a stepped copy; after this many, copy the rest in one step
+MAX_RESTARTS = 3
+DEFAULT_KEEP_LAST = 7
+DEFAULT_KEEP_DAYS = 30
+DEFAULT_INTERVAL = 86400
+PREFIX = 'database-'
+CHUNK_SIZE = 1024 * 1024
+
+
+class _Restarting(Exception):
+    pass
+
+
+@contextmanager
+def _backup_lock(folder):
+    """Cross-process lock so scheduled and manual backups don't overlap"""
+    with open(os.path.join(folder, '.backup.lock'), 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def backup_folder(app=None):
+    app = app or current_app
+    return app.config['BACKUP_FOLDER']
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_json(path, data):
+    temp_path = path + '.partial'
+    with open(temp_path, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(temp_path, path)
+
+
+def copy_database(source, target, pages=DEFAULT_PAGES_PER_STEP, pause=DEFAULT_STEP_PAUSE):
+    """Online copy of the source connection's database in small steps; returns (steps, restarts)
+
+    No lock is held between steps, so the site reads and writes as usual; a
+    write from another connection makes SQLite start the copy over.
+    """
+    counts = {'steps': 0, 'restarts': 0, 'remaining': None}
+
+    def progress(status, remaining, total):
+        counts['steps'] += 1
+        if counts['remaining'] is not None and remaining >= counts['remaining']:
+            counts['restarts'] += 1
+            if counts['restarts'] > MAX_RESTARTS:
+                raise _Restarting
+        counts['remaining'] = remaining
+        time.sleep(pause)
+
+    try:
+        source.backup(target, pages=pages, progress=progress)
+    except _Restarting:
+        # In WAL mode a single step is one read transaction: writers carry on, only checkpoints wait
+        source.backup(target, pages=-1)
+        counts['steps'] += 1
+    return counts['steps'], counts['restarts']
+
+
+def create(app=None, folder=None, pages=None, pause=None, label=None, keep=None):
+    """Write a compressed, checksummed snapshot of the live database; returns its manifest"""
+    app = app or current_app
+    folder = folder or backup_folder(app)
+    pages = pages or app.config['BACKUP_PAGES_PER_STEP']
+    pause = app.config['BACKUP_STEP_PAUSE'] if pause is None else pause
+    os.makedirs(folder, exist_ok=True)
+
+    with _backup_lock(folder):
+        for stale in glob.glob(os.path.join(folder, '*.partial')):
+            os.remove(stale)
+        created = datetime.now(timezone.utc)
+        stamp = PREFIX + created.strftime('%Y%m%dT%H%M%SZ') + (f'-{label}' if label else '')
+        name, n = stamp, 1
+        while os.path.exists(os.path.join(folder, name + '.json')):
+            n += 1
+            name = f'{stamp}-{n}'
+        raw_path = os.path.join(folder, name + '.db.partial')
+        started = time.perf_counter()
+
+        source = db.connect(app.config['DATABASE'])
+        target = sqlite3.connect(raw_path)
+        try:
+            steps, restarts = copy_database(source, target, pages, pause)
+            copied = time.perf_counter()
+            # A snapshot is one self-contained file, not a WAL database
+            target.execute('PRAGMA journal_mode=DELETE')
+            check = target.execute('PRAGMA integrity_check').fetchone()[0]
+            if check != 'ok':
+                raise ValueError(f'{name}: integrity check failed: {check}')
+            page_size = target.execute('PRAGMA page_size').fetchone()[0]
+            page_count = target.execute('PRAGMA page_count').fetchone()[0]
+            schema_version = migrations.current_version(target)
+        finally:
+            target.close()
+            source.close()
+
+        snapshot_path = os.path.join(folder, name + '.db.gz')
+        digest = hashlib.sha256()
+        with open(raw_path, 'rb') as raw, gzip.open(snapshot_path + '.partial', 'wb', compresslevel=6) as out:
+            for chunk in iter(lambda: raw.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                out.write(chunk)
+        os.replace(snapshot_path + '.partial', snapshot_path)
+        manifest = {
+            'name': name,
+            'file': os.path.basename(snapshot_path),
+            'created': created.isoformat(timespec='seconds'),
+            'schema_version': schema_version,
+            'page_size': page_size,
+            'pages': page_count,
+            'size': os.path.getsize(raw_path),
+            'compressed_size': os.path.getsize(snapshot_path),
+            'sha256': digest.hexdigest(),
+            'file_sha256': _sha256(snapshot_path),
+            'steps': steps,
+            'restarts': restarts,
+            'copy_seconds': round(copied - started, 3),
+            'seconds': round(time.perf_counter() - started, 3),
+        }
+        os.remove(raw_path)
+        # The manifest goes last: a snapshot without one is incomplete and never listed
+        _write_json(os.path.join(folder, name + '.json'), manifest)
+        manifest['removed'] = prune(folder, app.config['BACKUP_KEEP_LAST'], app.config['BACKUP_KEEP_DAYS'],
+                                    keep=[keep] if keep else ())
+
+    app.logger.info('Backup %s: %d pages in %d steps (%d restarts), copy %.2f s, total %.2f s, %d -> %d bytes',
+                    name, page_count, steps, restarts, manifest['copy_seconds'], manifest['seconds'],
+                    manifest['size'], manifest['compressed_size'])
+    return manifest
+
+
+def snapshots(folder):
+    """Manifests of complete snapshots, newest first"""
+    found = []
+    for path in glob.glob(os.path.join(folder, PREFIX + '*.json')):
+        with open(path) as f:
+            found.append(json.load(f))
+    return sorted(found, key=lambda manifest: (manifest['created'], manifest['name']), reverse=True)
+
+
+def prune(folder, keep_last=DEFAULT_KEEP_LAST, keep_days=DEFAULT_KEEP_DAYS, now=None, keep=()):
+    """Keep the newest keep_last snapshots and the newest of each day for keep_days; returns the names removed"""
+    now = now or datetime.now(timezone.utc)
+    cutoff = (now - timedelta(days=keep_days)).date().isoformat()
+    keep, days = set(keep), set()
+    found = snapshots(folder)
+    for manifest in found[:keep_last]:
+        keep.add(manifest['name'])
+    for manifest in found:
+        day = manifest['created'][:10]
+        if day >= cutoff and day not in days:
+            days.add(day)
+            keep.add(manifest['name'])
+
+    removed = []
+    for manifest in found:
+        if manifest['name'] not in keep:
+            for path in (os.path.join(folder, manifest['file']), os.path.join(folder, manifest['name'] + '.json')):
+                if os.path.exists(path):
+                    os.remove(path)
+            removed.append(manifest['name'])
+    return removed
+
+
+def find(folder, name=None):
+    """Manifest for a snapshot name (or file name), or the newest one"""
+    found = snapshots(folder)
+    if name is None:
+        if not found:
+            raise ValueError(f'no snapshots in {folder}')
+        return found[0]
+    for manifest in found:
+        if name in (manifest['name'], manifest['file']):
+            return manifest
+    raise ValueError(f'no snapshot named {name!r}')
+
+
+def extract(folder, manifest, target):
+    """Decompress a snapshot to target, checking both checksums and the database's integrity"""
+    path = os.path.join(folder, manifest['file'])
+    if _sha256(path) != manifest['file_sha256']:
+        raise ValueError(f"{manifest['name']}: compressed file checksum mismatch")
+    digest = hashlib.sha256()
+    with gzip.open(path, 'rb') as source, open(target, 'wb') as out:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            out.write(chunk)
+    if digest.hexdigest() != manifest['sha256']:
+        raise ValueError(f"{manifest['name']}: database checksum mismatch")
+    conn = sqlite3.connect(target)
+    try:
+        check = conn.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        conn.close()
+    if check != 'ok':
+        raise ValueError(f"{manifest['name']}: integrity check failed: {check}")
+
+
+def verify(folder, manifest):
+    """Check a snapshot end to end without touching the live database"""
+    target = os.path.join(folder, manifest['name'] + '.verify.tmp')
+    try:
+        extract(folder, manifest, target)
+    finally:
+        if os.path.exists(target):
+            os.remove(target)
+
+
+def restore(app, name=None, folder=None):
+    """Replace the live database with a verified snapshot, online; returns (restored, safety) manifests
+
+    The current database is backed up first. Pages are copied into the live
+    file through SQLite, so open connections see the restored data as soon
+    as the copy commits. Content generations move past every value served
+    before, so no worker keeps a cached page from the old data.
+    """
+    folder = folder or backup_folder(app)
+    manifest = find(folder, name)
+    if manifest['schema_version'] > migrations.latest_version():
+        raise ValueError(f"{manifest['name']}: made by a newer schema (version {manifest['schema_version']})")
+
+    target = os.path.join(folder, manifest['name'] + '.restore.tmp')
+    try:
+        extract(folder, manifest, target)
+        safety = create(app, folder, label='pre-restore', keep=manifest['name'])
+        live = db.connect(app.config['DATABASE'])
+        source = sqlite3.connect(target)
+        try:
+            served = live.execute('SELECT COALESCE(MAX(generation), 0) FROM content_generations').fetchone()[0]
+            source.backup(live)
+        finally:
+            source.close()
+            live.close()
+    finally:
+        if os.path.exists(target):
+            os.remove(target)
+
+    # An older snapshot catches up with the current schema
+    migrations.migrate(app.config['DATABASE'])
+    live = db.connect(app.config['DATABASE'])
+    try:
+        live.execute('''
+            UPDATE content_generations
+            SET generation = generation + ?, modified_at = CAST(strftime('%s', 'now') AS INTEGER)
+        ''', (served + 1,))
+        live.commit()
+    finally:
+        live.close()
+    app.logger.warning('Restored %s (safety snapshot %s)', manifest['name'], safety['name'])
+    return manifest, safety
+
+
+def _describe(manifest):
+    ratio = manifest['compressed_size'] / manifest['size'] if manifest['size'] else 0
+    return (f"{manifest['name']}  {manifest['size'] / 1e6:8.1f} MB -> {manifest['compressed_size'] / 1e6:7.1f} MB "
+            f"({ratio:.0%})  schema {manifest['schema_version']}  {manifest['seconds']:.2f} s")
+
+
+def register_commands(app):
+    """Add the `flask backup` command group"""
+
+    @app.cli.group('backup')
+    def backup():
+        """Online database snapshots"""
+
+    @backup.command('create')
+    @click.option('--pages', type=int, help='Pages per step. Defaults to BACKUP_PAGES_PER_STEP.')
+    @click.option('--pause', type=float, help='Seconds between steps. Defaults to BACKUP_STEP_PAUSE.')
+    def create_command(pages, pause):
+        """Snapshot the live database without stopping the site"""
+        manifest = create(app, pages=pages, pause=pause)
+        click.echo(_describe(manifest))
+        click.echo(f"  {manifest['pages']} pages in {manifest['steps']} steps, {manifest['restarts']} restarts, "
+                   f"copy {manifest['copy_seconds']:.2f} s")
+        for name in manifest['removed']:
+            click.echo(f'  removed {name}')
+
+    @backup.command('list')
+    def list_command():
+        """Show snapshots, newest first"""
+        for manifest in snapshots(backup_folder(app)):
+            click.echo(_describe(manifest))
+
+    @backup.command('verify')
+    @click.argument('name', required=False)
+    @click.option('--all', 'check_all', is_flag=True, help='Verify every snapshot.')
+    def verify_command(name, check_all):
+        """Check a snapshot's checksums and integrity (default: the newest)"""
+        folder = backup_folder(app)
+        try:
+            manifests = snapshots(folder) if check_all else [find(folder, name)]
+            for manifest in manifests:
+                verify(folder, manifest)
+                click.echo(f"ok  {manifest['name']}")
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+    @backup.command('restore')
+    @click.argument('name', required=False)
+    @click.confirmation_option(prompt='Replace the live database with this snapshot?')
+    def restore_command(name):
+        """Restore a snapshot (default: the newest) after verifying it"""
+        try:
+            restored, safety = restore(app, name)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Restored {restored['name']}; the previous database is in {safety['name']}")
+
+
+def init_app(app):
+    app.config.setdefault('BACKUP_FOLDER', os.path.join(os.path.dirname(app.config['DATABASE']) or '.', 'backups'))
+    app.config.setdefault('BACKUP_PAGES_PER_STEP', DEFAULT_PAGES_PER_STEP)
+    app.config.setdefault('BACKUP_STEP_PAUSE', DEFAULT_STEP_PAUSE)
+    app.config.setdefault('BACKUP_KEEP_LAST', DEFAULT_KEEP_LAST)
+    app.config.setdefault('BACKUP_KEEP_DAYS', DEFAULT_KEEP_DAYS)
+    app.config.setdefault('BACKUP_INTERVAL', DEFAULT_INTERVAL)
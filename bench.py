@@ -0,0 +1,787 @@
+"""Route benchmarks at a chosen data scale
+
+    python bench.py seed --scale 100k
+    python bench.py run --scale 100k --output bench-100k.json
+    python bench.py run --scale 100k --baseline bench-100k.json
+    python bench.py compare bench-100k.json bench-new.json
+    python bench.py startup --scale 1k
+    python bench.py backup --scale 100k
+    python bench.py stream --scale 10k --per-page 5000
+
+`run` drives every GET route through Flask's test client and, with
+--gunicorn, through a local gunicorn under concurrent load, and prints the
+results as JSON. `startup` times fresh worker processes from import to their
+first responses, with and without compiled templates on disk and warm-up.
+`backup` times an online snapshot while gunicorn serves steady load and
+compares request latency with and without it. `stream` measures time to first
+byte and transfer size of one long sermons page from gunicorn, buffered and
+streamed, with and without gzip.
+"""
+import glob
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+
+import click
+
+SCALES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+DATA_FOLDER = 'bench-data'
+ADMIN = ('admin', 'admin123')
+
+# name -> (path, needs admin); {sermon}, {event}, ... are filled with ids from the seeded data
+ROUTES = {
+    'index': ('/', False),
+    'sermons': ('/sermons', False),
+    'sermons_json': ('/sermons?format=json', False),
+    'sermon_feed': ('/sermons/feed.xml', False),
+    'sermon_atom': ('/sermons/atom.xml', False),
+    'sermon_feed_archive': ('/sermons/feed/1.xml', False),
+    'sermon_atom_archive': ('/sermons/atom/1.xml', False),
+    'events': ('/events', False),
+    'api_events': ('/api/events?from={today}&to={month_ahead}', False),
+    'branches': ('/branches', False),
+    'branches_near': ('/branches/near?lat=40.7&lon=-74.0&k=5', False),
+    'branches_services': ('/branches/services?day=sunday&from=9am&to=noon', False),
+    'inspiration': ('/inspiration', False),
+    'site_search': ('/search?q=faith', False),
+    'login': ('/login', False),
+    'admin_dashboard': ('/admin', True),
+    'admin_sermons': ('/admin/sermons', True),
+    'admin_add_sermon': ('/admin/sermons/add', True),
+    'admin_edit_sermon': ('/admin/sermons/edit/{sermon}', True),
+    'admin_events': ('/admin/events', True),
+    'admin_add_event': ('/admin/events/add', True),
+    'admin_edit_event': ('/admin/events/edit/{event}', True),
+    'admin_branches': ('/admin/branches', True),
+    'admin_add_branch': ('/admin/branches/add', True),
+    'admin_edit_branch': ('/admin/branches/edit/{branch}', True),
+    'admin_inspiration': ('/admin/inspiration', True),
+    'admin_add_inspiration': ('/admin/inspiration/add', True),
+    'admin_edit_inspiration': ('/admin/inspiration/edit/{inspiration}', True),
+    'admin_db_stats': ('/admin/stats/db', True),
+    'admin_cache_stats': ('/admin/stats/cache', True),
+    'admin_ratelimit_stats': ('/admin/stats/ratelimit', True),
+    'admin_jobs_stats': ('/admin/stats/jobs', True),
+    'prometheus_metrics': ('/metrics', True),
+}
+
+# Endpoints deliberately left out, so a new route that is in neither list gets noticed
+SKIPPED = {
+    'static': 'static files are served by the front-end server',
+    'static_asset': 'static files are served by the front-end server',
+    'sermon_media': 'needs uploaded media',
+    'image_file': 'needs uploaded images',
+    'logout': 'ends the benchmark session',
+    'admin_delete_sermon': 'deletes data',
+    'admin_delete_event': 'deletes data',
+    'admin_delete_branch': 'deletes data',
+    'admin_delete_inspiration': 'deletes data',
+    'admin_delete_media': 'deletes data',
+    'admin_rebuild_search': 'POST only',
+}
+
+
+def data_path(scale):
+    return os.path.join(DATA_FOLDER, f'{scale}.db')
+
+
+def _count(scale):
+    return SCALES.get(scale.lower()) or int(scale)
+
+
+def load_app(database):
+    """Import the app against a benchmark database; config is read at import time"""
+    os.environ['DATABASE'] = database
+    os.environ.setdefault('UPLOAD_FOLDER', os.path.join(os.path.dirname(database), 'uploads'))
+    os.environ.setdefault('METRICS_SAMPLE_RATE', '0')
+    os.environ.setdefault('RATE_LIMIT', '0')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as site
+    return site
+
+
+# Seeding
+
+WORDS = ('faith', 'hope', 'grace', 'love', 'mercy', 'prayer', 'victory', 'zion', 'light', 'peace',
+         'spirit', 'promise', 'kingdom', 'covenant', 'harvest', 'worship', 'healing', 'glory')
+BOOKS = ('Genesis', 'Psalms', 'Proverbs', 'Isaiah', 'Matthew', 'John', 'Acts', 'Romans', 'Hebrews')
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def _records(count, make):
+    for i in range(count):
+        yield json.dumps(make(i)) + '\n'
+
+
+def seed(site, count, seed_value=1):
+    """Fill an empty database through the bulk importer; the same seed gives the same data"""
+    import content_io
+    from db import get_pool
+
+    rng = random.Random(seed_value)
+    today = date.today()
+
+    def sermon(i):
+        return {
+            'title': _sentence(rng, 4),
+            'speaker': f'Pastor {rng.choice(WORDS).capitalize()}',
+            'date': (today - timedelta(days=rng.randrange(3650))).isoformat(),
+            'scripture': f'{rng.choice(BOOKS)} {rng.randint(1, 50)}:{rng.randint(1, 30)}',
+            'description': _sentence(rng, 25),
+        }
+
+    def event(i):
+        record = {
+            'title': _sentence(rng, 3),
+            'description': _sentence(rng, 20),
+            'date': (today + timedelta(days=rng.randrange(-365, 365))).isoformat(),
+            'time': f'{rng.randint(8, 20):02d}:00',
+            'location': f'{rng.choice(WORDS).capitalize()} Hall',
+            'registration_required': rng.random() < 0.2,
+        }
+        # A few weekly series, bounded so the occurrence table stays proportional
+        if rng.random() < 0.01:
+            record.update(recurrence='weekly', recurrence_until=(today + timedelta(days=180)).isoformat())
+        return record
+
+    def branch(i):
+        return {'name': f'{rng.choice(WORDS).capitalize()} Branch {i}', 'address': f'{i} Church Road',
+                'service_times': f'Sunday {rng.randint(7, 11)}:{rng.choice(("00", "30"))} AM, Wednesday 7:00 PM',
+                'latitude': round(rng.uniform(25, 49), 5), 'longitude': round(rng.uniform(-124, -67), 5)}
+
+    def inspiration(i):
+        return {'scripture': f'{rng.choice(BOOKS)} {rng.randint(1, 50)}:{rng.randint(1, 30)}',
+                'quote': _sentence(rng, 12), 'date': (today - timedelta(days=i)).isoformat()}
+
+    plan = (('sermons', count, sermon), ('events', count, event),
+            ('branches', min(count // 100, 1000) or 1, branch), ('inspiration', min(count, 3650), inspiration))
+    totals = {}
+    with site.app.app_context(), get_pool(site.app).connection() as conn:
+        for kind, n, make in plan:
+            stats = content_io.import_stream(conn, kind, _records(n, make), 'jsonl', f'bench:{kind}',
+                                             batch_size=5000)
+            totals[kind] = stats
+            click.echo(f"{kind}: {stats['inserted']:,} rows in {stats['seconds']:.1f}s", err=True)
+        conn.execute('ANALYZE')
+        conn.commit()
+    return totals
+
+
+def is_seeded(scale):
+    return os.path.exists(data_path(scale) + '.seeded')
+
+
+def prepare(scale):
+    """Create and seed the database for a scale, replacing any earlier one"""
+    path = data_path(scale)
+    for stale in (path, path + '-wal', path + '-shm', path + '.seeded'):
+        if os.path.exists(stale):
+            os.remove(stale)
+    os.makedirs(DATA_FOLDER, exist_ok=True)
+    site = load_app(path)
+    site.init_db()
+    seed(site, _count(scale))
+    with open(path + '.seeded', 'w') as f:
+        f.write(datetime.now(timezone.utc).isoformat())
+    return path
+
+
+# Measuring
+
+def _samples(site):
+    """Values for the placeholders in ROUTES"""
+    from db import get_pool
+
+    with get_pool(site.app).connection() as conn:
+        def first(table):
+            row = conn.execute(f'SELECT id FROM {table} ORDER BY id LIMIT 1').fetchone()
+            return row[0] if row else 0
+
+        today = date.today()
+        return {
+            'sermon': first('sermons'), 'event': first('events'), 'branch': first('branches'),
+            'inspiration': first('daily_inspiration'),
+            'today': today.isoformat(), 'month_ahead': (today + timedelta(days=30)).isoformat(),
+        }
+
+
+def check_coverage(site):
+    """Endpoints with a GET rule that are neither benchmarked nor skipped"""
+    endpoints = {rule.endpoint for rule in site.app.url_map.iter_rules() if 'GET' in rule.methods}
+    return sorted(endpoints - set(ROUTES) - set(SKIPPED))
+
+
+def summarize(latencies, wall=None, errors=0):
+    """Percentiles in ms and throughput for one route"""
+    ordered = sorted(latencies)
+    cuts = statistics.quantiles(ordered, n=100, method='inclusive') if len(ordered) > 1 else ordered * 99
+    result = {
+        'requests': len(ordered),
+        'errors': errors,
+        'p50_ms': round(cuts[49] * 1000, 3),
+        'p95_ms': round(cuts[94] * 1000, 3),
+        'p99_ms': round(cuts[98] * 1000, 3),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+    }
+    result['rps'] = round(len(ordered) / (wall if wall else sum(ordered)), 1)
+    return result
+
+
+def run_client(site, paths, requests, warmup):
+    """Sequential requests through the test client, plus peak Python allocation per request"""
+    client = site.app.test_client()
+    client.post('/login', data=dict(zip(('username', 'password'), ADMIN)))
+    anonymous = site.app.test_client()
+    results = {}
+    for name, (path, admin) in paths.items():
+        c = client if admin else anonymous
+        for _ in range(warmup):
+            c.get(path).close()
+        latencies, errors = [], 0
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = c.get(path)
+            response.get_data()
+            latencies.append(time.perf_counter() - started)
+            response.close()
+            errors += response.status_code >= 400
+        tracemalloc.start()
+        c.get(path).close()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = summarize(latencies, errors=errors)
+        results[name]['peak_alloc_kb'] = round(peak / 1024, 1)
+        click.echo(f"client    {name:24} p50 {results[name]['p50_ms']:8.2f} ms  p99 {results[name]['p99_ms']:8.2f} ms",
+                   err=True)
+    return results
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _rss_kb(pid):
+    """Resident memory of a process and its children, from /proc (Linux only)"""
+    total = 0
+    pids = [pid]
+    try:
+        pids += [int(p) for p in open(f'/proc/{pid}/task/{pid}/children').read().split()]
+    except OSError:
+        return None
+    for p in pids:
+        try:
+            for line in open(f'/proc/{p}/status'):
+                if line.startswith('VmRSS:'):
+                    total += int(line.split()[1])
+        except OSError:
+            pass
+    return total
+
+
+def _request(port, path, cookie=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('GET', path, headers={'Cookie': cookie} if cookie else {})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def _login(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    body = f'username={ADMIN[0]}&password={ADMIN[1]}'
+    conn.request('POST', '/login', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    return response.getheader('Set-Cookie', '').split(';')[0]
+
+
+def start_gunicorn(database, concurrency, workers, env=None):
+    """Start a local gunicorn on a free port and wait until it answers; returns (process, port)"""
+    if shutil.which('gunicorn') is None:
+        raise click.ClickException('gunicorn is not installed')
+    port = _free_port()
+    env = dict(os.environ, **(env or {}), DATABASE=os.path.abspath(database))
+    server = subprocess.Popen(
+        ['gunicorn', '--workers', str(workers), '--threads', str(max(1, concurrency // workers)),
+         '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:create_app()'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            _request(port, '/login')
+            return server, port
+        except OSError:
+            if time.monotonic() > deadline or server.poll() is not None:
+                server.kill()
+                raise click.ClickException('gunicorn did not start')
+            time.sleep(0.2)
+
+
+def run_gunicorn(database, paths, requests, warmup, concurrency, workers):
+    """Concurrent load against a local gunicorn; throughput is requests over wall time"""
+    server, port = start_gunicorn(database, concurrency, workers)
+    try:
+        cookie = _login(port)
+
+        results = {}
+        for name, (path, admin) in paths.items():
+            headers = cookie if admin else None
+            for _ in range(warmup):
+                _request(port, path, headers)
+            latencies, statuses = [], []
+            lock = threading.Lock()
+
+            def one(_):
+                started = time.perf_counter()
+                status = _request(port, path, headers)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    statuses.append(status)
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as pool:
+                list(pool.map(one, range(requests)))
+            wall = time.perf_counter() - started
+            results[name] = summarize(latencies, wall, sum(s >= 400 for s in statuses))
+            results[name]['rss_kb'] = _rss_kb(server.pid)
+            click.echo(f"gunicorn  {name:24} p50 {results[name]['p50_ms']:8.2f} ms  "
+                       f"{results[name]['rps']:8.1f} req/s", err=True)
+        return results
+    finally:
+        server.terminate()
+        server.wait(10)
+
+
+# Start-up
+
+# Pages a fresh worker is asked for first
+STARTUP_PATHS = ('/', '/sermons', '/events', '/login')
+# name -> (empty the template bytecode cache first, warm up in create_app)
+STARTUP_SCENARIOS = {
+    'cold': (True, False),
+    'bytecode_cache': (False, False),
+    'cold_warm_up': (True, True),
+    'bytecode_cache_warm_up': (False, True),
+}
+
+
+def probe_startup(database, warm_up):
+    """Milliseconds from importing the app to each first response, in this (fresh) process"""
+    started = time.perf_counter()
+    site = load_app(database)
+    imported = time.perf_counter()
+    app = site.create_app(warm_up=warm_up)
+    created = time.perf_counter()
+    client = app.test_client()
+    firsts = {}
+    for path in STARTUP_PATHS:
+        before = time.perf_counter()
+        response = client.get(path)
+        response.close()
+        firsts[path] = round((time.perf_counter() - before) * 1000, 3)
+    return {
+        'import_ms': round((imported - started) * 1000, 3),
+        'create_app_ms': round((created - imported) * 1000, 3),
+        'first_responses_ms': firsts,
+        'total_ms': round((time.perf_counter() - started) * 1000, 3),
+    }
+
+
+def run_startup(database, repeat):
+    """Median timings per scenario, each run in a new interpreter"""
+    cache = os.path.join(os.path.dirname(database), 'jinja-cache')
+    env = dict(os.environ, DATABASE=database, JINJA_CACHE_FOLDER=cache, RATE_LIMIT='0')
+    # Migrate and fill the cache once so only the scenario differs between runs
+    subprocess.run([sys.executable, os.path.abspath(__file__), 'startup-probe', database],
+                   env=env, check=True, capture_output=True)
+    results = {}
+    for name, (cold, warm_up) in STARTUP_SCENARIOS.items():
+        runs = []
+        for _ in range(repeat):
+            if cold:
+                shutil.rmtree(cache, ignore_errors=True)
+            command = [sys.executable, os.path.abspath(__file__), 'startup-probe', database]
+            if warm_up:
+                command.append('--warm-up')
+            output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+            runs.append(json.loads(output))
+        results[name] = {
+            field: round(statistics.median(run[field] for run in runs), 3)
+            for field in ('import_ms', 'create_app_ms', 'total_ms')
+        }
+        results[name]['first_responses_ms'] = {
+            path: round(statistics.median(run['first_responses_ms'][path] for run in runs), 3)
+            for path in STARTUP_PATHS
+        }
+        click.echo(f"{name:24} import {results[name]['import_ms']:7.1f} ms  "
+                   f"create_app {results[name]['create_app_ms']:7.1f} ms  "
+                   f"first responses {sum(results[name]['first_responses_ms'].values()):7.1f} ms  "
+                   f"total {results[name]['total_ms']:7.1f} ms", err=True)
+    return results
+
+
+# Backups
+
+# Pages requested round-robin while a backup runs
+BACKUP_PATHS = ('/', '/sermons', '/events', '/branches', '/inspiration', '/search?q=faith')
+
+
+def _load_until(port, stop, concurrency, seconds=None):
+    """Request BACKUP_PATHS from concurrent threads until stop is set (or for seconds); returns latencies"""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds if seconds else None
+
+    def client(n):
+        i = n
+        while not stop.is_set() and (deadline is None or time.perf_counter() < deadline):
+            started = time.perf_counter()
+            status = _request(port, BACKUP_PATHS[i % len(BACKUP_PATHS)])
+            elapsed = time.perf_counter() - started
+            i += 1
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += status >= 400
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+    return latencies, time.perf_counter() - started, errors[0]
+
+
+def run_backup_impact(database, seconds, concurrency, workers, pages, pause):
+    """Request latency under steady load, first alone and then while a backup runs"""
+    folder = os.path.join(os.path.dirname(database), 'backups')
+    # The backup runs in its own process, as `flask backup create` or the job worker would
+    command = [sys.executable, '-m', 'flask', '--app', 'app', 'backup', 'create']
+    command += ['--pages', str(pages)] if pages else []
+    command += ['--pause', str(pause)] if pause is not None else []
+    env = dict(os.environ, DATABASE=os.path.abspath(database), BACKUP_FOLDER=folder)
+
+    server, port = start_gunicorn(database, concurrency, workers)
+    try:
+        for path in BACKUP_PATHS:
+            _request(port, path)
+        latencies, wall, errors = _load_until(port, threading.Event(), concurrency, seconds)
+        baseline = summarize(latencies, wall, errors)
+
+        stop = threading.Event()
+        load = ThreadPoolExecutor(1).submit(_load_until, port, stop, concurrency)
+        try:
+            subprocess.run(command, env=env, check=True, capture_output=True,
+                           cwd=os.path.dirname(os.path.abspath(__file__)))
+        finally:
+            stop.set()
+        latencies, wall, errors = load.result()
+        during = summarize(latencies, wall, errors)
+    finally:
+        server.terminate()
+        server.wait(10)
+
+    with open(max(glob.glob(os.path.join(folder, '*.json')))) as f:
+        manifest = json.load(f)
+    fields = ('pages', 'page_size', 'steps', 'restarts', 'size', 'compressed_size', 'copy_seconds', 'seconds')
+    results = {
+        'backup': {field: manifest[field] for field in fields},
+        'baseline': baseline,
+        'during_backup': during,
+        'p95_change': round((during['p95_ms'] - baseline['p95_ms']) / baseline['p95_ms'], 3)
+        if baseline['p95_ms'] else None,
+    }
+    click.echo(f"backup    {manifest['pages']} pages in {manifest['steps']} steps ({manifest['restarts']} restarts), "
+               f"copy {manifest['copy_seconds']:.2f} s, total {manifest['seconds']:.2f} s", err=True)
+    click.echo(f"latency   p50 {baseline['p50_ms']:.2f} -> {during['p50_ms']:.2f} ms  "
+               f"p95 {baseline['p95_ms']:.2f} -> {during['p95_ms']:.2f} ms  "
+               f"{baseline['rps']:.1f} -> {during['rps']:.1f} req/s", err=True)
+    return results
+
+
+# Streaming
+
+def _first_byte(port, path, encoding):
+    """(ms to the first body byte, ms to the last, bytes on the wire, status) for one GET"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        started = time.perf_counter()
+        conn.request('GET', path, headers={'Accept-Encoding': encoding})
+        response = conn.getresponse()
+        first = response.read(1)
+        ttfb = time.perf_counter() - started
+        size = len(first) + len(response.read())
+        return ttfb * 1000, (time.perf_counter() - started) * 1000, size, response.status
+    finally:
+        conn.close()
+
+
+def run_streaming(database, per_page, repeat):
+    """Median TTFB, total time and size of one sermons page, buffered and streamed, identity and gzip"""
+    path = f'/sermons?per_page={per_page}'
+    results = {}
+    for streamed in (False, True):
+        # One sync worker and no page cache, so every request renders the page
+        env = {'STREAM_TEMPLATES': '1' if streamed else '0', 'PAGE_CACHE_SIZE': '0',
+               'MAX_PAGE_SIZE': str(max(per_page, 100)), 'RATE_LIMIT': '0', 'METRICS_SAMPLE_RATE': '0',
+               'METRICS_SLOW_MS': '60000'}
+        server, port = start_gunicorn(database, 1, 1, env)
+        try:
+            _request(port, path)
+            for encoding in ('identity', 'gzip'):
+                samples = [_first_byte(port, path, encoding) for _ in range(repeat)]
+                name = f"{'streamed' if streamed else 'buffered'}_{encoding}"
+                results[name] = {
+                    'ttfb_ms': round(statistics.median(s[0] for s in samples), 1),
+                    'total_ms': round(statistics.median(s[1] for s in samples), 1),
+                    'bytes': samples[-1][2],
+                    'errors': sum(s[3] >= 400 for s in samples),
+                }
+                click.echo(f"{name:18} TTFB {results[name]['ttfb_ms']:8.1f} ms  total {results[name]['total_ms']:8.1f} ms  "
+                           f"{results[name]['bytes']:>11,} B", err=True)
+        finally:
+            server.terminate()
+            server.wait(10)
+    return results
+
+
+# Comparing
+
+def compare(baseline, current, threshold, min_ms):
+    """Regressions: p95 slower or throughput lower than the baseline by more than threshold"""
+    regressions = []
+    rows = []
+    for mode, routes in current['results'].items():
+        for name, now in routes.items():
+            before = baseline.get('results', {}).get(mode, {}).get(name)
+            if not before:
+                continue
+            slower = (now['p95_ms'] > before['p95_ms'] * (1 + threshold)
+                      and now['p95_ms'] - before['p95_ms'] >= min_ms)
+            fewer = now['rps'] < before['rps'] * (1 - threshold)
+            change = (now['p95_ms'] - before['p95_ms']) / before['p95_ms'] if before['p95_ms'] else 0.0
+            rows.append((mode, name, before['p95_ms'], now['p95_ms'], change, slower or fewer))
+            if slower or fewer:
+                regressions.append({'mode': mode, 'route': name, 'baseline': before, 'current': now})
+    for mode, name, before, now, change, flagged in rows:
+        click.echo(f"{'REGRESSED' if flagged else 'ok':9} {mode:8} {name:24} p95 {before:8.2f} -> {now:8.2f} ms "
+                   f"({change:+.0%})", err=True)
+    return regressions
+
+
+@click.group()
+def cli():
+    """Seed benchmark databases and measure every route"""
+
+
+@cli.command('seed')
+@click.option('--scale', default='1k', show_default=True, help='1k, 10k, 100k, 1m or a row count.')
+def seed_command(scale):
+    """(Re)create the database for a scale"""
+    click.echo(prepare(scale))
+
+
+@cli.command('run')
+@click.option('--scale', default='1k', show_default=True, help='1k, 10k, 100k, 1m or a row count.')
+@click.option('--requests', 'count', default=200, show_default=True, help='Timed requests per route.')
+@click.option('--warmup', default=10, show_default=True)
+@click.option('--route', 'only', multiple=True, help='Limit to these route names.')
+@click.option('--gunicorn', 'use_gunicorn', is_flag=True, help='Also load-test a local gunicorn.')
+@click.option('--concurrency', default=8, show_default=True)
+@click.option('--workers', default=2, show_default=True)
+@click.option('--no-page-cache', is_flag=True, help='Measure rendering rather than cache hits.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write JSON here instead of stdout.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Flag regressions against this run.')
+@click.option('--threshold', default=0.15, show_default=True, help='Allowed relative slowdown.')
+@click.option('--min-ms', default=0.5, show_default=True, help='Ignore p95 changes smaller than this.')
+def run_command(scale, count, warmup, only, use_gunicorn, concurrency, workers, no_page_cache,
+                output, baseline, threshold, min_ms):
+    """Benchmark every route and print JSON results"""
+    if not is_seeded(scale):
+        # Seed in a child process: the app reads DATABASE once, at import
+        subprocess.run([sys.executable, os.path.abspath(__file__), 'seed', '--scale', scale], check=True)
+    database = data_path(scale)
+    # Work on a copy so admin page views and cache warm-up never change the seeded data
+    scratch = tempfile.mkdtemp(prefix='bench-')
+    copy = os.path.join(scratch, 'bench.db')
+    shutil.copyfile(database, copy)
+    if no_page_cache:
+        os.environ['PAGE_CACHE_SIZE'] = '0'
+    try:
+        site = load_app(copy)
+        site.app.config['PAGE_CACHE_ENABLED'] = not no_page_cache
+        # Failures are counted per route instead of logging a traceback per request
+        site.app.logger.disabled = True
+        missing = check_coverage(site)
+        if missing:
+            click.echo(f"warning: not benchmarked: {', '.join(missing)}", err=True)
+
+        samples = _samples(site)
+        paths = {name: (path.format(**samples), admin) for name, (path, admin) in ROUTES.items()
+                 if not only or name in only}
+        results = {'client': run_client(site, paths, count, warmup)}
+        if use_gunicorn:
+            results['gunicorn'] = run_gunicorn(copy, paths, count, warmup, concurrency, workers)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'scale': scale,
+            'rows': _count(scale),
+            'requests_per_route': count,
+            'concurrency': concurrency if use_gunicorn else 1,
+            'workers': workers if use_gunicorn else None,
+            'page_cache': not no_page_cache,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'commit': subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                     cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None,
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        },
+        'results': results,
+    }
+    failing = sorted({name for routes in results.values() for name, r in routes.items() if r['errors']})
+    if failing:
+        click.echo(f"warning: error responses from: {', '.join(failing)}", err=True)
+
+    text = json.dumps(report, indent=1)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        click.echo(text)
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(json.load(f), report, threshold, min_ms)
+        if regressions:
+            raise click.ClickException(f'{len(regressions)} route(s) regressed')
+
+
+@cli.command('startup')
+@click.option('--scale', default='1k', show_default=True, help='1k, 10k, 100k, 1m or a row count.')
+@click.option('--repeat', default=5, show_default=True, help='Fresh processes per scenario.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write JSON here instead of stdout.')
+def startup_command(scale, repeat, output):
+    """Time fresh workers from import to first responses and print JSON results"""
+    if not is_seeded(scale):
+        subprocess.run([sys.executable, os.path.abspath(__file__), 'seed', '--scale', scale], check=True)
+    scratch = tempfile.mkdtemp(prefix='bench-')
+    copy = os.path.join(scratch, 'bench.db')
+    shutil.copyfile(data_path(scale), copy)
+    try:
+        results = run_startup(copy, repeat)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {'meta': {'scale': scale, 'repeat': repeat, 'paths': list(STARTUP_PATHS),
+                       'python': platform.python_version()}, 'results': results}
+    text = json.dumps(report, indent=1)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        click.echo(text)
+
+
+@cli.command('backup')
+@click.option('--scale', default='1k', show_default=True, help='1k, 10k, 100k, 1m or a row count.')
+@click.option('--seconds', default=5.0, show_default=True, help='Length of the load-only baseline.')
+@click.option('--concurrency', default=8, show_default=True)
+@click.option('--workers', default=2, show_default=True)
+@click.option('--pages', type=int, help='Pages per backup step. Defaults to BACKUP_PAGES_PER_STEP.')
+@click.option('--pause', type=float, help='Seconds between steps. Defaults to BACKUP_STEP_PAUSE.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write JSON here instead of stdout.')
+def backup_command(scale, seconds, concurrency, workers, pages, pause, output):
+    """Time an online backup under load and its effect on request latency"""
+    if not is_seeded(scale):
+        subprocess.run([sys.executable, os.path.abspath(__file__), 'seed', '--scale', scale], check=True)
+    scratch = tempfile.mkdtemp(prefix='bench-')
+    copy = os.path.join(scratch, 'bench.db')
+    shutil.copyfile(data_path(scale), copy)
+    try:
+        results = run_backup_impact(copy, seconds, concurrency, workers, pages, pause)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {'meta': {'scale': scale, 'concurrency': concurrency, 'workers': workers, 'paths': list(BACKUP_PATHS),
+                       'python': platform.python_version()}, 'results': results}
+    text = json.dumps(report, indent=1)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        click.echo(text)
+
+
+@cli.command('stream')
+@click.option('--scale', default='10k', show_default=True, help='1k, 10k, 100k, 1m or a row count.')
+@click.option('--per-page', default=5000, show_default=True, help='Sermons on the page; raises MAX_PAGE_SIZE to match.')
+@click.option('--repeat', default=5, show_default=True, help='Requests per scenario; medians are reported.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write JSON here instead of stdout.')
+def stream_command(scale, per_page, repeat, output):
+    """Time to first byte and size of a long listing page, buffered vs streamed, and print JSON results"""
+    if not is_seeded(scale):
+        subprocess.run([sys.executable, os.path.abspath(__file__), 'seed', '--scale', scale], check=True)
+    scratch = tempfile.mkdtemp(prefix='bench-')
+    copy = os.path.join(scratch, 'bench.db')
+    shutil.copyfile(data_path(scale), copy)
+    try:
+        results = run_streaming(copy, per_page, repeat)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {'meta': {'scale': scale, 'per_page': per_page, 'repeat': repeat, 'path': f'/sermons?per_page={per_page}',
+                       'server': 'gunicorn, 1 sync worker', 'page_cache': False,
+                       'python': platform.python_version()}, 'results': results}
+    text = json.dumps(report, indent=1)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        click.echo(text)
+
+
+@cli.command('startup-probe', hidden=True)
+@click.argument('database')
+@click.option('--warm-up', is_flag=True)
+def startup_probe_command(database, warm_up):
+    """One start-up measurement; run by `startup` in a fresh process"""
+    click.echo(json.dumps(probe_startup(database, warm_up)))
+
+
+@cli.command('compare')
+@click.argument('baseline', type=click.File())
+@click.argument('current', type=click.File())
+@click.option('--threshold', default=0.15, show_default=True)
+@click.option('--min-ms', default=0.5, show_default=True)
+def compare_command(baseline, current, threshold, min_ms):
+    """Compare two saved runs; exits non-zero on regressions"""
+    regressions = compare(json.load(baseline), json.load(current), threshold, min_ms)
+    if regressions:
+        raise click.ClickException(f'{len(regressions)} route(s) regressed')
+
+
+if __name__ == '__main__':
+    cli()
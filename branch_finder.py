@@ -0,0 +1,324 @@
+import csv
+import math
+import re
+
+import click
+
+from db import get_pool
+
+EARTH_RADIUS_KM = 6371.0088
+# First search radius; it grows fourfold until k branches are inside it
+INITIAL_RADIUS_KM = 25.0
+DEFAULT_NEAREST = 5
+MAX_NEAREST = 50
+DEFAULT_SERVICES_LIMIT = 50
+MAX_SERVICES_LIMIT = 200
+
+# Monday is 0, as in date.weekday()
+DAY_NAMES = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+DAY_GROUPS = {
+    'daily': range(7),
+    'weekday': range(5),
+    'weekdays': range(5),
+    'weekend': (5, 6),
+    'weekends': (5, 6),
+}
+RANGE_WORDS = ('to', 'through', 'thru', 'till', 'until')
+WORD_TIMES = {'noon': 12 * 60, 'midday': 12 * 60, 'midnight': 0}
+
+TOKEN_RE = re.compile(r'''
+    (?P<hour>\d{1,2})(?:[:.](?P<minute>\d{2}))?(?:\s*(?P<meridiem>[ap])\.?m\b\.?)?(?!\d)
+    | (?P<word>[a-z]+)
+    | (?P<dash>[-–])
+''', re.VERBOSE)
+
+
+def day_index(word):
+    """0-6 for a day name, abbreviation or plural ('sun', 'Tues', 'Sundays'), else None"""
+    word = word.lower()
+    for candidate in (word, word[:-1] if word.endswith('s') else None):
+        if candidate and len(candidate) >= 3:
+            for index, name in enumerate(DAY_NAMES):
+                if name.startswith(candidate):
+                    return index
+    return None
+
+
+def _minutes(match):
+    """Minutes after midnight for a TOKEN_RE time match, or None if it is just a number"""
+    hour, minute, meridiem = int(match['hour']), match['minute'], match['meridiem']
+    minute = int(minute) if minute else 0
+    if minute > 59:
+        return None
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        return (hour % 12 + (12 if meridiem == 'p' else 0)) * 60 + minute
+    # A bare number ('Room 3') is not a time; '18:00' is
+    if match['minute'] is None or hour > 23:
+        return None
+    return hour * 60 + minute
+
+
+def _tokens(text):
+    """('days', [indexes]) and ('time', minutes) in reading order, with day ranges expanded"""
+    tokens = []
+    ranging = False
+    for match in TOKEN_RE.finditer(text.lower()):
+        if match['hour']:
+            minutes = _minutes(match)
+            if minutes is not None:
+                tokens.append(('time', minutes))
+            ranging = False
+            continue
+        word = match['word']
+        if match['dash'] or word in RANGE_WORDS:
+            ranging = bool(tokens) and tokens[-1][0] == 'days'
+            continue
+        if word in WORD_TIMES:
+            tokens.append(('time', WORD_TIMES[word]))
+        elif word in DAY_GROUPS:
+            tokens.append(('days', list(DAY_GROUPS[word])))
+        elif (day := day_index(word)) is not None:
+            if ranging:
+                # 'Mon-Fri', 'Friday to Sunday': wraps past the end of the week
+                start = tokens[-1][1][-1]
+                tokens[-1][1].extend((start + offset) % 7 for offset in range(1, (day - start) % 7 + 1))
+            else:
+                tokens.append(('days', [day]))
+        ranging = False
+    return tokens
+
+
+def parse_services(text):
+    """Sorted (day, minutes) pairs from free text such as 'Sunday 9:00 AM, 11:00 AM; Wed 7pm'
+
+    Times belong to the days next to them, on whichever side the text
+    starts with: 'Sunday 9am, Wednesday 7pm' and '9am Sunday, 7pm Wednesday'
+    mean the same.
+    """
+    tokens = _tokens(text or '')
+    leading = tokens[0][0] if tokens else None
+    groups = []
+    for kind, value in tokens:
+        if not groups or kind == leading and groups[-1]['time' if kind == 'days' else 'days']:
+            groups.append({'days': [], 'time': []})
+        groups[-1][kind].extend(value if kind == 'days' else [value])
+    return sorted({(day, minute) for group in groups for day in group['days'] for minute in group['time']})
+
+
+def parse_clock(value):
+    """Minutes after midnight for a query value like '9:30', '18:00', '7pm' or 'noon'"""
+    match = TOKEN_RE.fullmatch((value or '').strip().lower())
+    if match is None:
+        return None
+    if match['word']:
+        return WORD_TIMES.get(match['word'])
+    return _minutes(match) if match['hour'] else None
+
+
+def format_clock(minutes):
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+# Schedule index
+
+def sync_branch(conn, branch_id):
+    """Re-parse one branch's service times into branch_services"""
+    row = conn.execute('SELECT service_times FROM branches WHERE id = ?', (branch_id,)).fetchone()
+    if row is not None:
+        _index(conn, branch_id, row['service_times'])
+
+
+def sync_schedules(conn):
+    """Index every branch whose service times changed since they were last parsed; returns how many"""
+    # A partial index holds exactly these rows, so this is cheap when nothing changed
+    stale = conn.execute('''
+        SELECT id, service_times FROM branches WHERE services_indexed IS NOT service_times
+    ''').fetchall()
+    for row in stale:
+        _index(conn, row['id'], row['service_times'])
+    if stale:
+        conn.commit()
+    return len(stale)
+
+
+def _index(conn, branch_id, service_times):
+    conn.execute('DELETE FROM branch_services WHERE branch_id = ?', (branch_id,))
+    conn.executemany('INSERT INTO branch_services (day, minute, branch_id) VALUES (?, ?, ?)',
+                     [(day, minute, branch_id) for day, minute in parse_services(service_times)])
+    conn.execute('UPDATE branches SET services_indexed = service_times WHERE id = ?', (branch_id,))
+
+
+def _schedules(conn, ids):
+    """{branch id: [{'day': ..., 'time': ...}]} for the given branches"""
+    schedules = {branch_id: [] for branch_id in ids}
+    if not ids:
+        return schedules
+    placeholders = ', '.join('?' for _ in ids)
+    rows = conn.execute(f'''
+        SELECT branch_id, day, minute FROM branch_services
+        WHERE branch_id IN ({placeholders})
+        ORDER BY branch_id, day, minute
+    ''', list(ids))
+    for row in rows:
+        schedules[row['branch_id']].append({'day': DAY_NAMES[row['day']], 'time': format_clock(row['minute'])})
+    return schedules
+
+
+def services(conn, day=None, start=0, end=24 * 60 - 1, limit=DEFAULT_SERVICES_LIMIT):
+    """Services on a day (or any day) between two times, in schedule order"""
+    sync_schedules(conn)
+    first, last = (day, day) if day is not None else (0, 6)
+    rows = conn.execute('''
+        SELECT s.day, s.minute, b.id, b.name, b.address, b.phone, b.latitude, b.longitude
+        FROM branch_services s JOIN branches b ON b.id = s.branch_id
+        WHERE s.day BETWEEN ? AND ? AND s.minute BETWEEN ? AND ?
+        ORDER BY s.day, s.minute, s.branch_id
+        LIMIT ?
+    ''', (first, last, start, end, limit)).fetchall()
+    return [{'day': DAY_NAMES[row['day']], 'time': format_clock(row['minute']), 'id': row['id'], 'name': row['name'],
+             'address': row['address'], 'phone': row['phone'], 'latitude': row['latitude'],
+             'longitude': row['longitude']} for row in rows]
+
+
+# Nearest branches
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi, dlambda = phi2 - phi1, math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_boxes(lat, lon, radius):
+    """(min lat, max lat, min lon, max lon) boxes covering a circle; two when it crosses 180°"""
+    angle = radius / EARTH_RADIUS_KM
+    min_lat, max_lat = lat - math.degrees(angle), lat + math.degrees(angle)
+    if min_lat <= -90 or max_lat >= 90 or math.sin(angle) >= math.cos(math.radians(lat)):
+        # The circle reaches a pole: every longitude is in range
+        return [(max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0)]
+    spread = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(lat))))
+    min_lon, max_lon = lon - spread, lon + spread
+    if min_lon < -180:
+        return [(min_lat, max_lat, min_lon + 360, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+    if max_lon > 180:
+        return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
+
+
+def nearest(conn, lat, lon, count=DEFAULT_NEAREST, day=None, start=0, end=24 * 60 - 1):
+    """The `count` branches closest to a point, optionally only those with a service in a time window
+
+    The R*Tree returns the branches inside a box around a circle; once the
+    circle holds enough of them, nothing outside it can be closer.
+    """
+    sync_schedules(conn)
+    radius = INITIAL_RADIUS_KM
+    while True:
+        found = {}
+        for box in bounding_boxes(lat, lon, radius):
+            rows = conn.execute('''
+                SELECT b.id, b.name, b.address, b.phone, b.email, b.service_times, b.latitude, b.longitude
+                FROM branch_locations l JOIN branches b ON b.id = l.id
+                WHERE l.max_lat >= ? AND l.min_lat <= ? AND l.max_lon >= ? AND l.min_lon <= ?
+                  AND (? IS NULL OR EXISTS (
+                      SELECT 1 FROM branch_services s
+                      WHERE s.branch_id = b.id AND s.day = ? AND s.minute BETWEEN ? AND ?))
+            ''', box + (day, day, start, end))
+            for row in rows:
+                distance = haversine(lat, lon, row['latitude'], row['longitude'])
+                if distance <= radius:
+                    found[row['id']] = dict(row, distance_km=round(distance, 3))
+        if len(found) >= count or radius >= math.pi * EARTH_RADIUS_KM:
+            break
+        radius *= 4
+
+    results = sorted(found.values(), key=lambda branch: (branch['distance_km'], branch['id']))[:count]
+    schedules = _schedules(conn, [branch['id'] for branch in results])
+    for branch in results:
+        branch['services'] = schedules[branch['id']]
+    return results
+
+
+def parse_coordinate(value, limit):
+    """A float within ±limit, or None"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) and -limit <= number <= limit else None
+
+
+def form_coordinates(form):
+    """(latitude, longitude, error) from the admin branch form; leaving both blank clears them"""
+    lat_text, lon_text = form.get('latitude', '').strip(), form.get('longitude', '').strip()
+    if not lat_text and not lon_text:
+        return None, None, None
+    lat, lon = parse_coordinate(lat_text, 90), parse_coordinate(lon_text, 180)
+    if lat is None or lon is None:
+        return None, None, 'Coordinates not saved: latitude must be -90 to 90 and longitude -180 to 180'
+    return lat, lon, None
+
+
+def parse_window(args):
+    """(day or None, start, end) minutes from day/from/to query arguments; ValueError if unreadable"""
+    day = None
+    if args.get('day'):
+        day = day_index(args['day'])
+        if day is None:
+            raise ValueError(f"unknown day {args['day']!r}")
+    start, end = 0, 24 * 60 - 1
+    if args.get('from'):
+        start = parse_clock(args['from'])
+    if args.get('to'):
+        end = parse_clock(args['to'])
+    if start is None or end is None:
+        raise ValueError('from and to must be times such as 09:30 or 7pm')
+    if end < start:
+        raise ValueError('from must not be after to')
+    return day, start, end
+
+
+def register_commands(app):
+    """Add the `flask branches` command group"""
+
+    @app.cli.group('branches')
+    def branches():
+        """Branch coordinates and service schedules"""
+
+    @branches.command('import-coordinates')
+    @click.argument('path', type=click.File(encoding='utf-8'))
+    def import_coordinates_command(path):
+        """Set latitude/longitude from a geocoded CSV with id or name, latitude, longitude columns"""
+        updated, unmatched = 0, []
+        with get_pool().connection() as conn:
+            for number, record in enumerate(csv.DictReader(path), start=1):
+                lat = parse_coordinate(record.get('latitude'), 90)
+                lon = parse_coordinate(record.get('longitude'), 180)
+                if lat is None or lon is None:
+                    click.echo(f'record {number}: invalid coordinates', err=True)
+                    continue
+                if record.get('id'):
+                    cursor = conn.execute('UPDATE branches SET latitude = ?, longitude = ? WHERE id = ?',
+                                          (lat, lon, record['id']))
+                else:
+                    cursor = conn.execute('UPDATE branches SET latitude = ?, longitude = ? WHERE name = ?',
+                                          (lat, lon, (record.get('name') or '').strip()))
+                if cursor.rowcount:
+                    updated += cursor.rowcount
+                else:
+                    unmatched.append(record.get('id') or record.get('name'))
+            conn.commit()
+        for key in unmatched:
+            click.echo(f'no branch matches {key!r}', err=True)
+        click.echo(f'Updated coordinates for {updated} branches')
+
+    @branches.command('reindex')
+    def reindex_command():
+        """Re-parse service times into the schedule index"""
+        with get_pool().connection() as conn:
+            conn.execute('UPDATE branches SET services_indexed = NULL')
+            indexed = sync_schedules(conn)
+        click.echo(f'Indexed service times for {indexed} branches')
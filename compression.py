@@ -0,0 +1,174 @@
+import re
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+DEFAULT_MIN_SIZE = 1024
+DEFAULT_LEVEL = 6
+# Brotli's 0-11 scale; 5 compresses better than gzip -6 at similar speed for dynamic pages
+BROTLI_QUALITY = 5
+# Streamed bodies are flushed after the first chunk and then about this often;
+# flushing every chunk costs both ratio and CPU
+FLUSH_SIZE = 64 * 1024
+
+# Text formats worth compressing; media, images, PDFs and archives are compressed already
+COMPRESSIBLE = ('text/', 'application/json', 'application/javascript', 'application/xml',
+                'application/rss+xml', 'application/atom+xml', 'image/svg+xml')
+
+ETAG_SUFFIX_RE = re.compile(r'-(?:gzip|br)"')
+
+
+def _accepts(environ, token):
+    """Whether Accept-Encoding allows a coding (q=0 means refused)"""
+    for part in environ.get('HTTP_ACCEPT_ENCODING', '').lower().split(','):
+        name, _, params = part.strip().partition(';')
+        if name.strip() in (token, '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+def _suffixed(etag, encoding):
+    """Distinct ETag for the encoded representation, as Apache's mod_deflate does"""
+    return etag[:-1] + f'-{encoding}"' if etag.endswith('"') else etag
+
+
+class _Gzip:
+    def __init__(self, level):
+        # wbits 31: a gzip header and trailer around the deflate stream
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def process(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def process(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class Compressor:
+    """WSGI middleware that gzip/brotli-encodes text responses above a size threshold
+
+    Buffered responses are compressed in one go; streamed ones chunk by chunk,
+    flushing after each so the client still sees the first bytes early.
+    """
+
+    def __init__(self, app, min_size=DEFAULT_MIN_SIZE, level=DEFAULT_LEVEL):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+
+    def _encoding(self, environ):
+        if environ['REQUEST_METHOD'] != 'GET' or 'HTTP_RANGE' in environ:
+            return None
+        if brotli is not None and _accepts(environ, 'br'):
+            return 'br'
+        if _accepts(environ, 'gzip'):
+            return 'gzip'
+        return None
+
+    def _compressible(self, status, headers):
+        if not status.startswith('200'):
+            return False
+        values = {name.lower(): value for name, value in headers}
+        if 'content-encoding' in values or 'no-transform' in values.get('cache-control', ''):
+            return False
+        if not values.get('content-type', '').startswith(COMPRESSIBLE):
+            return False
+        length = values.get('content-length')
+        return length is None or int(length) >= self.min_size
+
+    def __call__(self, environ, start_response):
+        encoding = self._encoding(environ)
+        if encoding is None:
+            return self.app(environ, start_response)
+
+        # Clients revalidate with the ETag we sent, suffix included
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH', '')
+        revalidating = bool(ETAG_SUFFIX_RE.search(if_none_match))
+        if revalidating:
+            environ['HTTP_IF_NONE_MATCH'] = ETAG_SUFFIX_RE.sub('"', if_none_match)
+
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            captured.update(status=status, headers=headers, exc_info=exc_info)
+            return lambda data: None  # pragma: no cover - Flask never uses write()
+
+        app_iter = self.app(environ, capture)
+        if revalidating and captured['status'].startswith('304'):
+            # A 304 carries the ETag of the representation the client holds
+            headers = [(name, _suffixed(value, encoding) if name.lower() == 'etag' else value)
+                       for name, value in captured['headers']]
+            start_response(captured['status'], headers, captured['exc_info'])
+            return app_iter
+        if not self._compressible(captured['status'], captured['headers']):
+            start_response(captured['status'], captured['headers'], captured['exc_info'])
+            return app_iter
+        return self._compress(app_iter, encoding, captured, start_response)
+
+    def _compress(self, app_iter, encoding, captured, start_response):
+        headers = []
+        length = None
+        for name, value in captured['headers']:
+            lower = name.lower()
+            if lower == 'content-length':
+                length = int(value)
+            elif lower == 'etag':
+                headers.append((name, _suffixed(value, encoding)))
+            elif lower != 'vary':
+                headers.append((name, value))
+        vary = [v for n, v in captured['headers'] if n.lower() == 'vary']
+        headers.append(('Vary', ', '.join(vary + ['Accept-Encoding'])))
+        headers.append(('Content-Encoding', encoding))
+        compressor = _Brotli() if encoding == 'br' else _Gzip(self.level)
+
+        try:
+            if length is not None:
+                # Known length: compress the whole body and keep Content-Length
+                data = compressor.process(b''.join(app_iter)) + compressor.finish()
+                headers.append(('Content-Length', str(len(data))))
+                start_response(captured['status'], headers, captured['exc_info'])
+                yield data
+                return
+
+            start_response(captured['status'], headers, captured['exc_info'])
+            pending = FLUSH_SIZE
+            for chunk in app_iter:
+                data = compressor.process(chunk)
+                pending += len(chunk)
+                if pending >= FLUSH_SIZE:
+                    data += compressor.flush()
+                    pending = 0
+                if data:
+                    yield data
+            yield compressor.finish()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+
+def init_app(app):
+    app.config.setdefault('COMPRESS_ENABLED', True)
+    app.config.setdefault('COMPRESS_MIN_SIZE', DEFAULT_MIN_SIZE)
+    app.config.setdefault('COMPRESS_LEVEL', DEFAULT_LEVEL)
+    if app.config['COMPRESS_ENABLED']:
+        app.wsgi_app = Compressor(app.wsgi_app, app.config['COMPRESS_MIN_SIZE'], app.config['COMPRESS_LEVEL'])
@@ -0,0 +1,303 @@
+import csv
+import io
+import json
+import os
+import sys
+import time
+
+import click
+
+import branch_finder
+import recurrence
+from db import get_pool
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _text(value):
+    value = (value or '').strip() if isinstance(value, str) else value
+    return value if value not in ('', None) else None
+
+
+def _date(value):
+    value = _text(value)
+    if value is None:
+        return None
+    day = recurrence.parse_date(str(value))
+    if day is None:
+        raise ValueError(f'invalid date {value!r}')
+    return day.isoformat()
+
+
+def _flag(value):
+    value = _text(value)
+    if value is None:
+        return 0
+    return 1 if str(value).lower() in ('1', 'true', 'yes', 'y', 'on') else 0
+
+
+def _positive_int(value):
+    value = _text(value)
+    return max(1, int(value)) if value is not None else 1
+
+
+def _rule(value):
+    value = _text(value)
+    if value is None:
+        return None
+    if str(value).lower() not in recurrence.RULES:
+        raise ValueError(f'unknown recurrence {value!r}')
+    return str(value).lower()
+
+
+def _coordinate(limit):
+    def convert(value):
+        value = _text(value)
+        if value is None:
+            return None
+        number = branch_finder.parse_coordinate(value, limit)
+        if number is None:
+            raise ValueError(f'invalid coordinate {value!r}')
+        return number
+    return convert
+
+
+# Importable content: table, insert verb, and (column, converter, required) per field
+KINDS = {
+    'sermons': {
+        'table': 'sermons',
+        'insert': 'INSERT',
+        'fields': [
+            ('title', _text, True),
+            ('speaker', _text, True),
+            ('date', _date, True),
+            ('scripture', _text, False),
+            ('description', _text, False),
+        ],
+    },
+    'events': {
+        'table': 'events',
+        'insert': 'INSERT',
+        'fields': [
+            ('title', _text, True),
+            ('description', _text, False),
+            ('date', _date, True),
+            ('time', _text, False),
+            ('location', _text, False),
+            ('registration_required', _flag, False),
+            ('recurrence', _rule, False),
+            ('recurrence_interval', _positive_int, False),
+            ('recurrence_until', _date, False),
+        ],
+    },
+    'branches': {
+        'table': 'branches',
+        'insert': 'INSERT',
+        'fields': [
+            ('name', _text, True),
+            ('address', _text, True),
+            ('phone', _text, False),
+            ('email', _text, False),
+            ('service_times', _text, False),
+            ('latitude', _coordinate(90), False),
+            ('longitude', _coordinate(180), False),
+        ],
+    },
+    'inspiration': {
+        'table': 'daily_inspiration',
+        # One entry per day: re-importing an archive must not fail on existing dates
+        'insert': 'INSERT OR IGNORE',
+        'fields': [
+            ('scripture', _text, True),
+            ('quote', _text, False),
+            ('author', _text, False),
+            ('date', _date, True),
+        ],
+    },
+}
+
+
+def detect_format(path, fmt=None):
+    """csv or jsonl, from an explicit choice or the file extension"""
+    if fmt:
+        return fmt
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def read_records(stream, fmt):
+    """Yield (record number, dict) without loading the file into memory"""
+    if fmt == 'csv':
+        for number, record in enumerate(csv.DictReader(stream), start=1):
+            yield number, record
+    else:
+        number = 0
+        for line in stream:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                yield number, json.loads(line)
+            except ValueError as e:
+                yield number, ValueError(f'invalid JSON: {e}')
+
+
+def validate(records, kind):
+    """Yield (number, row tuple, error) for each record"""
+    fields = KINDS[kind]['fields']
+    for number, record in records:
+        if isinstance(record, Exception):
+            yield number, None, str(record)
+            continue
+        try:
+            row = []
+            for column, convert, required in fields:
+                value = convert(record.get(column))
+                if required and value is None:
+                    raise ValueError(f'missing {column}')
+                row.append(value)
+            yield number, tuple(row), None
+        except (ValueError, TypeError, AttributeError) as e:
+            yield number, None, str(e)
+
+
+def import_stream(conn, kind, stream, fmt, source, batch_size=DEFAULT_BATCH_SIZE,
+                  resume=False, strict=False, progress=None):
+    """Insert validated rows in batched transactions, checkpointing after each batch"""
+    spec = KINDS[kind]
+    columns = [column for column, _, _ in spec['fields']]
+    sql = (f"{spec['insert']} INTO {spec['table']} ({', '.join(columns)}) "
+           f"VALUES ({', '.join('?' for _ in columns)})")
+
+    skip_until = 0
+    if resume:
+        row = conn.execute('SELECT record FROM import_checkpoints WHERE source = ? AND kind = ?',
+                           (source, kind)).fetchone()
+        skip_until = row['record'] if row else 0
+
+    stats = {'read': 0, 'inserted': 0, 'ignored': 0, 'invalid': 0, 'skipped': skip_until}
+    started = time.perf_counter()
+    batch = []
+    last_number = skip_until
+
+    def flush():
+        if batch:
+            cursor = conn.executemany(sql, batch)
+            stats['inserted'] += cursor.rowcount
+            stats['ignored'] += len(batch) - cursor.rowcount
+            batch.clear()
+        # The checkpoint commits atomically with the rows it covers
+        conn.execute('''
+            INSERT INTO import_checkpoints (source, kind, record, updated_at)
+            VALUES (?, ?, ?, datetime('now'))
+            ON CONFLICT (source, kind) DO UPDATE SET record = excluded.record, updated_at = excluded.updated_at
+        ''', (source, kind, last_number))
+        conn.commit()
+        if progress:
+            elapsed = time.perf_counter() - started
+            progress(stats, elapsed)
+
+    for number, row, error in validate(read_records(stream, fmt), kind):
+        if number <= skip_until:
+            continue
+        stats['read'] += 1
+        last_number = number
+        if error:
+            stats['invalid'] += 1
+            click.echo(f'record {number}: {error}', err=True)
+            if strict:
+                flush()
+                raise click.ClickException(f'aborted at record {number} (--strict)')
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+
+    # Finished cleanly: nothing left to resume
+    conn.execute('DELETE FROM import_checkpoints WHERE source = ? AND kind = ?', (source, kind))
+    conn.commit()
+
+    if kind == 'events':
+        recurrence.extend(conn)
+    elif kind == 'branches':
+        branch_finder.sync_schedules(conn)
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    return stats
+
+
+def export_rows(conn, kind, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield dict rows straight from a cursor, fetching batch_size at a time"""
+    spec = KINDS[kind]
+    columns = [column for column, _, _ in spec['fields']]
+    cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {spec['table']} ORDER BY id")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield dict(zip(columns, row))
+
+
+def write_rows(rows, stream, fmt, columns):
+    """Stream rows out as CSV or JSON lines; returns the row count"""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=columns)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            stream.write(json.dumps(row, ensure_ascii=False))
+            stream.write('\n')
+            count += 1
+    return count
+
+
+def register_commands(app):
+    """Add the `flask content import/export` command group"""
+
+    @app.cli.group('content')
+    def content():
+        """Bulk import and export of site content"""
+
+    @content.command('import')
+    @click.argument('kind', type=click.Choice(sorted(KINDS)))
+    @click.argument('path', type=click.Path(allow_dash=True))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+    @click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True)
+    @click.option('--resume', is_flag=True, help='Skip records committed by an earlier, interrupted run.')
+    @click.option('--strict', is_flag=True, help='Stop at the first invalid record.')
+    def import_command(kind, path, fmt, batch_size, resume, strict):
+        """Import KIND records from a CSV or JSON-lines file ('-' for stdin)"""
+        fmt = detect_format(path, fmt)
+        source = 'stdin' if path == '-' else os.path.abspath(path)
+
+        def report(stats, elapsed):
+            rate = stats['read'] / elapsed if elapsed else 0
+            click.echo(f"{stats['read']} records, {stats['inserted']} inserted "
+                       f"({rate:,.0f} records/s)", err=True)
+
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8') if path == '-' \
+            else open(path, newline='', encoding='utf-8')
+        with stream, get_pool().connection() as conn:
+            stats = import_stream(conn, kind, stream, fmt, source, batch_size, resume, strict, report)
+        click.echo(json.dumps(stats))
+
+    @content.command('export')
+    @click.argument('kind', type=click.Choice(sorted(KINDS)))
+    @click.argument('path', type=click.Path(allow_dash=True), default='-')
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+    def export_command(kind, path, fmt):
+        """Export KIND records to a CSV or JSON-lines file ('-' for stdout)"""
+        fmt = detect_format(path, fmt or ('jsonl' if path == '-' else None))
+        columns = [column for column, _, _ in KINDS[kind]['fields']]
+        stream = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        try:
+            with get_pool().connection() as conn:
+                count = write_rows(export_rows(conn, kind), stream, fmt, columns)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        click.echo(f'Exported {count} {kind}', err=True)
@@ -0,0 +1,82 @@
+import json
+import threading
+
+from flask import current_app
+
+import page_cache
+import recurrence
+import rotation
+import query_plans
+
+HOMEPAGE_TAGS = ('events', 'inspiration', 'sermons')
+
+# Everything the homepage shows but today's inspiration, in a single statement
+HOMEPAGE_SQL = '''
+    SELECT 'upcoming_events' AS section,
+           json_object('id', id, 'title', title, 'description', description, 'date', date,
+                       'time', time, 'location', location,
+                       'registration_required', registration_required,
+                       'recurrence', recurrence) AS data
+    FROM (SELECT * FROM event_occurrence_details WHERE date >= date('now') ORDER BY date ASC, id ASC LIMIT 3)
+    UNION ALL
+    SELECT 'recent_sermons',
+           json_object('id', id, 'title', title, 'speaker', speaker, 'date', date,
+                       'scripture', scripture, 'description', description)
+    FROM (SELECT * FROM sermons ORDER BY date DESC, id DESC LIMIT 3)
+'''
+query_plans.register(HOMEPAGE_SQL, 'homepage bundle')
+
+
+def counts(conn):
+    """Row counts per content tag, maintained by triggers instead of COUNT(*)"""
+    rows = conn.execute('SELECT tag, row_count FROM content_counters').fetchall()
+    return dict((row['tag'], row['row_count']) for row in rows)
+
+
+def totals(conn, tag):
+    """Row count for a tag plus its 'tag.<stat>' counters, keyed by tag and stat name"""
+    prefix = tag + '.'
+    return dict((name[len(prefix):] if name.startswith(prefix) else name, count)
+                for name, count in counts(conn).items() if name == tag or name.startswith(prefix))
+
+
+class HomepageMemo:
+    """Process-local copy of the homepage bundle, kept until the next write"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._bundle = None
+
+    def get(self, conn):
+        generations, _ = page_cache.content_state(conn, HOMEPAGE_TAGS)
+        # date('now') in SQLite is UTC, so the bundle rolls over at UTC midnight
+        key = (generations, page_cache.today())
+        with self._lock:
+            bundle = self._bundle if key == self._key else None
+
+        if bundle is None:
+            bundle = load_homepage(conn)
+            with self._lock:
+                self._key, self._bundle = key, bundle
+        # Today's entry has its own cache, keyed on the inspiration generation alone
+        today = rotation.today(conn, generations[HOMEPAGE_TAGS.index('inspiration')])
+        return dict(bundle, today_inspiration=today)
+
+
+def load_homepage(conn):
+    """Upcoming events and recent sermons in one round trip"""
+    bundle = {'upcoming_events': [], 'recent_sermons': []}
+    for row in conn.execute(HOMEPAGE_SQL):
+        bundle[row['section']].append(json.loads(row['data']))
+    return bundle
+
+
+def homepage(conn):
+    """Memoized homepage bundle for the current app"""
+    recurrence.ensure_horizon(conn)
+    return current_app.extensions['homepage_memo'].get(conn)
+
+
+def init_app(app):
+    app.extensions['homepage_memo'] = HomepageMemo()
@@ -0,0 +1,245 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import current_app, g
+
+# Database configuration
+DATABASE = 'database/database.db'
+
+# Pragmas applied once to every pooled connection
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-16000',
+    'PRAGMA mmap_size=67108864',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA busy_timeout=5000',
+)
+
+
+# Set by metrics for sampled requests: each statement appends (sql, seconds) to the list
+query_log = ContextVar('query_log', default=None)
+
+
+def _timed(log, method, sql, args):
+    started = time.perf_counter()
+    try:
+        return method(sql, *args)
+    finally:
+        log.append((sql, time.perf_counter() - started))
+
+
+class ProfiledCursor:
+    """Cursor wrapper that logs each statement's execute time"""
+
+    def __init__(self, cursor, log):
+        self._cursor = cursor
+        self._log = log
+
+    def execute(self, sql, *args):
+        _timed(self._log, self._cursor.execute, sql, args)
+        return self
+
+    def executemany(self, sql, *args):
+        _timed(self._log, self._cursor.executemany, sql, args)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class ProfiledConnection:
+    """Connection wrapper handed out by get_db() while a query log is active
+
+    Only the execute call is timed: preparing the statement and stepping to
+    the first row. Unsampled requests get the bare connection, so they pay
+    nothing for this.
+    """
+
+    def __init__(self, conn, log):
+        self.raw = conn
+        self._log = log
+
+    def execute(self, sql, *args):
+        return _timed(self._log, self.raw.execute, sql, args)
+
+    def executemany(self, sql, *args):
+        return _timed(self._log, self.raw.executemany, sql, args)
+
+    def cursor(self, *args):
+        return ProfiledCursor(self.raw.cursor(*args), self._log)
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+def connect(path=DATABASE):
+    """Open a tuned SQLite connection"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections shared by all request threads"""
+
+    def __init__(self, path=DATABASE, max_size=8, timeout=10.0, prepare=None):
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+        # Called once before the first connection opens, e.g. to migrate the schema
+        self.prepare = prepare
+        self._prepared = False
+        self._prepare_lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._checkouts = 0
+        self._in_use = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+
+    def acquire(self):
+        """Check a connection out of the pool, opening one if there is room"""
+        started = time.perf_counter()
+        conn = None
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if self._created < self.max_size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    self._run_prepare()
+                    conn = connect(self.path)
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise RuntimeError(
+                        f'Timed out after {self.timeout}s waiting for a database connection'
+                    )
+
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+            self._wait_time += waited
+            self._max_wait = max(self._max_wait, waited)
+        return conn
+
+    def _run_prepare(self):
+        if self._prepared or self.prepare is None:
+            return
+        with self._prepare_lock:
+            if not self._prepared:
+                self.prepare()
+                self._prepared = True
+
+    def release(self, conn):
+        """Return a connection to the pool, rolling back anything uncommitted"""
+        with self._lock:
+            self._in_use -= 1
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Broken connection - drop it so a fresh one is opened later
+            with self._lock:
+                self._created -= 1
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Context manager for work outside of a request"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        """Snapshot of pool usage counters"""
+        with self._lock:
+            checkouts = self._checkouts
+            return {
+                'size': self._created,
+                'max_size': self.max_size,
+                'idle': self._idle.qsize(),
+                'in_use': self._in_use,
+                'checkouts': checkouts,
+                'wait_time_total_ms': round(self._wait_time * 1000, 3),
+                'wait_time_avg_ms': round(self._wait_time * 1000 / checkouts, 3) if checkouts else 0.0,
+                'wait_time_max_ms': round(self._max_wait * 1000, 3),
+            }
+
+
+def get_pool(app=None):
+    """Get the connection pool for an app"""
+    app = app or current_app
+    return app.extensions['db_pool']
+
+
+def get_db():
+    """Get the connection for the current app context"""
+    if 'db' not in g:
+        conn = get_pool().acquire()
+        log = query_log.get()
+        g.db = conn if log is None else ProfiledConnection(conn, log)
+    return g.db
+
+
+def close_db(exception=None):
+    """Return the app context connection to the pool"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(getattr(conn, 'raw', conn))
+
+
+def init_app(app):
+    """Attach a connection pool to the app"""
+    app.config.setdefault('DATABASE', DATABASE)
+    app.config.setdefault('DB_POOL_SIZE', 8)
+    app.config.setdefault('DB_POOL_TIMEOUT', 10.0)
+
+    app.extensions['db_pool'] = ConnectionPool(
+        app.config['DATABASE'],
+        max_size=app.config['DB_POOL_SIZE'],
+        timeout=app.config['DB_POOL_TIMEOUT'],
+    )
+    app.teardown_appcontext(close_db)
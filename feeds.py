@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import date, datetime, time, timezone
+from email.utils import format_datetime
+
+from flask import abort, current_app, render_template, send_file, url_for
+
+import jobs
+import page_cache
+import query_plans
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows development machines
+    fcntl = None
+
+DEFAULT_FEED_SIZE = 50
+DEFAULT_MAX_AGE = 300
+
+# Feed formats: kind -> (template, mime type)
+FORMATS = {
+    'rss': ('feeds/rss.xml', 'application/rss+xml'),
+    'atom': ('feeds/atom.xml', 'application/atom+xml'),
+}
+
+# Oldest first, so archive pages only change when old sermons do; the first
+# audio or video attachment becomes the podcast enclosure
+FEED_ITEMS_SQL = '''
+    SELECT s.id, s.title, s.speaker, s.date, s.scripture, s.description,
+           m.id AS media_id, m.mime_type, m.size
+    FROM sermons s
+    LEFT JOIN sermon_media m ON m.id = (
+        SELECT id FROM sermon_media
+        WHERE sermon_id = s.id AND kind IN ('audio', 'video')
+        ORDER BY id LIMIT 1
+    )
+    ORDER BY s.date ASC, s.id ASC
+'''
+query_plans.register(FEED_ITEMS_SQL, 'sermon feed items')
+
+
+class FeedState:
+    """Process-local copy of the feed manifest"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.manifest = None
+        # Sermons generation this process last queued a rebuild for
+        self.requested = None
+
+
+def feed_folder():
+    return current_app.config['FEED_FOLDER']
+
+
+def file_name(kind, page=None):
+    return f'{kind}.xml' if page is None else f'{kind}-{page}.xml'
+
+
+@contextmanager
+def _rebuild_lock(folder):
+    """Cross-process lock so workers don't render the same feeds at once"""
+    with open(os.path.join(folder, '.rebuild.lock'), 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _load_manifest(folder):
+    try:
+        with open(os.path.join(folder, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'generation': None, 'digests': {}, 'etags': {}}
+
+
+def _write(folder, name, data):
+    """Atomically replace one file in the feed folder"""
+    path = os.path.join(folder, name)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def _item(row):
+    """Template values for one sermon, with dates in both feed formats"""
+    published = datetime.combine(date.fromisoformat(row['date']), time(12), timezone.utc)
+    item = dict(row)
+    item['link'] = url_for('sermons', _external=True) + f"#sermon-{row['id']}"
+    item['rfc822'] = format_datetime(published)
+    item['iso'] = published.isoformat()
+    item['enclosure'] = url_for('sermon_media', id=row['media_id'], _external=True) if row['media_id'] else None
+    return item
+
+
+def _digest(rows):
+    return hashlib.sha1(json.dumps([tuple(row) for row in rows]).encode()).hexdigest()
+
+
+def _render(kind, items, page, pages, built):
+    """One feed document; page is None for the subscription feed"""
+    template, _ = FORMATS[kind]
+    endpoint = 'sermon_feed' if kind == 'rss' else 'sermon_atom'
+    archive = 'sermon_feed_archive' if kind == 'rss' else 'sermon_atom_archive'
+
+    if page is None:
+        self_url = url_for(endpoint, _external=True)
+        prev_archive = url_for(archive, page=pages, _external=True) if pages else None
+        next_archive = None
+    else:
+        self_url = url_for(archive, page=page, _external=True)
+        prev_archive = url_for(archive, page=page - 1, _external=True) if page > 1 else None
+        next_archive = url_for(archive, page=page + 1, _external=True) if page < pages else None
+
+    return render_template(template, items=items, self_url=self_url, archive=page is not None,
+                           prev_archive=prev_archive, next_archive=next_archive,
+                           current_url=url_for(endpoint, _external=True),
+                           built_rfc822=format_datetime(built), built_iso=built.isoformat()).encode('utf-8')
+
+
+def rebuild(conn, force=False):
+    """Re-render only the feed files whose sermons changed since the last build"""
+    folder = feed_folder()
+    os.makedirs(folder, exist_ok=True)
+    size = current_app.config['FEED_SIZE']
+    generations, _ = page_cache.content_state(conn, ('sermons',))
+    generation = generations[0]
+
+    with _rebuild_lock(folder):
+        manifest = _load_manifest(folder)
+        if manifest['generation'] == generation and not force:
+            return manifest
+
+        old_digests = {} if force else manifest['digests']
+        digests, etags = {}, {}
+        built = datetime.now(timezone.utc).replace(microsecond=0)
+        written = 0
+
+        # Stream full archive pages oldest-first; the newest rows double as the subscription feed
+        count = conn.execute("SELECT row_count FROM content_counters WHERE tag = 'sermons'").fetchone()[0]
+        pages = count // size
+        latest = deque(maxlen=size)
+        chunk, page = [], 0
+        for row in conn.execute(FEED_ITEMS_SQL):
+            latest.append(row)
+            chunk.append(row)
+            if len(chunk) == size and page < pages:
+                page += 1
+                written += _store(folder, manifest, digests, etags, old_digests, page, pages, chunk, built)
+                chunk = []
+
+        newest = list(reversed(latest))
+        written += _store(folder, manifest, digests, etags, old_digests, None, pages, newest, built)
+
+        # Drop archive pages that no longer exist after deletions
+        for name in set(manifest['digests']) - set(digests):
+            for kind in FORMATS:
+                stale = os.path.join(folder, file_name(kind, int(name)) if name != 'latest' else file_name(kind))
+                if os.path.exists(stale):
+                    os.remove(stale)
+
+        manifest = {'generation': generation, 'digests': digests, 'etags': etags}
+        _write(folder, 'manifest.json', json.dumps(manifest).encode())
+
+    current_app.logger.info('Rebuilt sermon feeds: %d of %d files rewritten', written, (pages + 1) * len(FORMATS))
+    get_state().manifest = manifest
+    return manifest
+
+
+def _store(folder, manifest, digests, etags, old_digests, page, pages, rows, built):
+    """Render a page in every format if its rows (or its neighbours) changed"""
+    # Include what the prev/next archive links depend on, so only affected pages re-render
+    key = 'latest' if page is None else str(page)
+    digest = _digest(rows) + (f':{pages}' if page is None else f':{page < pages}')
+    digests[key] = digest
+    names = [file_name(kind, page) for kind in FORMATS]
+    if old_digests.get(key) == digest and all(os.path.exists(os.path.join(folder, n)) for n in names):
+        for name in names:
+            etags[name] = manifest['etags'][name]
+        return 0
+
+    items = [_item(row) for row in rows]
+    for kind, name in zip(FORMATS, names):
+        data = _render(kind, items, page, pages, built)
+        _write(folder, name, data)
+        etags[name] = hashlib.sha1(data).hexdigest()
+    return len(names)
+
+
+def get_state():
+    return current_app.extensions['feed_state']
+
+
+def current_manifest(conn):
+    """Manifest of the last build; a stale one is served while the job queue rebuilds"""
+    generation = page_cache.content_state(conn, ('sermons',))[0][0]
+    state = get_state()
+    with state.lock:
+        manifest = state.manifest
+    if manifest and manifest['generation'] == generation:
+        return manifest
+
+    manifest = _load_manifest(feed_folder())
+    if not manifest['etags']:
+        # Nothing has ever been built here, so there is nothing to serve instead
+        return rebuild(conn)
+    if manifest['generation'] == generation:
+        with state.lock:
+            state.manifest = manifest
+    elif state.requested != generation:
+        # A poll never renders: one rebuild is queued per generation and the files on disk stay live
+        jobs.enqueue(conn, 'feeds.rebuild', dedupe_key='feeds.rebuild')
+        state.requested = generation
+    return manifest
+
+
+def serve(conn, kind, page=None):
+    """Send a pre-rendered feed file, answering conditional GETs from its stored ETag"""
+    name = file_name(kind, page)
+    etag = current_manifest(conn)['etags'].get(name)
+    if etag is None:
+        abort(404)
+    return send_file(os.path.join(feed_folder(), name), mimetype=FORMATS[kind][1], etag=etag,
+                     conditional=True, max_age=current_app.config['FEED_MAX_AGE'])
+
+
+def init_app(app):
+    app.config.setdefault('FEED_SIZE', DEFAULT_FEED_SIZE)
+    app.config.setdefault('FEED_MAX_AGE', DEFAULT_MAX_AGE)
+    app.config.setdefault('FEED_FOLDER', os.path.join(os.path.dirname(app.config['DATABASE']) or '.', 'feeds'))
+    app.extensions['feed_state'] = FeedState()
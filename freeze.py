@@ -0,0 +1,303 @@
+import hashlib
+import html
+import json
+import mimetypes
+import os
+import re
+import shutil
+from collections import deque
+from urllib.parse import urlsplit
+
+from werkzeug.exceptions import HTTPException
+
+import assets
+import page_cache
+from db import get_pool
+
+DEFAULT_FREEZE_FOLDER = 'build'
+MANIFEST = '.freeze-manifest.json'
+
+SEEDS = ('/', '/sermons', '/events', '/branches', '/inspiration', '/sermons/feed.xml', '/sermons/atom.xml')
+# Left to the origin server: route these paths past the CDN
+DYNAMIC_PREFIXES = ('/admin', '/login', '/logout', '/search', '/api/', '/branches/near', '/branches/services')
+# Views without @cached that still only change with these tags
+SECTION_TAGS = {
+    'sermon_feed': ('sermons',),
+    'sermon_atom': ('sermons',),
+    'sermon_feed_archive': ('sermons',),
+    'sermon_atom_archive': ('sermons',),
+}
+
+ATTR_RE = re.compile(r'\b(href|src|data-src|srcset|data-srcset|url)="([^"]*)"')
+PAGINATION_RE = re.compile(r'<a href="([^"]+)" class="pagination-btn" rel="(prev|next)">')
+
+
+def _sha1(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def fingerprint_static(static_folder, out):
+    """Copy static files under content-hashed names; returns {url: fingerprinted url}"""
+    mapping = {}
+    for root, _, files in os.walk(static_folder):
+        for name in files:
+            source = os.path.join(root, name)
+            relative = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            if relative.startswith(assets.DIST + '/'):
+                # Built bundles are already fingerprinted; keep their precompressed siblings alongside
+                hashed = relative
+            else:
+                with open(source, 'rb') as f:
+                    hashed = assets.hashed_name(relative, f.read())
+                mapping[f'/static/{relative}'] = f'/static/{hashed}'
+            target = os.path.join(out, 'static', hashed)
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copyfile(source, target)
+    return mapping
+
+
+class Freezer:
+    """Crawls the public site through the test client and writes it out as files"""
+
+    def __init__(self, app, out, base_url, full=False):
+        self.app = app
+        self.out = out
+        self.base_url = base_url.rstrip('/')
+        self.full = full
+        self.client = app.test_client()
+        self.adapter = app.url_map.bind(urlsplit(self.base_url).netloc or 'localhost')
+        self.old = self._load_manifest()
+        self.urls = {}
+        self.sections = {}
+        self.links = {}
+        self.stats = {'rendered': 0, 'written': 0, 'unchanged': 0, 'skipped_sections': 0, 'removed': 0}
+
+    def _load_manifest(self):
+        try:
+            with open(os.path.join(self.out, MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'sections': {}, 'urls': {}}
+
+    # Sections: one per endpoint, keyed on the content generations it depends on
+
+    def _endpoint(self, path):
+        try:
+            endpoint, _ = self.adapter.match(path)
+        except HTTPException:
+            return None
+        return endpoint
+
+    def _section_key(self, conn, endpoint):
+        view = self.app.view_functions[endpoint]
+        tags = getattr(view, 'cache_tags', None) or SECTION_TAGS.get(endpoint)
+        if not tags:
+            return None
+        generations, _ = page_cache.content_state(conn, tags)
+        key = f'{tags}={generations}'
+        if getattr(view, 'cache_daily', False):
+            key += f'@{page_cache.today().isoformat()}'
+        return key
+
+    def _fresh(self, conn, endpoint):
+        """Whether an endpoint's pages are unchanged since the last export"""
+        if endpoint not in self.sections:
+            key = self._section_key(conn, endpoint)
+            fresh = (not self.full and key is not None and self.old['sections'].get(endpoint) == key
+                     and all(os.path.exists(os.path.join(self.out, entry['path']))
+                             for entry in self.old['urls'].values() if entry['endpoint'] == endpoint))
+            self.sections[endpoint] = {'key': key, 'fresh': fresh}
+            if fresh:
+                self.stats['skipped_sections'] += 1
+        return self.sections[endpoint]['fresh']
+
+    # Output paths
+
+    def _is_page(self, endpoint):
+        return hasattr(self.app.view_functions[endpoint], 'cache_tags')
+
+    def _local(self, url):
+        """Site-relative path for an internal link, or None for anything else"""
+        if url.startswith(self.base_url + '/'):
+            url = url[len(self.base_url):]
+        if not url.startswith('/') or url.startswith('//') or url.startswith(DYNAMIC_PREFIXES):
+            return None
+        return url.split('#')[0] or None
+
+    def _file_path(self, url, endpoint, mimetype=None):
+        path = urlsplit(url).path
+        if self._is_page(endpoint):
+            return path.strip('/') + '/index.html' if path != '/' else 'index.html'
+        if not os.path.splitext(path)[1] and mimetype:
+            # Static hosts pick the content type from the extension
+            path += mimetypes.guess_extension(mimetype) or ''
+        return path.lstrip('/')
+
+    def _write(self, relative, data):
+        """Write a file only if its bytes changed, so CDN syncs only upload real changes"""
+        target = os.path.join(self.out, relative)
+        digest = _sha1(data)
+        if os.path.exists(target):
+            with open(target, 'rb') as f:
+                if _sha1(f.read()) == digest:
+                    self.stats['unchanged'] += 1
+                    return digest
+        os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(data)
+        self.stats['written'] += 1
+        return digest
+
+    # Crawl
+
+    def run(self, conn):
+        os.makedirs(self.out, exist_ok=True)
+        self.links.update(fingerprint_static(self.app.static_folder, self.out))
+
+        queue = deque((url, None, None) for url in SEEDS)
+        seen = set(SEEDS)
+        while queue:
+            url, owner, page_number = queue.popleft()
+            endpoint = self._endpoint(urlsplit(url).path)
+            if endpoint is None or endpoint == 'static':
+                continue
+            # Seeds are sections; pages reached from them (pagination, archives) belong to the seed
+            section = owner or endpoint
+            if owner is None and self._fresh(conn, section):
+                continue
+            for link, number in self._freeze(url, endpoint, section, page_number):
+                if link not in seen:
+                    seen.add(link)
+                    queue.append((link, section, number))
+
+        self._retain_fresh_sections()
+        self._remove_stale()
+        manifest = {
+            'sections': {ep: s['key'] for ep, s in self.sections.items() if s['key']},
+            'urls': self.urls,
+        }
+        with open(os.path.join(self.out, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        return self.stats
+
+    def _freeze(self, url, endpoint, section, page_number):
+        """Fetch one URL, write it, and return the internal links it contains"""
+        old = self.old['urls'].get(url)
+        # Media and image URLs never change content, so an existing copy is final
+        if not self._is_page(endpoint) and endpoint not in SECTION_TAGS and old \
+                and os.path.exists(os.path.join(self.out, old['path'])):
+            self._record(url, old['path'], old['sha1'], endpoint, section)
+            self.links[url] = '/' + old['path']
+            return []
+
+        response = self.client.get(url, base_url=self.base_url, buffered=False)
+        try:
+            if response.status_code != 200:
+                return []
+            relative = self._file_path(url, endpoint, response.mimetype)
+            if page_number:
+                relative = f"{urlsplit(url).path.strip('/')}/page/{page_number}/index.html"
+            if not self._is_page(endpoint) and not response.mimetype.startswith(('text/', 'application/rss', 'application/atom')):
+                digest = self._stream(response, relative)
+                self._record(url, relative, digest, endpoint, section)
+                self.links[url] = '/' + relative
+                return []
+            body = b''.join(response.iter_encoded()).decode('utf-8')
+        finally:
+            response.close()
+
+        self.stats['rendered'] += 1
+        self.links[url] = '/' + relative.removesuffix('index.html')
+        found = []
+        for link, rel in PAGINATION_RE.findall(body):
+            link = html.unescape(link)
+            number = (page_number or 1) + (1 if rel == 'next' else -1)
+            base = urlsplit(link).path.strip('/')
+            self.links[link] = f'/{base}/' if number == 1 else f'/{base}/page/{number}/'
+            if rel == 'next':
+                found.append((link, number))
+
+        for _, value in ATTR_RE.findall(body):
+            for candidate in value.split(','):
+                link = self._local(html.unescape(candidate.strip().split(' ')[0]))
+                if not link or '?' in link or link.startswith('/static/'):
+                    continue
+                target = self._endpoint(link)
+                if target and not self._is_page(target) and target not in SECTION_TAGS:
+                    # Files are fetched now so this page can link to their final names
+                    if link not in self.urls:
+                        self._freeze(link, target, section, None)
+                else:
+                    found.append((link, None))
+
+        body = ATTR_RE.sub(self._rewrite, body)
+        digest = self._write(relative, body.encode('utf-8'))
+        self._record(url, relative, digest, endpoint, section)
+        return found
+
+    def _stream(self, response, relative):
+        target = os.path.join(self.out, relative)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        digest = hashlib.sha1()
+        with open(target, 'wb') as f:
+            for chunk in response.iter_encoded():
+                digest.update(chunk)
+                f.write(chunk)
+        self.stats['written'] += 1
+        return digest.hexdigest()
+
+    def _rewrite(self, match):
+        """Point links at fingerprinted assets, numbered pages and extension-bearing files"""
+        attribute, value = match.groups()
+        parts = []
+        for candidate in value.split(','):
+            leading = candidate[:len(candidate) - len(candidate.lstrip())]
+            url, _, descriptor = candidate.strip().partition(' ')
+            raw = html.unescape(url)
+            absolute = raw.startswith(self.base_url + '/')
+            local = raw[len(self.base_url):] if absolute else raw
+            target = self.links.get(local)
+            if target:
+                url = html.escape((self.base_url if absolute else '') + target)
+            parts.append(leading + url + (' ' + descriptor if descriptor else ''))
+        return f'{attribute}="{",".join(parts)}"'
+
+    def _record(self, url, relative, digest, endpoint, section):
+        self.urls[url] = {'path': relative, 'sha1': digest, 'endpoint': section or endpoint}
+
+    def _retain_fresh_sections(self):
+        """Carry over files of sections that were skipped this run"""
+        for url, entry in self.old['urls'].items():
+            if url not in self.urls and self.sections.get(entry['endpoint'], {}).get('fresh'):
+                self.urls[url] = entry
+                if entry['path'].endswith('index.html'):
+                    self.links.setdefault(url, '/' + entry['path'].removesuffix('index.html'))
+
+    def _remove_stale(self):
+        """Delete files for pages that vanished from sections rendered this run"""
+        current = {entry['path'] for entry in self.urls.values()}
+        for entry in self.old['urls'].values():
+            path = os.path.join(self.out, entry['path'])
+            if entry['path'] not in current and os.path.exists(path):
+                os.remove(path)
+                self.stats['removed'] += 1
+
+
+def freeze(app, out=None, base_url=None, full=False):
+    """Export the public pages; returns counters for the run"""
+    out = out or app.config['FREEZE_FOLDER']
+    base_url = base_url or app.config['SITE_URL']
+    # Every crawled page comes from the one test client address
+    limited = app.config.get('RATE_LIMIT_ENABLED')
+    app.config['RATE_LIMIT_ENABLED'] = False
+    try:
+        with get_pool(app).connection() as conn:
+            return Freezer(app, out, base_url, full).run(conn)
+    finally:
+        app.config['RATE_LIMIT_ENABLED'] = limited
+
+
+def init_app(app):
+    app.config.setdefault('FREEZE_FOLDER', DEFAULT_FREEZE_FOLDER)
+    app.config.setdefault('SITE_URL', 'http://localhost')
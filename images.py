@@ -0,0 +1,290 @@
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app, url_for
+
+import media
+from db import get_pool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WIDTHS = (320, 640, 960, 1280)
+DEFAULT_QUALITY = 80
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_PIXELS = 40_000_000
+# Variant written for browsers that ignore srcset
+FALLBACK_WIDTH = 960
+
+# Accepted uploads: extension -> mime type
+ALLOWED = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+    '.gif': 'image/gif',
+}
+
+# Output formats: name -> (Pillow format, file extension, mime type)
+FORMATS = {
+    'webp': ('WEBP', 'webp', 'image/webp'),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg'),
+}
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def is_digest(value):
+    return bool(SHA256_RE.match(value or ''))
+
+
+def variants_folder(folder=None):
+    return os.path.join(folder or media.upload_folder(), 'variants')
+
+
+def variant_path(folder, sha256, width, fmt):
+    """Variants are named after the original's digest, so identical uploads share them"""
+    return os.path.join(folder, sha256[:2], f'{sha256}-{width}.{FORMATS[fmt][1]}')
+
+
+def render_variants(source, folder, sha256, widths, quality, max_pixels):
+    """Resize one original to every width and format; runs in a pool process"""
+    from PIL import ExifTags, Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    with Image.open(source) as original:
+        width, height = original.size
+        # Phone photos are often stored sideways with an EXIF rotation; size everything upright
+        sideways = original.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8)
+        if sideways:
+            width, height = height, width
+        targets = sorted({w for w in widths if w < width} | {min(width, max(widths))})
+        # JPEG can decode at reduced scale, far cheaper than decoding full size
+        box = (max(targets), max(targets) * height // width)
+        original.draft('RGB', box[::-1] if sideways else box)
+        image = ImageOps.exif_transpose(original).convert('RGB')
+
+    variants = []
+    for target in targets:
+        target_height = max(1, round(height * target / width))
+        resized = image if target == image.width else image.resize((target, target_height), Image.LANCZOS)
+        for fmt, (pil_format, _, _) in FORMATS.items():
+            path = variant_path(folder, sha256, target, fmt)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f'{path}.{os.getpid()}.tmp'
+                resized.save(temp_path, pil_format, quality=quality, optimize=True)
+                os.replace(temp_path, path)
+            variants.append({
+                'format': fmt,
+                'width': target,
+                'height': target_height,
+                'size': os.path.getsize(path),
+            })
+    return {'width': width, 'height': height, 'variants': variants}
+
+
+class ImagePipeline:
+    """Hands conversions to a process pool and records results when they finish"""
+
+    def __init__(self, app):
+        self.app = app
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def executor(self):
+        with self._lock:
+            # A pool created before a server forked its workers is unusable in the children
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.app.config['IMAGE_WORKERS'],
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def reset(self):
+        with self._lock:
+            self._executor = None
+
+    def submit(self, image_id, sha256):
+        """Queue a conversion and return its future without waiting for it"""
+        config = self.app.config
+        with self.app.app_context():
+            source = media.blob_path(sha256)
+            folder = variants_folder()
+        try:
+            future = self.executor().submit(
+                render_variants, source, folder, sha256,
+                tuple(config['IMAGE_WIDTHS']), config['IMAGE_QUALITY'], config['IMAGE_MAX_PIXELS'],
+            )
+        except (BrokenProcessPool, RuntimeError) as e:
+            self.reset()
+            logger.warning('Could not queue image %s: %s', image_id, e)
+            return None
+        future.add_done_callback(functools.partial(self._finished, image_id, sha256))
+        return future
+
+    def _finished(self, image_id, sha256, future):
+        try:
+            result, error = future.result(), None
+        except BrokenProcessPool as e:
+            self.reset()
+            result, error = None, f'worker crashed: {e}'
+        except Exception as e:
+            result, error = None, f'{type(e).__name__}: {e}'
+
+        try:
+            with get_pool(self.app).connection() as conn:
+                record_result(conn, image_id, sha256, result, error)
+        except Exception:
+            logger.exception('Could not record result for image %s', image_id)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+def record_result(conn, image_id, sha256, result, error=None):
+    """Store variant metadata, unless the image was replaced while converting"""
+    if error:
+        conn.execute('''
+            UPDATE images SET status = 'failed', error = ?, processed_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND sha256 = ?
+        ''', (error[:500], image_id, sha256))
+        conn.commit()
+        logger.warning('Image %s failed: %s', image_id, error)
+        return
+
+    cursor = conn.execute('''
+        UPDATE images SET status = 'ready', error = NULL, width = ?, height = ?, processed_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND sha256 = ?
+    ''', (result['width'], result['height'], image_id, sha256))
+    if cursor.rowcount:
+        conn.execute('DELETE FROM image_variants WHERE image_id = ?', (image_id,))
+        conn.executemany('''
+            INSERT INTO image_variants (image_id, format, width, height, size)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(image_id, v['format'], v['width'], v['height'], v['size']) for v in result['variants']])
+    conn.commit()
+
+
+def get_pipeline():
+    return current_app.extensions['image_pipeline']
+
+
+def save_upload(conn, owner_type, owner_id, upload):
+    """Store an uploaded original and mark it pending; returns (pending, error). The caller commits"""
+    if not upload or not upload.filename:
+        return None, None
+    extension = os.path.splitext(upload.filename)[1].lower()
+    if extension not in ALLOWED:
+        return None, f'{upload.filename}: unsupported image type (allowed: {", ".join(sorted(ALLOWED))})'
+
+    sha256, size = media.store(upload.stream)
+    if size == 0:
+        return None, f'{upload.filename}: file is empty'
+
+    previous = conn.execute('SELECT sha256 FROM images WHERE owner_type = ? AND owner_id = ?',
+                            (owner_type, owner_id)).fetchone()
+    image_id = conn.execute('''
+        INSERT INTO images (owner_type, owner_id, sha256, mime_type)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (owner_type, owner_id) DO UPDATE SET
+            sha256 = excluded.sha256, mime_type = excluded.mime_type, status = 'pending',
+            error = NULL, width = NULL, height = NULL, processed_at = NULL
+        RETURNING id
+    ''', (owner_type, owner_id, sha256, ALLOWED[extension])).fetchone()['id']
+    conn.execute('DELETE FROM image_variants WHERE image_id = ?', (image_id,))
+
+    replaced = previous['sha256'] if previous and previous['sha256'] != sha256 else None
+    return {'id': image_id, 'sha256': sha256, 'replaced': replaced}, None
+
+
+def process(conn, pending):
+    """After the upload commits: drop a replaced original and queue the conversion"""
+    if not pending:
+        return None
+    if pending['replaced']:
+        prune(conn, [pending['replaced']])
+    return get_pipeline().submit(pending['id'], pending['sha256'])
+
+
+def requeue(conn, statuses=('pending',)):
+    """Queue every image in the given states, e.g. after a restart lost in-flight work"""
+    placeholders = ', '.join('?' for _ in statuses)
+    rows = conn.execute(f'SELECT id, sha256 FROM images WHERE status IN ({placeholders})', statuses).fetchall()
+    pipeline = get_pipeline()
+    return [future for future in (pipeline.submit(row['id'], row['sha256']) for row in rows) if future]
+
+
+def hashes_for(conn, owner_type, owner_id):
+    """Original digest for an owner, collected before the owner is deleted"""
+    rows = conn.execute('SELECT sha256 FROM images WHERE owner_type = ? AND owner_id = ?', (owner_type, owner_id))
+    return [row['sha256'] for row in rows]
+
+
+def prune(conn, hashes):
+    """Remove variants and originals no image references any more; run after the delete commits"""
+    folder = variants_folder()
+    for sha256 in set(hashes):
+        if conn.execute('SELECT 1 FROM images WHERE sha256 = ? LIMIT 1', (sha256,)).fetchone():
+            continue
+        directory = os.path.join(folder, sha256[:2])
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.startswith(sha256):
+                    os.remove(os.path.join(directory, name))
+    media.prune(conn, hashes)
+
+
+def for_owners(conn, owner_type, owner_ids):
+    """Picture data for a page of owners, as {owner_id: {src, srcset per format, width, height}}"""
+    pictures = {}
+    if not owner_ids:
+        return pictures
+    rows = conn.execute('''
+        SELECT i.owner_id, i.sha256, i.status, i.width, i.height, v.format, v.width AS variant_width
+        FROM images i LEFT JOIN image_variants v ON v.image_id = i.id
+        WHERE i.owner_type = ? AND i.owner_id IN (SELECT value FROM json_each(?))
+    ''', (owner_type, json.dumps(list(owner_ids)))).fetchall()
+
+    for row in rows:
+        picture = pictures.setdefault(row['owner_id'], {
+            'sha256': row['sha256'],
+            'src': url_for('image_file', sha256=row['sha256']),
+            'width': row['width'],
+            'height': row['height'],
+            'srcset': {},
+        })
+        if row['status'] == 'ready' and row['format']:
+            picture['srcset'].setdefault(row['format'], []).append(row['variant_width'])
+
+    for picture in pictures.values():
+        sha256 = picture.pop('sha256')
+        jpeg_widths = sorted(picture['srcset'].get('jpeg', []))
+        if jpeg_widths:
+            fallback = max([w for w in jpeg_widths if w <= FALLBACK_WIDTH] or jpeg_widths[:1])
+            picture['src'] = url_for('image_file', sha256=sha256, width=fallback, fmt='jpeg')
+        picture['srcset'] = {
+            fmt: ', '.join(f"{url_for('image_file', sha256=sha256, width=w, fmt=fmt)} {w}w" for w in sorted(widths))
+            for fmt, widths in picture['srcset'].items()
+        }
+    return pictures
+
+
+def init_app(app):
+    app.config.setdefault('IMAGE_WIDTHS', DEFAULT_WIDTHS)
+    app.config.setdefault('IMAGE_QUALITY', DEFAULT_QUALITY)
+    app.config.setdefault('IMAGE_WORKERS', DEFAULT_WORKERS)
+    app.config.setdefault('IMAGE_MAX_PIXELS', DEFAULT_MAX_PIXELS)
+    app.extensions['image_pipeline'] = ImagePipeline(app)
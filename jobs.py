@@ -0,0 +1,304 @@
+import json
+import os
+import signal
+import socket
+import threading
+import time
+
+import click
+from flask import current_app
+
+import content_summary
+from db import get_pool
+
+DEFAULT_CONCURRENCY = 2
+DEFAULT_POLL_SECONDS = 1.0
+DEFAULT_MAX_ATTEMPTS = 5
+# A job still 'running' after this long lost its worker (crash, kill -9) and is queued again
+DEFAULT_TIMEOUT = 900
+DEFAULT_KEEP_DAYS = 7
+# A due job waiting longer than this means no worker is taking jobs; the dashboard warns
+DEFAULT_STALL_SECONDS = 300
+# Retry n waits RETRY_BASE_SECONDS * 2**(n-1), capped
+RETRY_BASE_SECONDS = 10
+RETRY_MAX_SECONDS = 3600
+# Finished jobs the latency figures are taken from
+LATENCY_SAMPLE = 200
+
+# Task name -> Task, filled by the @task decorator
+TASKS = {}
+
+
+class Task:
+    def __init__(self, name, func, max_attempts, every):
+        self.name = name
+        self.func = func
+        self.max_attempts = max_attempts
+        self.every = every
+
+
+def task(name, max_attempts=DEFAULT_MAX_ATTEMPTS, every=None):
+    """Register f(conn, **args) as a background task; `every` (seconds) makes it periodic"""
+    def decorator(f):
+        TASKS[name] = Task(name, f, max_attempts, every)
+        return f
+    return decorator
+
+
+def enqueue(conn, name, args=None, dedupe_key=None, delay=0, run_at=None):
+    """Queue a task; returns the job id, or None if a job with the same dedupe key is already waiting"""
+    now = time.time()
+    cursor = conn.execute('''
+        INSERT INTO jobs (task, args, dedupe_key, max_attempts, run_at, enqueued_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (dedupe_key) WHERE dedupe_key IS NOT NULL AND status = 'queued' DO NOTHING
+    ''', (name, json.dumps(args or {}, sort_keys=True), dedupe_key, TASKS[name].max_attempts,
+          run_at if run_at is not None else now + delay, now))
+    conn.commit()
+    job_id = cursor.lastrowid if cursor.rowcount else None
+    if job_id and current_app.config['JOBS_EAGER'] and not delay and run_at is None:
+        # No worker process (development): run it now, in the request
+        job = _claim(conn, 'eager', job_id)
+        if job:
+            execute(conn, job)
+    return job_id
+
+
+def _claim(conn, worker, job_id=None):
+    """Mark the next due job (or a given one) as running and return it"""
+    now = time.time()
+    if job_id is None:
+        row = conn.execute('''
+            UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, worker = ?
+            WHERE id = (
+                -- Without statistics the planner would rather sort every waiting job by hand
+                SELECT id FROM jobs INDEXED BY idx_jobs_due
+                WHERE status = 'queued' AND run_at <= ? ORDER BY run_at, id LIMIT 1
+            )
+            RETURNING *
+        ''', (now, worker, now)).fetchone()
+    else:
+        row = conn.execute('''
+            UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, worker = ?
+            WHERE id = ? AND status = 'queued'
+            RETURNING *
+        ''', (now, worker, job_id)).fetchone()
+    conn.commit()
+    return row
+
+
+def execute(conn, job):
+    """Run a claimed job and record the outcome: done, queued again with backoff, or failed"""
+    handler = TASKS.get(job['task'])
+    try:
+        if handler is None:
+            raise LookupError(f"unknown task {job['task']!r}")
+        handler.func(conn, **json.loads(job['args']))
+    except Exception as e:
+        conn.rollback()
+        current_app.logger.exception('Job %s (%s) failed on attempt %d', job['id'], job['task'], job['attempts'])
+        error = f'{type(e).__name__}: {e}'
+        if handler is not None and job['attempts'] < job['max_attempts'] and _retry(conn, job, error):
+            return False
+        conn.execute('''
+            UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE id = ?
+        ''', (time.time(), error, job['id']))
+        conn.commit()
+    else:
+        conn.execute("UPDATE jobs SET status = 'done', finished_at = ?, error = NULL WHERE id = ?",
+                     (time.time(), job['id']))
+        conn.commit()
+    if handler is not None and handler.every:
+        enqueue(conn, handler.name, dedupe_key=f'periodic:{handler.name}', delay=handler.every)
+    return True
+
+
+def _retry(conn, job, error):
+    delay = min(RETRY_BASE_SECONDS * 2 ** (job['attempts'] - 1), RETRY_MAX_SECONDS)
+    # A newer copy already waiting under the same key makes this retry redundant
+    cursor = conn.execute('''
+        UPDATE jobs SET status = 'queued', run_at = ?, error = ?
+        WHERE id = ? AND NOT EXISTS (
+            SELECT 1 FROM jobs WHERE dedupe_key = ? AND status = 'queued'
+        )
+    ''', (time.time() + delay, error, job['id'], job['dedupe_key']))
+    conn.commit()
+    return cursor.rowcount > 0
+
+
+def requeue_stale(conn, timeout=None):
+    """Queue again jobs whose worker died mid-run; returns how many"""
+    timeout = timeout or current_app.config['JOBS_TIMEOUT']
+    now = time.time()
+    cutoff = now - timeout
+    # Only one job per key may wait: the newest lost copy, unless another is already queued
+    cursor = conn.execute('''
+        UPDATE jobs SET status = 'queued', run_at = ?, error = 'worker lost'
+        WHERE status = 'running' AND started_at < ? AND (dedupe_key IS NULL OR (
+            id = (SELECT MAX(id) FROM jobs AS lost
+                  WHERE lost.dedupe_key = jobs.dedupe_key AND lost.status = 'running' AND lost.started_at < ?)
+            AND NOT EXISTS (
+                SELECT 1 FROM jobs AS waiting WHERE waiting.dedupe_key = jobs.dedupe_key AND waiting.status = 'queued'
+            )
+        ))
+    ''', (now, cutoff, cutoff))
+    requeued = cursor.rowcount
+    # The other lost copies are superseded
+    conn.execute('''
+        UPDATE jobs SET status = 'failed', finished_at = ?, error = 'worker lost'
+        WHERE status = 'running' AND started_at < ?
+    ''', (now, cutoff))
+    conn.commit()
+    return requeued
+
+
+def schedule_periodic(conn):
+    """Make sure every periodic task has a run waiting; a restart keeps the existing schedule"""
+    for name, handler in sorted(TASKS.items()):
+        if handler.every:
+            enqueue(conn, name, dedupe_key=f'periodic:{name}', run_at=time.time())
+
+
+@task('jobs.prune', every=3600)
+def prune(conn):
+    """Forget finished jobs older than JOBS_KEEP_DAYS"""
+    cutoff = time.time() - current_app.config['JOBS_KEEP_DAYS'] * 86400
+    conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (cutoff,))
+    conn.commit()
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else None
+
+
+def _millis(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def stats(conn):
+    """Jobs per status, wait of the oldest due job, and wait/run latency of recent jobs
+
+    Counts come from trigger-maintained counters and every other query reads
+    a bounded index range, so this costs the same however long the history grows.
+    stalled is set once the oldest due job has waited JOBS_STALL_SECONDS, which
+    usually means no `flask jobs run` process is running.
+    """
+    now = time.time()
+    counts = content_summary.totals(conn, 'jobs')
+    oldest = conn.execute('''
+        SELECT run_at FROM jobs INDEXED BY idx_jobs_due WHERE status = 'queued' ORDER BY run_at LIMIT 1
+    ''').fetchone()
+    recent = conn.execute('''
+        SELECT started_at - run_at AS wait, finished_at - started_at AS run FROM jobs
+        WHERE status = 'done' ORDER BY finished_at DESC LIMIT ?
+    ''', (LATENCY_SAMPLE,)).fetchall()
+    waits = sorted(max(0.0, row['wait']) for row in recent)
+    runs = sorted(row['run'] for row in recent)
+    failures = conn.execute('''
+        SELECT id, task, attempts, error, finished_at FROM jobs
+        WHERE status = 'failed' ORDER BY finished_at DESC LIMIT 5
+    ''').fetchall()
+    oldest_wait_ms = _millis(now - oldest['run_at']) if oldest and oldest['run_at'] <= now else 0
+    return {
+        'queued': counts.get('queued', 0),
+        'running': counts.get('running', 0),
+        'done': counts.get('done', 0),
+        'failed': counts.get('failed', 0),
+        'oldest_wait_ms': oldest_wait_ms,
+        'stalled': oldest_wait_ms >= current_app.config['JOBS_STALL_SECONDS'] * 1000,
+        'wait_ms': {'avg': _millis(sum(waits) / len(waits)) if waits else None,
+                    'p95': _millis(_percentile(waits, 0.95))},
+        'run_ms': {'avg': _millis(sum(runs) / len(runs)) if runs else None,
+                   'p95': _millis(_percentile(runs, 0.95))},
+        'recent_failures': [dict(row) for row in failures],
+    }
+
+
+def _context(app):
+    # A request context for SITE_URL, so tasks can build absolute links with url_for
+    return app.test_request_context(base_url=app.config['SITE_URL'])
+
+
+def work(app, stop, poll, once=False):
+    """One worker thread: claim, run, repeat until stopped (or, with once, until the queue is empty)"""
+    worker = f'{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}'
+    pool = get_pool(app)
+    with _context(app):
+        while not stop.is_set():
+            with pool.connection() as conn:
+                job = _claim(conn, worker)
+                if job is not None:
+                    execute(conn, job)
+                    continue
+            if once:
+                return
+            stop.wait(poll)
+
+
+def run(app, concurrency=None, once=False):
+    """Run worker threads in this process until SIGTERM/SIGINT; returns after the current jobs finish"""
+    concurrency = concurrency or app.config['JOBS_CONCURRENCY']
+    poll = app.config['JOBS_POLL_SECONDS']
+    stop = threading.Event()
+    if not once:
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stop.set())
+
+    with _context(app), get_pool(app).connection() as conn:
+        lost = requeue_stale(conn)
+        schedule_periodic(conn)
+    if lost:
+        app.logger.warning('Re-queued %d jobs left running by a lost worker', lost)
+
+    threads = [threading.Thread(target=work, args=(app, stop, poll, once), name=f'jobs-{n}')
+               for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    # Check for lost jobs now and then while the workers run
+    while any(thread.is_alive() for thread in threads):
+        if stop.wait(60 if not once else 0.1):
+            break
+        if not once:
+            with _context(app), get_pool(app).connection() as conn:
+                requeue_stale(conn)
+    for thread in threads:
+        thread.join()
+
+
+def register_commands(app):
+    """Add the `flask jobs` command group"""
+
+    @app.cli.group('jobs')
+    def jobs():
+        """Background job queue"""
+
+    @jobs.command('run')
+    @click.option('--concurrency', type=int, help='Worker threads. Defaults to JOBS_CONCURRENCY.')
+    @click.option('--once', is_flag=True, help='Exit when no job is due instead of waiting for more.')
+    def run_command(concurrency, once):
+        """Run queued jobs until stopped"""
+        click.echo(f"Running jobs with {concurrency or app.config['JOBS_CONCURRENCY']} workers")
+        run(app, concurrency, once)
+
+    @jobs.command('enqueue')
+    @click.argument('name', type=click.Choice(sorted(TASKS)))
+    def enqueue_command(name):
+        """Queue a task by name, e.g. after a bulk change made outside the admin"""
+        with get_pool().connection() as conn:
+            job_id = enqueue(conn, name, dedupe_key=name)
+        click.echo(f'Queued job {job_id}' if job_id else f'{name} is already queued')
+
+    @jobs.command('stats')
+    def stats_command():
+        """Print queue depth and latency as JSON"""
+        with get_pool().connection() as conn:
+            click.echo(json.dumps(stats(conn), indent=2))
+
+
+def init_app(app):
+    app.config.setdefault('JOBS_CONCURRENCY', DEFAULT_CONCURRENCY)
+    app.config.setdefault('JOBS_POLL_SECONDS', DEFAULT_POLL_SECONDS)
+    app.config.setdefault('JOBS_TIMEOUT', DEFAULT_TIMEOUT)
+    app.config.setdefault('JOBS_KEEP_DAYS', DEFAULT_KEEP_DAYS)
+    app.config.setdefault('JOBS_STALL_SECONDS', DEFAULT_STALL_SECONDS)
+    app.config.setdefault('JOBS_EAGER', False)
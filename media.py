@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from flask import current_app
+
+DEFAULT_UPLOAD_FOLDER = 'uploads'
+CHUNK_SIZE = 1024 * 1024
+# Blobs are named by their content, so a URL's bytes never change
+MAX_AGE = 365 * 24 * 3600
+
+# Accepted uploads: extension -> (kind, mime type)
+ALLOWED = {
+    '.mp3': ('audio', 'audio/mpeg'),
+    '.m4a': ('audio', 'audio/mp4'),
+    '.aac': ('audio', 'audio/aac'),
+    '.ogg': ('audio', 'audio/ogg'),
+    '.wav': ('audio', 'audio/wav'),
+    '.mp4': ('video', 'video/mp4'),
+    '.m4v': ('video', 'video/mp4'),
+    '.webm': ('video', 'video/webm'),
+    '.mov': ('video', 'video/quicktime'),
+    '.pdf': ('pdf', 'application/pdf'),
+}
+
+
+def upload_folder():
+    """Directory holding content-addressed media blobs"""
+    return current_app.config.get('UPLOAD_FOLDER', DEFAULT_UPLOAD_FOLDER)
+
+
+def blob_path(sha256, folder=None):
+    """Where a blob with this digest lives, fanned out by its first two hex digits"""
+    return os.path.join(folder or upload_folder(), sha256[:2], sha256)
+
+
+def classify(filename):
+    """(kind, mime type) for an upload, or ValueError if the type isn't accepted"""
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension not in ALLOWED:
+        raise ValueError(f'{filename or "file"}: unsupported type (allowed: {", ".join(sorted(ALLOWED))})')
+    return ALLOWED[extension]
+
+
+def store(stream, folder=None):
+    """Copy a stream to disk in chunks while hashing it; returns (sha256, size), or (None, 0) if it was empty"""
+    folder = folder or upload_folder()
+    os.makedirs(folder, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+
+    # Write beside the final location so the rename below is atomic
+    fd, temp_path = tempfile.mkstemp(prefix='.upload-', dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+
+        if size == 0:
+            # Nothing to keep; the caller rejects the upload
+            os.remove(temp_path)
+            return None, 0
+
+        sha256 = digest.hexdigest()
+        path = blob_path(sha256, folder)
+        if os.path.exists(path):
+            # Same bytes already stored
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return sha256, size
+
+
+def attach(conn, sermon_id, upload):
+    """Store an uploaded file and link it to a sermon; the caller commits"""
+    kind, mime_type = classify(upload.filename)
+    sha256, size = store(upload.stream)
+    if size == 0:
+        raise ValueError(f'{upload.filename}: file is empty')
+    cursor = conn.execute('''
+        INSERT INTO sermon_media (sermon_id, sha256, kind, filename, mime_type, size)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (sermon_id, sha256, kind, os.path.basename(upload.filename), mime_type, size))
+    return cursor.lastrowid
+
+
+def attach_all(conn, sermon_id, uploads):
+    """Attach every non-empty file field; returns (attached count, error messages)"""
+    attached, errors = 0, []
+    for upload in uploads:
+        if not upload or not upload.filename:
+            continue
+        try:
+            attach(conn, sermon_id, upload)
+            attached += 1
+        except ValueError as e:
+            errors.append(str(e))
+    return attached, errors
+
+
+def hashes_for_sermon(conn, sermon_id):
+    """Digests referenced by a sermon, collected before it is deleted"""
+    # prune() dedupes, so no DISTINCT (and no temp B-tree) here
+    rows = conn.execute('SELECT sha256 FROM sermon_media WHERE sermon_id = ?', (sermon_id,))
+    return [row['sha256'] for row in rows]
+
+
+def prune(conn, hashes):
+    """Remove blobs no longer referenced by an attachment or image; run after the delete commits"""
+    removed = 0
+    for sha256 in set(hashes):
+        in_use = conn.execute('''
+            SELECT 1 FROM sermon_media WHERE sha256 = ?
+            UNION ALL
+            SELECT 1 FROM images WHERE sha256 = ?
+            LIMIT 1
+        ''', (sha256, sha256)).fetchone()
+        path = blob_path(sha256)
+        if not in_use and os.path.exists(path):
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def for_sermons(conn, sermon_ids):
+    """Attachments for a page of sermons, as {sermon_id: [media dicts]}"""
+    grouped = {}
+    if not sermon_ids:
+        return grouped
+    rows = conn.execute('''
+        SELECT id, sermon_id, kind, filename, mime_type, size
+        FROM sermon_media
+        WHERE sermon_id IN (SELECT value FROM json_each(?))
+        ORDER BY sermon_id, id
+    ''', (json.dumps(list(sermon_ids)),))
+    for row in rows:
+        grouped.setdefault(row['sermon_id'], []).append(dict(row))
+    return grouped
+
+
+def init_app(app):
+    app.config.setdefault('UPLOAD_FOLDER', DEFAULT_UPLOAD_FOLDER)
@@ -0,0 +1,315 @@
+import bisect
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from flask import Response, before_render_template, current_app, request, template_rendered
+
+import db
+import jobs
+from page_cache import get_cache
+from ratelimit import get_limiter
+
+DEFAULT_SLOW_MS = 500
+DEFAULT_SAMPLE_RATE = 0.1
+
+# Latency buckets in seconds, as Prometheus client libraries use by default
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Statements shown per slow request in the log
+SLOW_LOG_QUERIES = 20
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram"""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class EndpointStats:
+    """Per-endpoint counters; SQL and template figures come from sampled requests only"""
+
+    __slots__ = ('latency', 'statuses', 'sampled', 'queries', 'query_time', 'render_time', 'slow')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.statuses = {}
+        self.sampled = 0
+        self.queries = 0
+        self.query_time = 0.0
+        self.render_time = 0.0
+        self.slow = 0
+
+
+class Profile:
+    """What one sampled request spent on SQL and templates"""
+
+    __slots__ = ('queries', 'render_time', 'render_started')
+
+    def __init__(self):
+        self.queries = []
+        self.render_time = 0.0
+        self.render_started = []
+
+
+class Metrics:
+    """Process-wide request metrics; each worker process keeps its own"""
+
+    def __init__(self, slow_ms=DEFAULT_SLOW_MS, sample_rate=DEFAULT_SAMPLE_RATE):
+        self.slow = slow_ms / 1000
+        self.sample_rate = sample_rate
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, status, elapsed, profile):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = EndpointStats()
+            stats.latency.observe(elapsed)
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            if elapsed >= self.slow:
+                stats.slow += 1
+            if profile is not None:
+                stats.sampled += 1
+                stats.queries += len(profile.queries)
+                stats.query_time += sum(seconds for _, seconds in profile.queries)
+                stats.render_time += profile.render_time
+
+    def snapshot(self):
+        """{endpoint: dict of counters}, copied under the lock"""
+        with self._lock:
+            return {endpoint: {
+                'buckets': list(stats.latency.counts),
+                'sum': stats.latency.sum,
+                'count': stats.latency.count,
+                'statuses': dict(stats.statuses),
+                'slow': stats.slow,
+                'sampled': stats.sampled,
+                'queries': stats.queries,
+                'query_time': stats.query_time,
+                'render_time': stats.render_time,
+            } for endpoint, stats in self._endpoints.items()}
+
+
+def get_metrics(app=None):
+    app = app or current_app
+    return app.extensions['metrics']
+
+
+class _Closing:
+    """Response iterable that runs a callback once the server closes it; lighter than werkzeug's ClosingIterator"""
+
+    __slots__ = ('_iterable', '_callback')
+
+    def __init__(self, iterable, callback):
+        self._iterable = iterable
+        self._callback = callback
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+    def close(self):
+        try:
+            if hasattr(self._iterable, 'close'):
+                self._iterable.close()
+        finally:
+            self._callback()
+
+
+def _closing_hook(close, callback):
+    def hook():
+        try:
+            if close is not None:
+                close()
+        finally:
+            callback()
+    return hook
+
+
+# Set for sampled requests, so template signals can find their profile without the request proxy
+_profile = ContextVar('request_profile', default=None)
+
+
+class RequestTimer:
+    """WSGI middleware that times each request until its body has been sent
+
+    Working on the WSGI environ keeps the common unsampled path free of Flask's
+    context-local proxies, which cost about a microsecond per access.
+    """
+
+    def __init__(self, wsgi_app, app):
+        self.wsgi_app = wsgi_app
+        self.app = app
+        self.metrics = app.extensions['metrics']
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        rate = self.metrics.sample_rate
+        profile = Profile() if rate and (rate >= 1 or random.random() < rate) else None
+        tokens = (_profile.set(profile), db.query_log.set(profile.queries)) if profile else None
+        status = []
+
+        def capture(status_line, headers, exc_info=None):
+            status.append(status_line)
+            return start_response(status_line, headers, exc_info)
+
+        def finish():
+            elapsed = time.perf_counter() - started
+            if tokens:
+                _profile.reset(tokens[0])
+                db.query_log.reset(tokens[1])
+            endpoint = environ.get('metrics.endpoint') or 'unmatched'
+            code = int(status[0][:3]) if status else 500
+            self.metrics.record(endpoint, code, elapsed, profile)
+            if elapsed >= self.metrics.slow:
+                self._log_slow(environ, endpoint, elapsed, profile)
+
+        try:
+            app_iter = self.wsgi_app(environ, capture)
+        except BaseException:
+            finish()
+            raise
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None and isinstance(app_iter, file_wrapper):
+            # Servers only sendfile their own wrapper class, so hook its close in place
+            app_iter.close = _closing_hook(getattr(app_iter, 'close', None), finish)
+            return app_iter
+        # Streamed bodies are timed until the server closes the iterator
+        return _Closing(app_iter, finish)
+
+    def _log_slow(self, environ, endpoint, elapsed, profile):
+        path = environ.get('PATH_INFO', '') + ('?' + environ['QUERY_STRING'] if environ.get('QUERY_STRING') else '')
+        message = f"Slow request: {environ['REQUEST_METHOD']} {path} ({endpoint}) took {elapsed * 1000:.1f} ms"
+        if profile is None:
+            self.app.logger.warning(message + ' (not sampled, no SQL recorded)')
+            return
+
+        query_time = sum(seconds for _, seconds in profile.queries)
+        lines = [f'{message}; {len(profile.queries)} queries {query_time * 1000:.1f} ms, '
+                 f'templates {profile.render_time * 1000:.1f} ms']
+        for sql, seconds in sorted(profile.queries, key=lambda q: q[1], reverse=True)[:SLOW_LOG_QUERIES]:
+            lines.append(f'  {seconds * 1000:8.2f} ms  {" ".join(sql.split())}')
+        self.app.logger.warning('\n'.join(lines))
+
+
+def _note_endpoint():
+    # One proxy lookup; the middleware reads the endpoint back from the environ
+    current = request._get_current_object()
+    current.environ['metrics.endpoint'] = current.endpoint
+
+
+def _render_started(sender, template, context, **extra):
+    profile = _profile.get()
+    if profile is not None:
+        profile.render_started.append(time.perf_counter())
+
+
+def _render_finished(sender, template, context, **extra):
+    profile = _profile.get()
+    if profile is not None and profile.render_started:
+        # Included templates render inside their parent; count only the outermost
+        started = profile.render_started.pop()
+        if not profile.render_started:
+            profile.render_time += time.perf_counter() - started
+
+
+# Prometheus text format
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def exposition():
+    """All metrics in the Prometheus text format"""
+    snapshot = get_metrics().snapshot()
+    lines = [
+        '# HELP http_request_duration_seconds Request latency by endpoint.',
+        '# TYPE http_request_duration_seconds histogram',
+    ]
+    for endpoint, stats in sorted(snapshot.items()):
+        label = _label(endpoint)
+        cumulative = 0
+        for bound, bucket in zip(BUCKETS + ('+Inf',), stats['buckets']):
+            cumulative += bucket
+            lines.append(f'http_request_duration_seconds_bucket{{endpoint="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'http_request_duration_seconds_sum{{endpoint="{label}"}} {stats["sum"]:.6f}')
+        lines.append(f'http_request_duration_seconds_count{{endpoint="{label}"}} {stats["count"]}')
+
+    lines += ['# HELP http_responses_total Responses by endpoint and status code.',
+              '# TYPE http_responses_total counter']
+    for endpoint, stats in sorted(snapshot.items()):
+        for status, count in sorted(stats['statuses'].items()):
+            lines.append(f'http_responses_total{{endpoint="{_label(endpoint)}",status="{status}"}} {count}')
+
+    counters = (
+        ('http_slow_requests_total', 'Requests slower than METRICS_SLOW_MS.', 'slow'),
+        ('http_sampled_requests_total', 'Requests profiled for SQL and template time.', 'sampled'),
+        ('sql_queries_total', 'SQL statements executed by sampled requests.', 'queries'),
+        ('sql_query_seconds_total', 'Time in SQL execute calls for sampled requests.', 'query_time'),
+        ('template_render_seconds_total', 'Template rendering time for sampled requests.', 'render_time'),
+    )
+    for name, help_text, field in counters:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for endpoint, stats in sorted(snapshot.items()):
+            value = stats[field]
+            value = f'{value:.6f}' if isinstance(value, float) else value
+            lines.append(f'{name}{{endpoint="{_label(endpoint)}"}} {value}')
+
+    pool = db.get_pool().stats()
+    cache = get_cache().stats()
+    queue = jobs.stats(db.get_db())
+    gauges = (
+        ('db_pool_connections', 'Open pooled connections.', pool['size']),
+        ('db_pool_in_use', 'Connections checked out.', pool['in_use']),
+        ('db_pool_wait_seconds_total', 'Time spent waiting for a connection.', round(pool['wait_time_total_ms'] / 1000, 6)),
+        ('page_cache_entries', 'Rendered pages held in the cache.', cache['entries']),
+        ('page_cache_hits_total', 'Page cache hits.', cache['hits']),
+        ('page_cache_misses_total', 'Page cache misses.', cache['misses']),
+        ('jobs_queued', 'Background jobs waiting, including ones scheduled for later.', queue['queued']),
+        ('jobs_running', 'Background jobs being run.', queue['running']),
+        ('jobs_failed', 'Background jobs that used up their retries.', queue['failed']),
+        ('jobs_oldest_wait_seconds', 'How long the oldest due job has waited.', round(queue['oldest_wait_ms'] / 1000, 3)),
+        ('jobs_stalled', 'Whether the oldest due job has waited past JOBS_STALL_SECONDS.', int(queue['stalled'])),
+    )
+    for name, help_text, value in gauges:
+        kind = 'counter' if name.endswith('_total') else 'gauge'
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}']
+
+    limits = get_limiter().stats()['limits']
+    counters = (
+        ('rate_limit_allowed_total', 'Requests let through by a rate limit.', 'allowed'),
+        ('rate_limit_rejected_total', 'Requests rejected with 429 by a rate limit.', 'rejected'),
+        ('rate_limit_store_calls_total', 'Token leases taken from the shared store.', 'store_calls'),
+    )
+    for name, help_text, field in counters:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for limit, stats in sorted(limits.items()):
+            lines.append(f'{name}{{limit="{_label(limit)}"}} {stats[field]}')
+
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('METRICS_SLOW_MS', DEFAULT_SLOW_MS)
+    app.config.setdefault('METRICS_SAMPLE_RATE', DEFAULT_SAMPLE_RATE)
+    app.config.setdefault('METRICS_ALLOWLIST', ())
+    app.extensions['metrics'] = Metrics(app.config['METRICS_SLOW_MS'], app.config['METRICS_SAMPLE_RATE'])
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    app.before_request_funcs.setdefault(None, []).insert(0, _note_endpoint)
+    app.wsgi_app = RequestTimer(app.wsgi_app, app)
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
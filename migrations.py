@@ -0,0 +1,784 @@
+import hashlib
+import sqlite3
+from contextlib import contextmanager
+
+import db
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows development machines
+    fcntl = None
+
+# Ordered list of (version, description, function)
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register a schema migration"""
+    def decorator(f):
+        MIGRATIONS.append((version, description, f))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return f
+    return decorator
+
+
+def latest_version():
+    """Highest registered migration version"""
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(conn):
+    """Schema version recorded in the database (0 for a fresh file)"""
+    try:
+        row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+@contextmanager
+def _migration_lock(path):
+    """Cross-process lock so only one worker migrates at a time"""
+    lock_path = path + '.migrate.lock'
+    with open(lock_path, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def migrate(path=db.DATABASE):
+    """Apply pending migrations, returning the list of versions applied"""
+    conn = db.connect(path)
+    try:
+        # Fast path: every worker after the first pays a single query
+        if current_version(conn) >= latest_version():
+            return []
+
+        applied = []
+        with _migration_lock(path):
+            # Another worker may have finished while we waited for the lock
+            version = current_version(conn)
+            conn.isolation_level = None
+            for number, description, func in MIGRATIONS:
+                if number <= version:
+                    continue
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    func(conn)
+                    conn.execute('''
+                        CREATE TABLE IF NOT EXISTS schema_version (
+                            version INTEGER PRIMARY KEY,
+                            description TEXT NOT NULL,
+                            applied_at TEXT NOT NULL DEFAULT (datetime('now'))
+                        )
+                    ''')
+                    conn.execute(
+                        'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                        (number, description),
+                    )
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+                applied.append(number)
+                print(f"Applied migration {number}: {description}")
+        return applied
+    finally:
+        conn.close()
+
+
+@migration(1, 'Create core tables')
+def create_core_tables(conn):
+    # Create users table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            email TEXT,
+            role TEXT DEFAULT 'user'
+        )
+    ''')
+
+    # Create sermons table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sermons (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            speaker TEXT NOT NULL,
+            date TEXT NOT NULL,
+            scripture TEXT,
+            description TEXT
+        )
+    ''')
+
+    # Create events table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT,
+            date TEXT NOT NULL,
+            time TEXT,
+            location TEXT,
+            registration_required INTEGER DEFAULT 0
+        )
+    ''')
+
+    # Create branches table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS branches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            address TEXT NOT NULL,
+            phone TEXT,
+            email TEXT,
+            service_times TEXT
+        )
+    ''')
+
+    # Create daily inspiration table
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_inspiration (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scripture TEXT NOT NULL,
+            quote TEXT,
+            author TEXT,
+            date TEXT UNIQUE NOT NULL
+        )
+    ''')
+
+
+# Sample data for demonstration
+SAMPLE_SERMONS = [
+    ('The Power of Faith', 'Pastor John', '2024-01-15', 'Hebrews 11:1', 'Understanding the essence of faith'),
+    ('Love Your Neighbor', 'Pastor Sarah', '2024-01-22', 'Matthew 22:39', 'Practicing love in daily life'),
+    ('Hope in Christ', 'Pastor John', '2024-01-29', 'Romans 15:13', 'Finding hope through Jesus')
+]
+
+SAMPLE_EVENTS = [
+    ('Sunday Service', 'Weekly Sunday worship service', '2024-02-04', '09:00', 'Main Sanctuary', 0),
+    ('Bible Study', 'Weekly Bible study group', '2024-02-06', '19:00', 'Fellowship Hall', 0),
+    ('Youth Ministry', 'Youth group meeting', '2024-02-08', '18:00', 'Youth Center', 0)
+]
+
+SAMPLE_BRANCHES = [
+    ('Main Campus', '123 Church Street, City', '+1-555-0123', 'main@church.com', 'Sunday 9:00 AM, 11:00 AM'),
+    ('North Branch', '456 North Avenue, City', '+1-555-0456', 'north@church.com', 'Sunday 10:00 AM'),
+    ('South Branch', '789 South Road, City', '+1-555-0789', 'south@church.com', 'Sunday 10:30 AM')
+]
+
+SAMPLE_INSPIRATION = [
+    ('For I know the plans I have for you, declares the Lord, plans to prosper you and not to harm you, plans to give you hope and a future.', 'Jeremiah 29:11', 'Jeremiah', '2024-02-01'),
+    ('I can do all things through Christ who strengthens me.', 'Philippians 4:13', 'Paul', '2024-02-02'),
+    ('Be strong and courageous. Do not be afraid; do not be discouraged, for the Lord your God will be with you wherever you go.', 'Joshua 1:9', 'Joshua', '2024-02-03')
+]
+
+SAMPLE_TABLES = [
+    ('sermons', ('title', 'speaker', 'date', 'scripture', 'description'), SAMPLE_SERMONS),
+    ('events', ('title', 'description', 'date', 'time', 'location', 'registration_required'), SAMPLE_EVENTS),
+    ('branches', ('name', 'address', 'phone', 'email', 'service_times'), SAMPLE_BRANCHES),
+    ('daily_inspiration', ('scripture', 'quote', 'author', 'date'), SAMPLE_INSPIRATION),
+]
+
+
+@migration(2, 'Seed default admin and sample content')
+def seed_sample_data(conn):
+    # Insert default admin user if not exists
+    if not conn.execute('SELECT 1 FROM users WHERE username = ?', ('admin',)).fetchone():
+        password_hash = hashlib.sha256('admin123'.encode()).hexdigest()
+        conn.execute('''
+            INSERT INTO users (username, password_hash, email, role)
+            VALUES (?, ?, ?, ?)
+        ''', ('admin', password_hash, 'admin@church.com', 'admin'))
+
+    for table, columns, rows in SAMPLE_TABLES:
+        match = ' AND '.join(f'{column} = ?' for column in columns)
+
+        # Older releases re-inserted the samples on every start; keep one copy
+        conn.executemany(f'''
+            DELETE FROM {table}
+            WHERE {match} AND id > (SELECT MIN(id) FROM {table} WHERE {match})
+        ''', [row + row for row in rows])
+
+        # Only seed tables that are still empty
+        if conn.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone():
+            continue
+        placeholders = ', '.join('?' for _ in columns)
+        conn.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+            rows,
+        )
+
+
+@migration(3, 'Index date-ordered listings')
+def create_listing_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_events_date ON events (date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sermons_date ON sermons (date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sermons_speaker_date ON sermons (speaker, date)')
+
+
+# Full-text indexes: (fts table, content table, indexed columns)
+FTS_TABLES = [
+    ('sermons_fts', 'sermons', ('title', 'speaker', 'scripture', 'description')),
+    ('events_fts', 'events', ('title', 'description', 'location')),
+    ('daily_inspiration_fts', 'daily_inspiration', ('scripture', 'quote', 'author')),
+]
+
+
+@migration(4, 'Add FTS5 search indexes')
+def create_search_indexes(conn):
+    for fts, table, columns in FTS_TABLES:
+        column_list = ', '.join(columns)
+        new_values = ', '.join(f'new.{column}' for column in columns)
+        old_values = ', '.join(f'old.{column}' for column in columns)
+
+        conn.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                {column_list},
+                content='{table}', content_rowid='id',
+                tokenize='porter unicode61 remove_diacritics 2'
+            )
+        ''')
+
+        # Keep the external-content index in step with the base table
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts} (rowid, {column_list}) VALUES (new.id, {new_values});
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN
+                INSERT INTO {fts} ({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+                INSERT INTO {fts} (rowid, {column_list}) VALUES (new.id, {new_values});
+            END
+        ''')
+
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+# Cache tags and the content table each one follows
+CONTENT_TAGS = {
+    'sermons': 'sermons',
+    'events': 'events',
+    'branches': 'branches',
+    'inspiration': 'daily_inspiration',
+}
+
+
+@migration(5, 'Track content generations for cache invalidation')
+def create_content_generations(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS content_generations (
+            tag TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    for tag, table in CONTENT_TAGS.items():
+        conn.execute('INSERT OR IGNORE INTO content_generations (tag) VALUES (?)', (tag,))
+        for action in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_generation_{action.lower()}
+                AFTER {action} ON {table} BEGIN
+                    UPDATE content_generations SET generation = generation + 1 WHERE tag = '{tag}';
+                END
+            ''')
+
+
+@migration(6, 'Stamp content generations with a modification time')
+def add_content_modified_at(conn):
+    conn.execute('ALTER TABLE content_generations ADD COLUMN modified_at INTEGER NOT NULL DEFAULT 0')
+    conn.execute("UPDATE content_generations SET modified_at = CAST(strftime('%s', 'now') AS INTEGER)")
+    for tag, table in CONTENT_TAGS.items():
+        for action in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'DROP TRIGGER IF EXISTS {table}_generation_{action.lower()}')
+            conn.execute(f'''
+                CREATE TRIGGER {table}_generation_{action.lower()}
+                AFTER {action} ON {table} BEGIN
+                    UPDATE content_generations
+                    SET generation = generation + 1,
+                        modified_at = CAST(strftime('%s', 'now') AS INTEGER)
+                    WHERE tag = '{tag}';
+                END
+            ''')
+
+
+@migration(7, 'Maintain content row counters')
+def create_content_counters(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS content_counters (
+            tag TEXT PRIMARY KEY,
+            row_count INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    for tag, table in CONTENT_TAGS.items():
+        conn.execute(f'''
+            INSERT OR REPLACE INTO content_counters (tag, row_count)
+            VALUES ('{tag}', (SELECT COUNT(*) FROM {table}))
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_counter_insert AFTER INSERT ON {table} BEGIN
+                UPDATE content_counters SET row_count = row_count + 1 WHERE tag = '{tag}';
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_counter_delete AFTER DELETE ON {table} BEGIN
+                UPDATE content_counters SET row_count = row_count - 1 WHERE tag = '{tag}';
+            END
+        ''')
+
+
+@migration(8, 'Add recurring events and materialized occurrences')
+def create_event_occurrences(conn):
+    conn.execute('ALTER TABLE events ADD COLUMN recurrence TEXT')
+    conn.execute('ALTER TABLE events ADD COLUMN recurrence_interval INTEGER NOT NULL DEFAULT 1')
+    conn.execute('ALTER TABLE events ADD COLUMN recurrence_until TEXT')
+    conn.execute('ALTER TABLE events ADD COLUMN materialized_until TEXT')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS event_exceptions (
+            event_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            PRIMARY KEY (event_id, date)
+        ) WITHOUT ROWID
+    ''')
+
+    # One row per event per day it happens; the primary key serves date-range lookups
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS event_occurrences (
+            date TEXT NOT NULL,
+            event_id INTEGER NOT NULL,
+            PRIMARY KEY (date, event_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_event_occurrences_event ON event_occurrences (event_id, date)')
+
+    conn.execute('''
+        CREATE VIEW IF NOT EXISTS event_occurrence_details AS
+        SELECT o.event_id AS id, o.date AS date, e.title AS title, e.description AS description,
+               e.time AS time, e.location AS location,
+               e.registration_required AS registration_required, e.recurrence AS recurrence
+        FROM event_occurrences o JOIN events e ON e.id = o.event_id
+    ''')
+
+    # One-off events get their single occurrence straight from the base table;
+    # recurring series are expanded by recurrence.sync_event / recurrence.extend
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS events_occurrence_insert AFTER INSERT ON events BEGIN
+            INSERT OR IGNORE INTO event_occurrences (date, event_id) VALUES (new.date, new.id);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS events_occurrence_update AFTER UPDATE OF date, recurrence ON events
+        WHEN new.recurrence IS NULL BEGIN
+            DELETE FROM event_occurrences WHERE event_id = new.id;
+            INSERT OR IGNORE INTO event_occurrences (date, event_id) VALUES (new.date, new.id);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS events_occurrence_delete AFTER DELETE ON events BEGIN
+            DELETE FROM event_occurrences WHERE event_id = old.id;
+            DELETE FROM event_exceptions WHERE event_id = old.id;
+        END
+    ''')
+
+    # Occurrence changes alter what the events pages show
+    for action in ('INSERT', 'DELETE'):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS event_occurrences_generation_{action.lower()}
+            AFTER {action} ON event_occurrences BEGIN
+                UPDATE content_generations
+                SET generation = generation + 1,
+                    modified_at = CAST(strftime('%s', 'now') AS INTEGER)
+                WHERE tag = 'events';
+            END
+        ''')
+
+    conn.execute('INSERT OR IGNORE INTO event_occurrences (date, event_id) SELECT date, id FROM events')
+    conn.execute('UPDATE events SET materialized_until = date')
+
+
+@migration(9, 'Track bulk import checkpoints')
+def create_import_checkpoints(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS import_checkpoints (
+            source TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            record INTEGER NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (source, kind)
+        ) WITHOUT ROWID
+    ''')
+
+
+@migration(10, 'Attach media files to sermons')
+def create_sermon_media(conn):
+    # Files live on disk under their SHA-256; rows only reference them
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sermon_media (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sermon_id INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            mime_type TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sermon_media_sermon ON sermon_media (sermon_id, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sermon_media_sha256 ON sermon_media (sha256)')
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS sermons_media_delete AFTER DELETE ON sermons BEGIN
+            DELETE FROM sermon_media WHERE sermon_id = old.id;
+        END
+    ''')
+
+    # Attachments change what the sermons pages show
+    for action in ('INSERT', 'DELETE'):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS sermon_media_generation_{action.lower()}
+            AFTER {action} ON sermon_media BEGIN
+                UPDATE content_generations
+                SET generation = generation + 1,
+                    modified_at = CAST(strftime('%s', 'now') AS INTEGER)
+                WHERE tag = 'sermons';
+            END
+        ''')
+
+
+IMAGE_OWNERS = ('branches', 'events', 'sermons')
+
+
+@migration(11, 'Add images with responsive variants')
+def create_images(conn):
+    # One picture per branch, event or sermon; originals are content-addressed blobs
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            owner_type TEXT NOT NULL,
+            owner_id INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            mime_type TEXT NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP,
+            UNIQUE (owner_type, owner_id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_images_sha256 ON images (sha256)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_images_status ON images (status)')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS image_variants (
+            image_id INTEGER NOT NULL,
+            format TEXT NOT NULL,
+            width INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            PRIMARY KEY (image_id, format, width)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS images_variants_delete AFTER DELETE ON images BEGIN
+            DELETE FROM image_variants WHERE image_id = old.id;
+        END
+    ''')
+
+    for table in IMAGE_OWNERS:
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_image_delete AFTER DELETE ON {table} BEGIN
+                DELETE FROM images WHERE owner_type = '{table}' AND owner_id = old.id;
+            END
+        ''')
+
+    # A finished conversion changes the owner's pages (srcset appears)
+    for action, row in (('INSERT', 'new'), ('UPDATE', 'new'), ('DELETE', 'old')):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS images_generation_{action.lower()}
+            AFTER {action} ON images BEGIN
+                UPDATE content_generations
+                SET generation = generation + 1,
+                    modified_at = CAST(strftime('%s', 'now') AS INTEGER)
+                WHERE tag = {row}.owner_type;
+            END
+        ''')
+
+
+@migration(12, 'Add branch coordinates and service schedule index')
+def create_branch_finder_indexes(conn):
+    conn.execute('ALTER TABLE branches ADD COLUMN latitude REAL')
+    conn.execute('ALTER TABLE branches ADD COLUMN longitude REAL')
+    # The service_times text that branch_services was last built from
+    conn.execute('ALTER TABLE branches ADD COLUMN services_indexed TEXT')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_branches_services_stale ON branches (id)
+        WHERE services_indexed IS NOT service_times
+    ''')
+
+    # Points stored as zero-size boxes; nearest-branch searches read a box around a circle
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS branch_locations USING rtree(
+            id, min_lat, max_lat, min_lon, max_lon
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS branches_location_insert AFTER INSERT ON branches
+        WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN
+            INSERT INTO branch_locations VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS branches_location_update AFTER UPDATE OF latitude, longitude ON branches BEGIN
+            DELETE FROM branch_locations WHERE id = old.id;
+            INSERT INTO branch_locations
+            SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude
+            WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+        END
+    ''')
+
+    # Parsed from service_times by branch_finder; the key serves day and time-window lookups
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS branch_services (
+            day INTEGER NOT NULL,
+            minute INTEGER NOT NULL,
+            branch_id INTEGER NOT NULL,
+            PRIMARY KEY (day, minute, branch_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_branch_services_branch ON branch_services (branch_id)')
+
+    # Recording which text was parsed is bookkeeping, not a change to the branches pages
+    conn.execute('DROP TRIGGER IF EXISTS branches_generation_update')
+    conn.execute('''
+        CREATE TRIGGER branches_generation_update
+        AFTER UPDATE OF name, address, phone, email, service_times, latitude, longitude ON branches BEGIN
+            UPDATE content_generations
+            SET generation = generation + 1,
+                modified_at = CAST(strftime('%s', 'now') AS INTEGER)
+            WHERE tag = 'branches';
+        END
+    ''')
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS branches_finder_delete AFTER DELETE ON branches BEGIN
+            DELETE FROM branch_locations WHERE id = old.id;
+            DELETE FROM branch_services WHERE branch_id = old.id;
+        END
+    ''')
+
+
+@migration(13, 'Add daily inspiration schedule')
+def create_inspiration_schedule(conn):
+    # One entry per day: dated entries are pinned by triggers, rotation.py fills the other days
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS inspiration_schedule (
+            date TEXT PRIMARY KEY,
+            inspiration_id INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_inspiration_schedule_entry ON inspiration_schedule (inspiration_id, date)
+    ''')
+    conn.execute('INSERT OR IGNORE INTO inspiration_schedule (date, inspiration_id) SELECT date, id FROM daily_inspiration')
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS inspiration_schedule_insert AFTER INSERT ON daily_inspiration BEGIN
+            INSERT OR REPLACE INTO inspiration_schedule (date, inspiration_id) VALUES (new.date, new.id);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS inspiration_schedule_update AFTER UPDATE OF date ON daily_inspiration BEGIN
+            DELETE FROM inspiration_schedule WHERE date = old.date AND inspiration_id = old.id;
+            INSERT OR REPLACE INTO inspiration_schedule (date, inspiration_id) VALUES (new.date, new.id);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS inspiration_schedule_delete AFTER DELETE ON daily_inspiration BEGIN
+            DELETE FROM inspiration_schedule WHERE inspiration_id = old.id;
+        END
+    ''')
+
+    # What the rotation was last built from; a different generation or window means rebuild
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS inspiration_rotation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL,
+            no_repeat_days INTEGER NOT NULL,
+            scheduled_through TEXT NOT NULL
+        )
+    ''')
+
+    conn.execute('''
+        CREATE VIEW IF NOT EXISTS inspiration_archive AS
+        SELECT s.date AS date, i.id AS id, i.scripture AS scripture, i.quote AS quote, i.author AS author
+        FROM inspiration_schedule s
+        JOIN daily_inspiration i ON i.id = s.inspiration_id
+    ''')
+
+
+@migration(14, 'Add background job queue')
+def create_jobs(conn):
+    # Times are epoch seconds; run_at is when a job becomes due, so scheduled jobs wait in the queue
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task TEXT NOT NULL,
+            args TEXT NOT NULL DEFAULT '{}',
+            dedupe_key TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            run_at REAL NOT NULL,
+            enqueued_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            worker TEXT,
+            error TEXT
+        )
+    ''')
+    # Workers claim from this; it only holds waiting jobs however long the history grows
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (run_at, id) WHERE status = 'queued'")
+    # At most one waiting job per key; a key can be queued again once its job has started
+    conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs (dedupe_key)
+        WHERE dedupe_key IS NOT NULL AND status = 'queued'
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, finished_at)')
+
+
+# Admin stat counters: tag -> (table, column) whose distinct non-null values are counted
+DISTINCT_COUNTERS = {
+    'sermons.speakers': ('sermons', 'speaker'),
+    'sermons.dates': ('sermons', 'date'),
+    'events.locations': ('events', 'location'),
+}
+
+
+def _count_value(tag, value):
+    # The counter goes up when a value first appears, before the reference is added
+    return f'''
+        UPDATE content_counters SET row_count = row_count + 1
+        WHERE tag = '{tag}' AND {value} IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM content_values WHERE tag = '{tag}' AND value = {value});
+        INSERT OR IGNORE INTO content_values (tag, value, row_count) SELECT '{tag}', {value}, 0 WHERE {value} IS NOT NULL;
+        UPDATE content_values SET row_count = row_count + 1 WHERE tag = '{tag}' AND value = {value};
+    '''
+
+
+def _uncount_value(tag, value):
+    # ...and down when its last reference goes
+    return f'''
+        UPDATE content_counters SET row_count = row_count - 1
+        WHERE tag = '{tag}'
+          AND EXISTS (SELECT 1 FROM content_values WHERE tag = '{tag}' AND value = {value} AND row_count = 1);
+        DELETE FROM content_values WHERE tag = '{tag}' AND value = {value} AND row_count = 1;
+        UPDATE content_values SET row_count = row_count - 1 WHERE tag = '{tag}' AND value = {value};
+    '''
+
+
+@migration(15, 'Maintain admin listing stat counters')
+def create_stat_counters(conn):
+    # Reference counts per distinct value, so the distinct counters need no scan
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS content_values (
+            tag TEXT NOT NULL,
+            value NOT NULL,
+            row_count INTEGER NOT NULL,
+            PRIMARY KEY (tag, value)
+        ) WITHOUT ROWID
+    ''')
+    for tag, (table, column) in DISTINCT_COUNTERS.items():
+        name = tag.replace('.', '_')
+        conn.execute(f'''
+            INSERT OR REPLACE INTO content_values (tag, value, row_count)
+            SELECT '{tag}', {column}, COUNT(*) FROM {table} WHERE {column} IS NOT NULL GROUP BY {column}
+        ''')
+        conn.execute(f'''
+            INSERT OR REPLACE INTO content_counters (tag, row_count)
+            VALUES ('{tag}', (SELECT COUNT(*) FROM content_values WHERE tag = '{tag}'))
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name}_counter_insert AFTER INSERT ON {table} BEGIN
+                {_count_value(tag, f'new.{column}')}
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name}_counter_update AFTER UPDATE OF {column} ON {table}
+            WHEN old.{column} IS NOT new.{column} BEGIN
+                {_uncount_value(tag, f'old.{column}')}
+                {_count_value(tag, f'new.{column}')}
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name}_counter_delete AFTER DELETE ON {table} BEGIN
+                {_uncount_value(tag, f'old.{column}')}
+            END
+        ''')
+
+    conn.execute('''
+        INSERT OR REPLACE INTO content_counters (tag, row_count)
+        VALUES ('events.registration_required', (SELECT COUNT(*) FROM events WHERE registration_required = 1))
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS events_registration_counter_insert AFTER INSERT ON events
+        WHEN new.registration_required = 1 BEGIN
+            UPDATE content_counters SET row_count = row_count + 1 WHERE tag = 'events.registration_required';
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS events_registration_counter_update AFTER UPDATE OF registration_required ON events
+        WHEN (old.registration_required IS 1) IS NOT (new.registration_required IS 1) BEGIN
+            UPDATE content_counters SET row_count = row_count + (new.registration_required IS 1) - (old.registration_required IS 1)
+            WHERE tag = 'events.registration_required';
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS events_registration_counter_delete AFTER DELETE ON events
+        WHEN old.registration_required = 1 BEGIN
+            UPDATE content_counters SET row_count = row_count - 1 WHERE tag = 'events.registration_required';
+        END
+    ''')
+
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+
+
+@migration(16, 'Maintain job status counters')
+def create_job_counters(conn):
+    # 'jobs.<status>' rows in content_counters, so the dashboard never counts the job history
+    for status in JOB_STATUSES:
+        conn.execute(f'''
+            INSERT OR REPLACE INTO content_counters (tag, row_count)
+            VALUES ('jobs.{status}', (SELECT COUNT(*) FROM jobs WHERE status = '{status}'))
+        ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS jobs_counter_insert AFTER INSERT ON jobs BEGIN
+            UPDATE content_counters SET row_count = row_count + 1 WHERE tag = 'jobs.' || new.status;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS jobs_counter_update AFTER UPDATE OF status ON jobs
+        WHEN old.status IS NOT new.status BEGIN
+            UPDATE content_counters SET row_count = row_count - 1 WHERE tag = 'jobs.' || old.status;
+            UPDATE content_counters SET row_count = row_count + 1 WHERE tag = 'jobs.' || new.status;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS jobs_counter_delete AFTER DELETE ON jobs BEGIN
+            UPDATE content_counters SET row_count = row_count - 1 WHERE tag = 'jobs.' || old.status;
+        END
+    ''')
@@ -0,0 +1,216 @@
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask import Response, current_app, make_response, request, session
+
+from db import get_db
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL = 300
+
+
+class PageCache:
+    """LRU cache of rendered responses, validated against content generations"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def get(self, key, generations):
+        """Return a live entry, or None if missing, expired or out of date"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry['expires'] < time.monotonic() or entry['generations'] != generations:
+                del self._entries[key]
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, generations, response, ttl=None):
+        """Store a rendered response"""
+        self._store(key, generations, response.get_data(), response, ttl)
+
+    def tee(self, key, generations, response, ttl=None):
+        """Pass a streamed response through, storing it once the last chunk has gone out"""
+        source = response.response
+        chunks = []
+
+        def stream():
+            for chunk in source:
+                chunk = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                chunks.append(chunk)
+                yield chunk
+            # Only complete bodies are stored; a dropped connection closes the generator first
+            self._store(key, generations, b''.join(chunks), response, ttl)
+
+        response.response = stream()
+
+    def _store(self, key, generations, body, response, ttl):
+        entry = {
+            'body': body,
+            'status': response.status_code,
+            'headers': [(k, v) for k, v in response.headers.items()
+                        if k.lower() not in ('content-length', 'x-cache')],
+            'generations': generations,
+            'expires': time.monotonic() + (ttl or self.ttl),
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Snapshot of cache counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def get_cache(app=None):
+    """Get the page cache for an app"""
+    app = app or current_app
+    return app.extensions['page_cache']
+
+
+def content_state(conn, tags):
+    """(generations, last modified epoch) for the given tags, shared by every worker through SQLite"""
+    placeholders = ', '.join('?' for _ in tags)
+    rows = conn.execute(
+        f'SELECT tag, generation, modified_at FROM content_generations WHERE tag IN ({placeholders})',
+        tags,
+    ).fetchall()
+    found = dict((row['tag'], row) for row in rows)
+    generations = tuple(found[tag]['generation'] if tag in found else 0 for tag in tags)
+    modified = max((row['modified_at'] for row in rows), default=0)
+    return generations, modified
+
+
+def today():
+    """The current day on SQLite's date('now') clock (UTC), which daily pages select by"""
+    return datetime.now(timezone.utc).date()
+
+
+def _cache_key(daily):
+    args = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+    key = f'{request.path}?{args}'
+    if daily:
+        # Pages that depend on date('now') roll over at UTC midnight
+        key += f'#{today().isoformat()}'
+    return key
+
+
+def _anonymous_get():
+    # Logged-in users and pending flash messages change the rendered header
+    return (
+        request.method == 'GET'
+        and not session.get('user_id')
+        and '_flashes' not in session
+    )
+
+
+def _validators(key, generations, modified, daily):
+    """Strong ETag and Last-Modified for a page built from the given content state"""
+    etag = hashlib.sha1(f'{key}|{generations}'.encode()).hexdigest()[:20]
+    last_modified = datetime.fromtimestamp(modified, timezone.utc)
+    if daily:
+        midnight = datetime.combine(today(), datetime.min.time(), tzinfo=timezone.utc)
+        last_modified = max(last_modified, midnight)
+    return etag, last_modified.replace(microsecond=0)
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def _add_validators(response, etag, last_modified, max_age=None):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = f'public, max-age={max_age}' if max_age else 'no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
+def cached(*tags, ttl=None, daily=False, max_age=None):
+    """Cache a public view's response and answer conditional GETs until one of its content tags changes"""
+    def decorator(f):
+        @functools.wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not _anonymous_get():
+                return f(*args, **kwargs)
+
+            key = _cache_key(daily)
+            generations, modified = content_state(get_db(), tags)
+            etag, last_modified = _validators(key, generations, modified, daily)
+
+            # Revalidation: answer before running the listing query or rendering
+            if _not_modified(etag, last_modified):
+                return _add_validators(Response(status=304), etag, last_modified, max_age)
+
+            use_cache = current_app.config.get('PAGE_CACHE_ENABLED', True)
+            cache = get_cache()
+            entry = cache.get(key, generations) if use_cache else None
+            if entry is not None:
+                response = Response(entry['body'], status=entry['status'], headers=entry['headers'])
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            response = _add_validators(make_response(f(*args, **kwargs)), etag, last_modified, max_age)
+            if use_cache and response.status_code == 200 and not response.direct_passthrough \
+                    and 'Set-Cookie' not in response.headers:
+                if response.is_streamed:
+                    cache.tee(key, generations, response, ttl)
+                else:
+                    cache.set(key, generations, response, ttl)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        # Lets other tools (e.g. the static export) see what a page depends on
+        decorated_function.cache_tags = tags
+        decorated_function.cache_daily = daily
+        return decorated_function
+    return decorator
+
+
+def init_app(app):
+    """Attach a page cache to the app"""
+    app.config.setdefault('PAGE_CACHE_ENABLED', True)
+    app.config.setdefault('PAGE_CACHE_SIZE', DEFAULT_MAX_ENTRIES)
+    app.config.setdefault('PAGE_CACHE_TTL', DEFAULT_TTL)
+    app.extensions['page_cache'] = PageCache(
+        max_entries=app.config['PAGE_CACHE_SIZE'],
+        ttl=app.config['PAGE_CACHE_TTL'],
+    )
@@ -0,0 +1,203 @@
+import base64
+import json
+
+from flask import current_app, request, url_for
+
+import query_plans
+
+DEFAULT_PAGE_SIZE = 12
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(values):
+    """Opaque, URL-safe cursor for a row's sort key"""
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; returns None for anything malformed"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or not all(_is_key_value(value) for value in values):
+        return None
+    return values
+
+
+def _is_key_value(value):
+    # Only what encode_cursor can produce from a sort key; anything else SQLite cannot bind
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return -2 ** 63 <= value < 2 ** 63
+    return value is None or isinstance(value, (str, float))
+
+
+def wants_json():
+    """True when the client asked for the JSON variant of a listing"""
+    return request.args.get('format') == 'json'
+
+
+def page_size():
+    """Page size from ?per_page=, clamped to the configured bounds"""
+    default = current_app.config.get('PAGE_SIZE', DEFAULT_PAGE_SIZE)
+    try:
+        size = int(request.args.get('per_page', default))
+    except ValueError:
+        size = default
+    return max(1, min(size, current_app.config.get('MAX_PAGE_SIZE', MAX_PAGE_SIZE)))
+
+
+class Page:
+    """One page of a keyset-paginated listing"""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def _url(self, **cursor):
+        args = request.args.to_dict()
+        args.pop('after', None)
+        args.pop('before', None)
+        args.update(cursor)
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+    @property
+    def next_url(self):
+        return self._url(after=self.next_cursor) if self.has_next else None
+
+    @property
+    def prev_url(self):
+        return self._url(before=self.prev_cursor) if self.has_prev else None
+
+    def as_dict(self):
+        """JSON-ready representation"""
+        return {
+            'items': [dict(row) for row in self.items],
+            'per_page': self.per_page,
+            'next': self.next_url,
+            'prev': self.prev_url,
+        }
+
+
+class OffsetPage(Page):
+    """Numbered page for result sets without a stable sort key (e.g. ranked search)"""
+
+    def __init__(self, items, per_page, number, has_more):
+        super().__init__(items, per_page)
+        self.number = number
+        self._has_more = has_more
+
+    @property
+    def has_next(self):
+        return self._has_more
+
+    @property
+    def has_prev(self):
+        return self.number > 1
+
+    def _url(self, **page):
+        args = request.args.to_dict()
+        args.update(page)
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+    @property
+    def next_url(self):
+        return self._url(page=self.number + 1) if self.has_next else None
+
+    @property
+    def prev_url(self):
+        return self._url(page=self.number - 1) if self.has_prev else None
+
+
+def page_number():
+    """1-based page number from ?page="""
+    try:
+        return max(1, int(request.args.get('page', 1)))
+    except ValueError:
+        return 1
+
+
+class Listing:
+    """Keyset pagination over a table ordered by (key, id)"""
+
+    def __init__(self, table, key='date', descending=True, columns='*', where=None):
+        self.table = table
+        self.key = key
+        self.descending = descending
+
+        # Sort key columns; id breaks ties so every row has a unique position
+        order = (key, 'id') if key else ('id',)
+        tuple_sql = '(' + ', '.join(order) + ')' if key else 'id'
+        params_sql = '(' + ', '.join('?' for _ in order) + ')' if key else '?'
+        forward = 'DESC' if descending else 'ASC'
+        backward = 'ASC' if descending else 'DESC'
+        ahead = '<' if descending else '>'
+        behind = '>' if descending else '<'
+
+        def order_by(direction):
+            return ', '.join(f'{column} {direction}' for column in order)
+
+        def where_sql(*conditions):
+            conditions = [c for c in (where, *conditions) if c]
+            return ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+        self.order = order
+        self._first_sql = f'SELECT {columns} FROM {table}{where_sql()} ORDER BY {order_by(forward)} LIMIT ?'
+        self._after_sql = (f'SELECT {columns} FROM {table}{where_sql(f"{tuple_sql} {ahead} {params_sql}")} '
+                           f'ORDER BY {order_by(forward)} LIMIT ?')
+        self._before_sql = (f'SELECT {columns} FROM {table}{where_sql(f"{tuple_sql} {behind} {params_sql}")} '
+                            f'ORDER BY {order_by(backward)} LIMIT ?')
+        for sql in (self._first_sql, self._after_sql, self._before_sql):
+            query_plans.register(sql, f'{table} listing')
+
+    def _cursor_for(self, row):
+        return encode_cursor([row[column] for column in self.order])
+
+    def page(self, conn, after=None, before=None, per_page=DEFAULT_PAGE_SIZE):
+        """Fetch one page; after/before are decoded cursor values"""
+        if before is not None and len(before) == len(self.order):
+            rows = conn.execute(self._before_sql, (*before, per_page + 1)).fetchall()
+            has_more_before = len(rows) > per_page
+            items = list(reversed(rows[:per_page]))
+            return Page(
+                items, per_page,
+                next_cursor=self._cursor_for(items[-1]) if items else None,
+                prev_cursor=self._cursor_for(items[0]) if items and has_more_before else None,
+            )
+
+        if after is not None and len(after) == len(self.order):
+            rows = conn.execute(self._after_sql, (*after, per_page + 1)).fetchall()
+        else:
+            after = None
+            rows = conn.execute(self._first_sql, (per_page + 1,)).fetchall()
+        items = rows[:per_page]
+        return Page(
+            items, per_page,
+            next_cursor=self._cursor_for(items[-1]) if len(rows) > per_page else None,
+            prev_cursor=self._cursor_for(items[0]) if items and after is not None else None,
+        )
+
+    def page_from_request(self, conn):
+        """Fetch the page described by ?after=, ?before= and ?per_page="""
+        return self.page(
+            conn,
+            after=decode_cursor(request.args.get('after')),
+            before=decode_cursor(request.args.get('before')),
+            per_page=page_size(),
+        )
@@ -0,0 +1,63 @@
+import ast
+import glob
+import os
+
+# Plan details that mean SQLite sorted rows itself instead of walking an index
+BAD_PLAN_MARKERS = ('USE TEMP B-TREE',)
+
+# Modules whose queries run against their own SQLite file, not the site database
+SEPARATE_DATABASE_MODULES = ('ratelimit.py',)
+
+# Queries built at runtime (so invisible to the source scan) register themselves here
+REGISTERED_QUERIES = []
+
+
+def register(sql, label):
+    """Add a dynamically built query to the plan check"""
+    REGISTERED_QUERIES.append((label, ' '.join(sql.split())))
+
+
+def find_queries(path):
+    """Yield (line, sql) for every literal SELECT passed to execute()"""
+    with open(path) as f:
+        tree = ast.parse(f.read(), filename=path)
+
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)):
+            continue
+        if node.func.attr not in ('execute', 'executemany') or not node.args:
+            continue
+        arg = node.args[0]
+        if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+            sql = ' '.join(arg.value.split())
+            if sql.upper().startswith(('SELECT', 'WITH')):
+                yield node.lineno, sql
+
+
+def explain(conn, sql):
+    """Return the EXPLAIN QUERY PLAN detail lines for a query"""
+    params = [None] * sql.count('?')
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+def _check(conn, location, sql):
+    plan = explain(conn, sql)
+    ok = not any(marker in detail for detail in plan for marker in BAD_PLAN_MARKERS)
+    return location, sql, plan, ok
+
+
+def check_plans(conn, paths):
+    """Explain every query found in paths; return a list of (location, sql, plan, ok)"""
+    results = []
+    for path in paths:
+        for lineno, sql in sorted(find_queries(path)):
+            results.append(_check(conn, f'{os.path.basename(path)}:{lineno}', sql))
+    for label, sql in REGISTERED_QUERIES:
+        results.append(_check(conn, label, sql))
+    return results
+
+
+def source_files(root):
+    """Python modules in the application directory"""
+    return sorted(path for path in glob.glob(os.path.join(root, '*.py'))
+                  if os.path.basename(path) not in SEPARATE_DATABASE_MODULES)
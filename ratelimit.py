@@ -0,0 +1,196 @@
+import functools
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request
+from werkzeug.exceptions import TooManyRequests
+
+# Limit name -> 'count/period': a bucket of `count` tokens refilled evenly over the period
+DEFAULT_LIMITS = {
+    'login': '10/minute',
+    'login_username': '20/hour',
+    'listing': '120/minute',
+}
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+# Keys remembered per worker; the least recently used are forgotten first
+MAX_LOCAL_KEYS = 10000
+# Shared-store round trips between sweeps of fully refilled buckets
+SWEEP_EVERY = 1000
+
+
+class Limit:
+    """Token bucket parameters for one named limit"""
+
+    def __init__(self, name, spec):
+        count, _, period = spec.partition('/')
+        self.name = name
+        self.capacity = int(count)
+        self.rate = self.capacity / PERIODS[period.strip().rstrip('s')]
+        # Tokens a worker takes from the shared store at once. Unused leased
+        # tokens only make the limit stricter, so keep leases small
+        self.lease = max(1, self.capacity // 20)
+
+
+class LocalBucket:
+    __slots__ = ('tokens', 'blocked_until')
+
+    def __init__(self):
+        self.tokens = 0
+        self.blocked_until = 0.0
+
+
+class RateLimiter:
+    """Token buckets shared by all workers through a small SQLite file
+
+    Each worker leases tokens from the shared bucket in small batches and
+    spends them from memory; once the shared bucket is empty it remembers
+    when the next token is due and rejects until then without any I/O.
+    """
+
+    def __init__(self, path, limits):
+        self.path = path
+        self.limits = {name: Limit(name, spec) for name, spec in limits.items()}
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._store_lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._store_calls = 0
+        self.counters = {name: {'allowed': 0, 'rejected': 0, 'store_calls': 0} for name in self.limits}
+
+    def hit(self, name, key):
+        """Spend one token; returns 0 if allowed, else seconds until a token is due"""
+        limit = self.limits[name]
+        counters = self.counters[name]
+        now = time.time()
+        with self._lock:
+            bucket = self._local.get((name, key))
+            if bucket is not None:
+                self._local.move_to_end((name, key))
+                if bucket.tokens >= 1:
+                    bucket.tokens -= 1
+                    counters['allowed'] += 1
+                    return 0
+                if bucket.blocked_until > now:
+                    counters['rejected'] += 1
+                    return bucket.blocked_until - now
+
+        granted, wait = self._lease(limit, key, now)
+        with self._lock:
+            counters['store_calls'] += 1
+            bucket = self._local.get((name, key))
+            if bucket is None:
+                bucket = self._local[(name, key)] = LocalBucket()
+                while len(self._local) > MAX_LOCAL_KEYS:
+                    self._local.popitem(last=False)
+            if granted:
+                bucket.tokens += granted - 1
+                counters['allowed'] += 1
+                return 0
+            bucket.blocked_until = now + wait
+            counters['rejected'] += 1
+            return wait
+
+    def _connection(self):
+        # A forked worker must not share its parent's SQLite handle
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Losing a few counts in a crash is fine; fsyncs on every lease are not
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('PRAGMA busy_timeout=2000')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _lease(self, limit, key, now):
+        """Take up to limit.lease tokens from the shared bucket; returns (granted, seconds to wait)"""
+        store_key = f'{limit.name}:{key}'
+        with self._store_lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (store_key,)).fetchone()
+                tokens = limit.capacity if row is None else min(limit.capacity, row[0] + (now - row[1]) * limit.rate)
+                granted = min(limit.lease, int(tokens))
+                tokens -= granted
+                conn.execute('''
+                    INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated
+                ''', (store_key, tokens, now))
+                self._store_calls += 1
+                if self._store_calls % SWEEP_EVERY == 0:
+                    self._sweep(conn, now)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return granted, 0 if granted else (1 - tokens) / limit.rate
+
+    def _sweep(self, conn, now):
+        # A bucket that has refilled completely is the same as no row at all
+        slowest = max(limit.capacity / limit.rate for limit in self.limits.values())
+        conn.execute('DELETE FROM buckets WHERE updated < ?', (now - slowest,))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'local_keys': len(self._local),
+                'limits': {name: dict(counters, capacity=self.limits[name].capacity,
+                                      per_second=round(self.limits[name].rate, 4))
+                           for name, counters in self.counters.items()},
+            }
+
+
+def get_limiter(app=None):
+    app = app or current_app
+    return app.extensions['rate_limiter']
+
+
+def client_ip():
+    """The visitor's address; behind a proxy, set TRUSTED_PROXY_HOPS so this is not the proxy's"""
+    return request.remote_addr or 'unknown'
+
+
+def form_username():
+    """Login attempts are also limited per account, whatever address they come from"""
+    username = request.form.get('username', '').strip().lower()
+    return username or None
+
+
+def rate_limited(name, key=client_ip, methods=None):
+    """Reject with 429 and Retry-After once a key runs out of tokens; runs before the view touches the database"""
+    def decorator(f):
+        @functools.wraps(f)
+        def decorated_function(*args, **kwargs):
+            if current_app.config['RATE_LIMIT_ENABLED'] and (methods is None or request.method in methods):
+                value = key()
+                if value is not None:
+                    wait = get_limiter().hit(name, value)
+                    if wait:
+                        raise TooManyRequests(retry_after=max(1, math.ceil(wait)))
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def init_app(app):
+    app.config.setdefault('RATE_LIMIT_ENABLED', True)
+    app.config.setdefault('RATE_LIMITS', DEFAULT_LIMITS)
+    app.config.setdefault('RATE_LIMIT_STORE',
+                          os.path.join(os.path.dirname(app.config['DATABASE']) or '.', 'ratelimit.db'))
+    limits = dict(DEFAULT_LIMITS, **app.config['RATE_LIMITS'])
+    app.extensions['rate_limiter'] = RateLimiter(app.config['RATE_LIMIT_STORE'], limits)
@@ -0,0 +1,184 @@
+import calendar
+import threading
+from datetime import date, timedelta
+
+from flask import current_app
+
+import page_cache
+
+RULES = ('weekly', 'monthly')
+DEFAULT_HORIZON_DAYS = 365
+
+
+def parse_date(value):
+    """ISO date string to date, or None"""
+    try:
+        return date.fromisoformat((value or '').strip())
+    except ValueError:
+        return None
+
+
+def parse_dates(text):
+    """Sorted unique dates from a comma/whitespace separated list, ignoring junk"""
+    found = set()
+    for part in (text or '').replace(',', ' ').split():
+        day = parse_date(part)
+        if day:
+            found.add(day)
+    return sorted(found)
+
+
+def nth_weekday(year, month, weekday, n):
+    """Date of the nth weekday in a month (n=-1 for the last), or None if it doesn't exist"""
+    days_in_month = calendar.monthrange(year, month)[1]
+    if n < 0:
+        last = date(year, month, days_in_month)
+        return last - timedelta(days=(last.weekday() - weekday) % 7)
+    first = date(year, month, 1)
+    day = 1 + (weekday - first.weekday()) % 7 + 7 * (n - 1)
+    return date(year, month, day) if day <= days_in_month else None
+
+
+def week_of_month(day):
+    """Which weekday-of-month a date is: 1-4, or -1 for a fifth (i.e. last) weekday"""
+    n = (day.day - 1) // 7 + 1
+    return -1 if n == 5 else n
+
+
+def expand(start, rule, interval=1, until=None, exceptions=(), window_start=None, window_end=None):
+    """Yield occurrence dates of a series that fall inside [window_start, window_end]"""
+    interval = max(1, interval or 1)
+    window_start = max(window_start or start, start)
+    end = min(window_end, until) if until else window_end
+    skip = set(exceptions)
+
+    if rule == 'weekly':
+        step = 7 * interval
+        # Jump straight to the first occurrence inside the window
+        k = -(-(window_start - start).days // step)
+        day = start + timedelta(days=k * step)
+        while day <= end:
+            if day not in skip:
+                yield day
+            day += timedelta(days=step)
+
+    elif rule == 'monthly':
+        weekday, n = start.weekday(), week_of_month(start)
+        elapsed = (window_start.year - start.year) * 12 + window_start.month - start.month
+        k = max(0, elapsed // interval)
+        while True:
+            month_index = start.month - 1 + k * interval
+            year, month = start.year + month_index // 12, month_index % 12 + 1
+            if date(year, month, 1) > end:
+                break
+            day = nth_weekday(year, month, weekday, n)
+            if day and window_start <= day <= end and day not in skip:
+                yield day
+            k += 1
+
+    elif window_start <= start <= end and start not in skip:
+        yield start
+
+
+def horizon_end(today=None):
+    """Last date the occurrence table should cover"""
+    days = current_app.config.get('EVENT_HORIZON_DAYS', DEFAULT_HORIZON_DAYS)
+    return (today or page_cache.today()) + timedelta(days=days)
+
+
+def _exceptions(conn, event_id):
+    rows = conn.execute('SELECT date FROM event_exceptions WHERE event_id = ?', (event_id,))
+    return [date.fromisoformat(row['date']) for row in rows]
+
+
+def sync_event(conn, event_id, exceptions=None, until_day=None):
+    """Rebuild one event's occurrences after it was created or edited"""
+    event = conn.execute('SELECT * FROM events WHERE id = ?', (event_id,)).fetchone()
+    if event is None:
+        return
+
+    if exceptions is not None:
+        conn.execute('DELETE FROM event_exceptions WHERE event_id = ?', (event_id,))
+        conn.executemany(
+            'INSERT OR IGNORE INTO event_exceptions (event_id, date) VALUES (?, ?)',
+            [(event_id, day.isoformat()) for day in exceptions],
+        )
+
+    start = date.fromisoformat(event['date'])
+    end = until_day or horizon_end()
+    days = expand(start, event['recurrence'], event['recurrence_interval'],
+                  parse_date(event['recurrence_until']), _exceptions(conn, event_id),
+                  window_start=start, window_end=end)
+
+    conn.execute('DELETE FROM event_occurrences WHERE event_id = ?', (event_id,))
+    conn.executemany(
+        'INSERT OR IGNORE INTO event_occurrences (date, event_id) VALUES (?, ?)',
+        [(day.isoformat(), event_id) for day in days],
+    )
+    conn.execute('UPDATE events SET materialized_until = ? WHERE id = ?', (end.isoformat(), event_id))
+
+
+def extend(conn, until_day=None):
+    """Materialize recurring series up to the horizon, only adding the missing tail"""
+    end = until_day or horizon_end()
+    series = conn.execute('''
+        SELECT * FROM events
+        WHERE recurrence IS NOT NULL
+          AND (materialized_until IS NULL OR materialized_until < ?)
+          AND (recurrence_until IS NULL OR recurrence_until > COALESCE(materialized_until, ''))
+    ''', (end.isoformat(),)).fetchall()
+
+    added = 0
+    for event in series:
+        start = date.fromisoformat(event['date'])
+        done = parse_date(event['materialized_until'])
+        window_start = done + timedelta(days=1) if done else start
+        days = expand(start, event['recurrence'], event['recurrence_interval'],
+                      parse_date(event['recurrence_until']), _exceptions(conn, event['id']),
+                      window_start=window_start, window_end=end)
+        rows = [(day.isoformat(), event['id']) for day in days]
+        conn.executemany('INSERT OR IGNORE INTO event_occurrences (date, event_id) VALUES (?, ?)', rows)
+        conn.execute('UPDATE events SET materialized_until = ? WHERE id = ?', (end.isoformat(), event['id']))
+        added += len(rows)
+    conn.commit()
+    return added
+
+
+class _HorizonMemo:
+    """Remembers the day this process last extended the horizon"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.day = None
+
+
+_horizon_memo = _HorizonMemo()
+
+
+def ensure_horizon(conn):
+    """Extend the occurrence horizon at most once per day per process"""
+    # The listings select upcoming occurrences with date('now'), so the day is UTC too
+    today = page_cache.today()
+    with _horizon_memo.lock:
+        if _horizon_memo.day == today:
+            return
+    extend(conn, horizon_end(today))
+    # Only a successful run counts; a failed one (e.g. a busy timeout) is retried next request
+    with _horizon_memo.lock:
+        _horizon_memo.day = today
+
+
+def form_values(form):
+    """Recurrence columns and exception dates from an admin event form"""
+    rule = form.get('recurrence', '').strip().lower()
+    rule = rule if rule in RULES else None
+    try:
+        interval = max(1, int(form.get('recurrence_interval') or 1))
+    except ValueError:
+        interval = 1
+    until = parse_date(form.get('recurrence_until'))
+    return {
+        'recurrence': rule,
+        'recurrence_interval': interval,
+        'recurrence_until': until.isoformat() if until and rule else None,
+    }, parse_dates(form.get('recurrence_exceptions')) if rule else []
@@ -0,0 +1,174 @@
+import heapq
+import threading
+from datetime import date, timedelta
+
+import click
+from flask import current_app
+
+import page_cache
+from db import get_pool
+
+DEFAULT_SCHEDULE_DAYS = 365
+DEFAULT_NO_REPEAT_DAYS = 60
+
+
+def _generation(conn):
+    generations, _ = page_cache.content_state(conn, ('inspiration',))
+    return generations[0]
+
+
+def ensure_schedule(conn, today=None, schedule_days=None, no_repeat_days=None, rebuild=False):
+    """Keep the schedule filled from today to the horizon; returns how many days were assigned
+
+    An inspiration write (or a new window) reshuffles every day after today;
+    otherwise only the days that came into range since the last run are added.
+    Today's entry never changes once assigned, unless an entry is dated today.
+    """
+    today = today or page_cache.today()
+    schedule_days = schedule_days or current_app.config['INSPIRATION_SCHEDULE_DAYS']
+    no_repeat_days = current_app.config['INSPIRATION_NO_REPEAT_DAYS'] if no_repeat_days is None else no_repeat_days
+    end = today + timedelta(days=schedule_days)
+    generation = _generation(conn)
+
+    state = conn.execute('SELECT generation, no_repeat_days, scheduled_through FROM inspiration_rotation').fetchone()
+    if rebuild or state is None or (state['generation'], state['no_repeat_days']) != (generation, no_repeat_days):
+        # Dated entries are pinned by triggers; only the rotated days are recomputed
+        conn.execute('''
+            DELETE FROM inspiration_schedule
+            WHERE date > ? AND NOT EXISTS (
+                SELECT 1 FROM daily_inspiration i
+                WHERE i.date = inspiration_schedule.date AND i.id = inspiration_schedule.inspiration_id
+            )
+        ''', (today.isoformat(),))
+        start = today
+    else:
+        start = max(today, date.fromisoformat(state['scheduled_through']) + timedelta(days=1))
+        if start > end:
+            return 0
+
+    assigned = _fill(conn, start, end, no_repeat_days)
+    conn.execute('''
+        INSERT INTO inspiration_rotation (id, generation, no_repeat_days, scheduled_through) VALUES (1, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET generation = excluded.generation,
+            no_repeat_days = excluded.no_repeat_days, scheduled_through = excluded.scheduled_through
+    ''', (generation, no_repeat_days, end.isoformat()))
+    conn.commit()
+    return assigned
+
+
+def _fill(conn, start, end, no_repeat_days):
+    """Assign an entry to every open day in [start, end], least recently shown first"""
+    pool = [row['id'] for row in conn.execute('SELECT id FROM daily_inspiration')]
+    if not pool:
+        return 0
+    taken = dict((date.fromisoformat(row['date']).toordinal(), row['inspiration_id']) for row in conn.execute(
+        'SELECT date, inspiration_id FROM inspiration_schedule WHERE date BETWEEN ? AND ?',
+        (start.isoformat(), end.isoformat())))
+    last_shown = dict((row['inspiration_id'], date.fromisoformat(row['shown']).toordinal()) for row in conn.execute(
+        'SELECT inspiration_id, MAX(date) AS shown FROM inspiration_schedule WHERE date < ? GROUP BY inspiration_id',
+        (start.isoformat(),)))
+    # An entry dated ahead is not rotated in within the window before its own day either
+    pinned = {}
+    for day, inspiration_id in taken.items():
+        pinned.setdefault(inspiration_id, []).append(day)
+
+    def eligible(inspiration_id, day):
+        shown = last_shown.get(inspiration_id)
+        if shown is not None and day - shown <= no_repeat_days:
+            return False
+        return not any(0 < pin - day <= no_repeat_days for pin in pinned.get(inspiration_id, ()))
+
+    # (day last shown, id); entries never shown sort first. Stale heap items are skipped lazily
+    heap = [(last_shown.get(inspiration_id, -1), inspiration_id) for inspiration_id in pool]
+    heapq.heapify(heap)
+    rows = []
+    for day in range(start.toordinal(), end.toordinal() + 1):
+        if day in taken:
+            chosen = taken[day]
+        else:
+            skipped, chosen = [], None
+            while heap:
+                shown, inspiration_id = heapq.heappop(heap)
+                if shown != last_shown.get(inspiration_id, -1):
+                    continue
+                if eligible(inspiration_id, day):
+                    chosen = inspiration_id
+                    break
+                skipped.append((shown, inspiration_id))
+            if chosen is None:
+                # Pool smaller than the window: repeat the least recently shown entry
+                chosen = skipped.pop(0)[1]
+            for item in skipped:
+                heapq.heappush(heap, item)
+            rows.append((date.fromordinal(day).isoformat(), chosen))
+        last_shown[chosen] = day
+        heapq.heappush(heap, (day, chosen))
+
+    # Another worker may have filled the same days from the same inputs
+    conn.executemany('INSERT OR IGNORE INTO inspiration_schedule (date, inspiration_id) VALUES (?, ?)', rows)
+    return len(rows)
+
+
+def load_today(conn, today=None):
+    """Today's scheduled entry, read-only
+
+    The schedule is filled by the inspiration.schedule job, queued by admin
+    writes and daily; until it has covered today the latest dated entry is shown.
+    """
+    today = today or page_cache.today()
+    row = conn.execute('SELECT * FROM inspiration_archive WHERE date = ?', (today.isoformat(),)).fetchone()
+    if row is None:
+        row = conn.execute('''
+            SELECT id, scripture, quote, author, date FROM daily_inspiration
+            WHERE date <= ? ORDER BY date DESC LIMIT 1
+        ''', (today.isoformat(),)).fetchone()
+    return dict(row) if row else None
+
+
+class TodayCache:
+    """Process-local copy of today's inspiration, reloaded at UTC midnight or after an inspiration write"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._entry = None
+
+    def get(self, conn, generation=None):
+        if generation is None:
+            generation = _generation(conn)
+        key = (page_cache.today(), generation)
+        with self._lock:
+            if key == self._key:
+                return self._entry
+
+        entry = load_today(conn, key[0])
+        with self._lock:
+            self._key, self._entry = key, entry
+        return entry
+
+
+def today(conn, generation=None):
+    """Today's inspiration for the current app; pass the inspiration generation if already known"""
+    return current_app.extensions['inspiration_today'].get(conn, generation)
+
+
+def register_commands(app):
+    """Add the `flask inspiration` command group"""
+
+    @app.cli.group('inspiration')
+    def inspiration():
+        """Daily inspiration rotation"""
+
+    @inspiration.command('schedule')
+    @click.option('--rebuild', is_flag=True, help='Reshuffle every day after today even if nothing changed.')
+    def schedule_command(rebuild):
+        """Fill the year-ahead inspiration calendar"""
+        with get_pool().connection() as conn:
+            assigned = ensure_schedule(conn, rebuild=rebuild)
+        click.echo(f'Scheduled {assigned} days of inspiration')
+
+
+def init_app(app):
+    app.config.setdefault('INSPIRATION_SCHEDULE_DAYS', DEFAULT_SCHEDULE_DAYS)
+    app.config.setdefault('INSPIRATION_NO_REPEAT_DAYS', DEFAULT_NO_REPEAT_DAYS)
+    app.extensions['inspiration_today'] = TodayCache()
@@ -0,0 +1,89 @@
+import re
+
+from markupsafe import Markup, escape
+
+import migrations
+
+# Snippet markers that cannot appear in user content; swapped for <mark> after escaping
+_OPEN, _CLOSE = '\x02', '\x03'
+
+# What each content type contributes to a search result
+SOURCES = {
+    'sermons': {
+        'fts': 'sermons_fts',
+        'table': 'sermons',
+        'title': 't.title',
+        'subtitle': 'speaker',
+        'weights': (10.0, 5.0, 2.0, 1.0),
+        'endpoint': 'sermons',
+    },
+    'events': {
+        'fts': 'events_fts',
+        'table': 'events',
+        'title': 't.title',
+        'subtitle': 'location',
+        'weights': (10.0, 1.0, 3.0),
+        'endpoint': 'events',
+    },
+    'inspiration': {
+        'fts': 'daily_inspiration_fts',
+        'table': 'daily_inspiration',
+        'title': "COALESCE(t.quote, t.author, '')",
+        'subtitle': 'author',
+        'weights': (5.0, 5.0, 2.0),
+        'endpoint': 'inspiration',
+    },
+}
+
+
+def build_match(query):
+    """Turn free text into a safe FTS5 prefix query, or None if nothing is searchable"""
+    terms = re.findall(r'\w+', query or '')
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms[:16])
+
+
+def _source_sql(kind):
+    source = SOURCES[kind]
+    fts, table = source['fts'], source['table']
+    weights = ', '.join(str(w) for w in source['weights'])
+    return f'''
+        SELECT '{kind}' AS type, t.id AS id, {source['title']} AS title,
+               t.{source['subtitle']} AS subtitle, t.date AS date,
+               snippet({fts}, -1, '{_OPEN}', '{_CLOSE}', '…', 16) AS snippet,
+               bm25({fts}, {weights}) AS rank
+        FROM {fts} JOIN {table} t ON t.id = {fts}.rowid
+        WHERE {fts} MATCH :match
+    '''
+
+
+def highlight(text):
+    """Escape a snippet and turn the match markers into <mark> tags"""
+    escaped = str(escape(text or ''))
+    return Markup(escaped.replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>'))
+
+
+def search(conn, query, kinds=None, page=1, per_page=12):
+    """BM25-ranked results across content types; returns (rows, has_more)"""
+    match = build_match(query)
+    if match is None:
+        return [], False
+
+    kinds = [kind for kind in (kinds or SOURCES) if kind in SOURCES]
+    union = ' UNION ALL '.join(_source_sql(kind) for kind in kinds)
+    sql = f'SELECT * FROM ({union}) ORDER BY rank LIMIT :limit OFFSET :offset'
+    rows = conn.execute(sql, {
+        'match': match,
+        'limit': per_page + 1,
+        'offset': (page - 1) * per_page,
+    }).fetchall()
+    return rows[:per_page], len(rows) > per_page
+
+
+def rebuild(conn):
+    """Rebuild every full-text index from its content table"""
+    for fts, _, _ in migrations.FTS_TABLES:
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('optimize')")
+    conn.commit()
@@ -232,6 +232,15 @@ function initLazyLoading() {
         entries.forEach(entry => {
             if (entry.isIntersecting) {
                 const img = entry.target;
+                // Responsive variants: let the browser pick a width once the image is near
+                if (img.parentElement.tagName === 'PICTURE') {
+                    img.parentElement.querySelectorAll('source[data-srcset]').forEach(source => {
+                        source.srcset = source.dataset.srcset;
+                    });
+                }
+                if (img.dataset.srcset) {
+                    img.srcset = img.dataset.srcset;
+                }
                 img.src = img.dataset.src;
                 img.classList.remove('lazy');
                 imageObserver.unobserve(img);
@@ -0,0 +1,38 @@
+from flask import Response, current_app, render_template, stream_template
+
+from pagination import DEFAULT_PAGE_SIZE
+
+# None streams any full page at the configured PAGE_SIZE
+DEFAULT_MIN_ITEMS = None
+DEFAULT_BUFFER_SIZE = 8 * 1024
+
+
+def _buffered(chunks, size):
+    """Group Jinja's many small chunks into writes of about `size` characters"""
+    buffer, length = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def render_listing(template, items, **context):
+    """Render a listing page, streaming it when STREAM_TEMPLATES is on and the page is long"""
+    config = current_app.config
+    min_items = config['STREAM_MIN_ITEMS'] or config.get('PAGE_SIZE', DEFAULT_PAGE_SIZE)
+    if not config['STREAM_TEMPLATES'] or len(items) < min_items:
+        return render_template(template, **context)
+
+    # The header and first cards go out while the rest of the list is still rendering
+    chunks = stream_template(template, **context)
+    return Response(_buffered(chunks, config['STREAM_BUFFER_SIZE']), mimetype='text/html')
+
+
+def init_app(app):
+    app.config.setdefault('STREAM_TEMPLATES', False)
+    app.config.setdefault('STREAM_MIN_ITEMS', DEFAULT_MIN_ITEMS)
+    app.config.setdefault('STREAM_BUFFER_SIZE', DEFAULT_BUFFER_SIZE)
@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app reads its configuration from the environment at import time
+_data = tempfile.mkdtemp(prefix='church-tests-')
+os.environ.update(
+    DATABASE=os.path.join(_data, 'database.db'),
+    UPLOAD_FOLDER=os.path.join(_data, 'uploads'),
+    BACKUP_FOLDER=os.path.join(_data, 'backups'),
+    RATE_LIMIT='0',
+    TRUSTED_PROXY_HOPS='1',
+)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as site  # noqa: E402
+from db import get_pool  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    site.init_db()
+    site.app.testing = True
+    return site.app
+
+
+@pytest.fixture
+def conn(app):
+    with app.app_context(), get_pool(app).connection() as conn:
+        yield conn
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin(client):
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    return client
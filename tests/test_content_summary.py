@@ -0,0 +1,36 @@
+import content_summary
+
+
+def aggregate(conn):
+    sermons = conn.execute('''
+        SELECT COUNT(*) AS sermons, COUNT(DISTINCT speaker) AS speakers, COUNT(DISTINCT date) AS dates FROM sermons
+    ''').fetchone()
+    events = conn.execute('''
+        SELECT COUNT(*) AS events, COUNT(DISTINCT location) AS locations,
+               COALESCE(SUM(registration_required = 1), 0) AS registration_required FROM events
+    ''').fetchone()
+    return dict(sermons), dict(events)
+
+
+def totals(conn):
+    return content_summary.totals(conn, 'sermons'), content_summary.totals(conn, 'events')
+
+
+def test_stat_counters_follow_writes(conn):
+    assert totals(conn) == aggregate(conn)
+
+    conn.execute("INSERT INTO sermons (title, speaker, date) VALUES ('A', 'Counter Speaker', '1999-01-01')")
+    sermon_id = conn.execute("INSERT INTO sermons (title, speaker, date) VALUES ('B', 'Counter Speaker', '1999-01-01')").lastrowid
+    event_id = conn.execute('''
+        INSERT INTO events (title, date, location, registration_required) VALUES ('E', '1999-01-01', 'Counter Hall', 1)
+    ''').lastrowid
+    assert totals(conn) == aggregate(conn)
+
+    conn.execute("UPDATE sermons SET speaker = 'Other Speaker', date = '1999-01-02' WHERE id = ?", (sermon_id,))
+    conn.execute("UPDATE events SET location = NULL, registration_required = 0 WHERE id = ?", (event_id,))
+    assert totals(conn) == aggregate(conn)
+
+    conn.execute("DELETE FROM sermons WHERE speaker IN ('Counter Speaker', 'Other Speaker')")
+    conn.execute('DELETE FROM events WHERE id = ?', (event_id,))
+    assert totals(conn) == aggregate(conn)
+    conn.rollback()
@@ -0,0 +1,28 @@
+import pytest
+
+import feeds
+import jobs
+
+
+def test_stale_feed_is_served_while_a_rebuild_is_queued(app, client, conn, monkeypatch):
+    with app.test_request_context():
+        feeds.rebuild(conn)
+    first = client.get('/sermons/feed.xml')
+    assert first.status_code == 200
+
+    conn.execute("INSERT INTO sermons (title, speaker, date) VALUES ('Unrendered', 'Test', '2099-01-01')")
+    conn.commit()
+    with monkeypatch.context() as patch:
+        patch.setattr(feeds, 'rebuild', lambda *args, **kwargs: pytest.fail('a poll rendered the feed'))
+        for _ in range(3):
+            response = client.get('/sermons/feed.xml', headers={'If-None-Match': first.headers['ETag']})
+            assert response.status_code == 304
+    job = conn.execute("SELECT id FROM jobs WHERE dedupe_key = 'feeds.rebuild' AND status = 'queued'").fetchall()
+    assert len(job) == 1
+
+    with app.test_request_context():
+        jobs.execute(conn, jobs._claim(conn, 'test', job[0]['id']))
+    assert b'Unrendered' in client.get('/sermons/feed.xml').data
+    conn.execute("DELETE FROM sermons WHERE title = 'Unrendered'")
+    conn.commit()
+
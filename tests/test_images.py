@@ -0,0 +1,21 @@
+from PIL import ExifTags, Image
+
+import images
+
+
+def test_variants_follow_exif_rotation(tmp_path):
+    source = tmp_path / 'sideways.jpg'
+    exif = Image.Exif()
+    exif[ExifTags.Base.Orientation] = 6
+    Image.new('RGB', (2000, 1000), 'white').save(source, 'JPEG', exif=exif)
+
+    result = images.render_variants(str(source), str(tmp_path / 'variants'), 'ab' * 32,
+                                    (320, 640, 960, 1280), 80, 40_000_000)
+
+    assert (result['width'], result['height']) == (1000, 2000)
+    assert sorted({v['width'] for v in result['variants']}) == [320, 640, 960, 1000]
+    for variant in result['variants']:
+        assert variant['height'] == variant['width'] * 2
+        path = images.variant_path(str(tmp_path / 'variants'), 'ab' * 32, variant['width'], variant['format'])
+        with Image.open(path) as rendered:
+            assert rendered.size == (variant['width'], variant['height'])
@@ -0,0 +1,68 @@
+import time
+
+import jobs
+
+
+def add_job(conn, status, dedupe_key, started_at=None):
+    return conn.execute('''
+        INSERT INTO jobs (task, dedupe_key, status, attempts, max_attempts, run_at, enqueued_at, started_at, worker)
+        VALUES ('jobs.prune', ?, ?, 1, 5, 0, 0, ?, 'lost')
+    ''', (dedupe_key, status, started_at)).lastrowid
+
+
+def statuses(conn, ids):
+    return [conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()['status'] for job_id in ids]
+
+
+def test_requeue_stale_keeps_one_job_per_key(app, conn):
+    stale = time.time() - 3600
+    same_key = [add_job(conn, 'running', 'stale:shared', stale) for _ in range(3)]
+    unkeyed = [add_job(conn, 'running', None, stale) for _ in range(2)]
+    superseded = add_job(conn, 'running', 'stale:waiting', stale)
+    waiting = add_job(conn, 'queued', 'stale:waiting')
+    current = add_job(conn, 'running', 'stale:current', time.time())
+    conn.commit()
+
+    assert jobs.requeue_stale(conn, timeout=60) == 3
+    assert statuses(conn, same_key) == ['failed', 'failed', 'queued']
+    assert statuses(conn, unkeyed) == ['queued', 'queued']
+    assert statuses(conn, [superseded, waiting, current]) == ['failed', 'queued', 'running']
+
+    conn.execute("DELETE FROM jobs WHERE dedupe_key LIKE 'stale:%' OR worker = 'lost'")
+    conn.commit()
+
+
+def test_stats_counts_follow_status_changes(app, conn):
+    def counted():
+        rows = conn.execute('SELECT status, COUNT(*) AS jobs FROM jobs GROUP BY status').fetchall()
+        return dict((status, 0) for status in ('queued', 'running', 'done', 'failed')) | dict(
+            (row['status'], row['jobs']) for row in rows)
+
+    def reported():
+        stats = jobs.stats(conn)
+        return dict((status, stats[status]) for status in ('queued', 'running', 'done', 'failed'))
+
+    assert reported() == counted()
+    job_id = add_job(conn, 'queued', 'stats:counted')
+    conn.commit()
+    assert reported() == counted()
+    conn.execute("UPDATE jobs SET status = 'done', started_at = 0, finished_at = 1 WHERE id = ?", (job_id,))
+    conn.commit()
+    assert reported() == counted()
+    conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+    conn.commit()
+    assert reported() == counted()
+
+
+def test_dashboard_warns_when_no_worker_takes_jobs(app, conn, admin):
+    assert not jobs.stats(conn)['stalled']
+    assert b'The oldest queued job has waited' not in admin.get('/admin').data
+    add_job(conn, 'queued', 'stats:stalled')
+    conn.commit()
+
+    assert jobs.stats(conn)['stalled']
+    page = admin.get('/admin').data
+    assert b'The oldest queued job has waited' in page and b'flask --app app jobs run' in page
+    assert b'jobs_stalled 1' in admin.get('/metrics').data
+    conn.execute("DELETE FROM jobs WHERE dedupe_key = 'stats:stalled'")
+    conn.commit()
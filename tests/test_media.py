@@ -0,0 +1,17 @@
+import io
+import os
+
+
+def stored_files(app):
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(app.config['UPLOAD_FOLDER']) for name in names)
+
+
+def test_rejected_uploads_leave_no_files(app, admin):
+    before = stored_files(app)
+    response = admin.post('/admin/sermons/add', data={
+        'title': 'Rejected uploads', 'speaker': 'Test', 'date': '1999-01-01', 'scripture': '', 'description': '',
+        'media': [(io.BytesIO(b''), 'empty.mp3'), (io.BytesIO(b'MZ'), 'tool.exe')],
+        'image': (io.BytesIO(b''), 'empty.jpg'),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 302
+    assert stored_files(app) == before
@@ -0,0 +1,27 @@
+import io
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wsgi import FileWrapper
+
+import metrics
+from db import get_pool
+
+
+def test_file_responses_keep_the_servers_file_wrapper(app, admin):
+    admin.post('/admin/sermons/add', data={
+        'title': 'Sendfile', 'speaker': 'Test', 'date': '1999-01-02', 'scripture': '', 'description': '',
+        'media': (io.BytesIO(b'ID3' + b'\0' * 4096), 'talk.mp3'),
+    }, content_type='multipart/form-data')
+    with app.app_context(), get_pool(app).connection() as conn:
+        media_id = conn.execute('SELECT MAX(id) FROM sermon_media').fetchone()[0]
+        before = metrics.get_metrics(app).snapshot().get('sermon_media', {}).get('count', 0)
+
+    environ = EnvironBuilder(path=f'/media/{media_id}', environ_base={'wsgi.file_wrapper': FileWrapper}).get_environ()
+    statuses = []
+    app_iter = app.wsgi_app(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    assert isinstance(app_iter, FileWrapper)
+    assert b''.join(app_iter).startswith(b'ID3')
+    app_iter.close()
+
+    assert statuses == ['200 OK']
+    assert metrics.get_metrics(app).snapshot()['sermon_media']['count'] == before + 1
@@ -0,0 +1,17 @@
+from datetime import date, datetime, timezone
+
+import page_cache
+
+
+def test_daily_clock_matches_sqlite(conn):
+    assert page_cache.today().isoformat() == conn.execute("SELECT date('now')").fetchone()[0]
+
+
+def test_daily_pages_roll_over_with_the_sql_day(client, monkeypatch):
+    monkeypatch.setattr(page_cache, 'today', lambda: date(2030, 1, 1))
+    first = client.get('/events')
+    monkeypatch.setattr(page_cache, 'today', lambda: date(2030, 1, 2))
+    revalidated = client.get('/events', headers={'If-None-Match': first.headers['ETag']})
+    assert revalidated.status_code == 200
+    assert revalidated.headers['ETag'] != first.headers['ETag']
+    assert revalidated.last_modified >= datetime(2030, 1, 2, tzinfo=timezone.utc)
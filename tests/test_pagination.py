@@ -0,0 +1,30 @@
+import base64
+import json
+
+import pytest
+
+from pagination import decode_cursor, encode_cursor
+
+
+def crafted(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(['2024-01-07', 12])) == ['2024-01-07', 12]
+
+
+@pytest.mark.parametrize('values', [[{}], [[1], 2], ['2024-01-07', {'id': 1}], [True, 1], [2 ** 70, 1], {'date': 1}])
+def test_crafted_cursor_is_rejected(values):
+    assert decode_cursor(crafted(values)) is None
+
+
+@pytest.mark.parametrize('url', ['/sermons', '/admin/sermons', '/admin/events'])
+@pytest.mark.parametrize('values', [[{}], ['2024-01-07', [1]], ['2024-01-07', 1, 2]])
+@pytest.mark.parametrize('direction', ['after', 'before'])
+def test_bad_cursor_falls_back_to_first_page(admin, url, values, direction):
+    first = admin.get(f'{url}?format=json').get_json()
+    assert admin.get(f'{url}?{direction}={crafted(values)}').status_code == 200
+    response = admin.get(f'{url}?format=json&{direction}={crafted(values)}')
+    assert response.status_code == 200
+    assert response.get_json() == first
@@ -0,0 +1,19 @@
+import query_plans
+
+
+def test_no_query_sorts_with_a_temp_btree(app, conn):
+    results = query_plans.check_plans(conn, query_plans.source_files(app.root_path))
+    assert results
+    failures = [(location, sql, plan) for location, sql, plan, ok in results if not ok]
+    assert failures == []
+
+
+def test_check_catches_an_unindexed_sort(conn):
+    _, _, plan, ok = query_plans._check(conn, 'test', 'SELECT * FROM sermons ORDER BY title')
+    assert not ok, plan
+
+
+def test_check_plans_command(app):
+    result = app.test_cli_runner().invoke(args=['check-plans'])
+    assert result.exit_code == 0, result.output
+    assert ', 0 sorting with a temp B-tree' in result.output
@@ -0,0 +1,17 @@
+def login(client, address, username):
+    return client.post('/login', data={'username': username, 'password': 'wrong'},
+                       headers={'X-Forwarded-For': address})
+
+
+def test_forwarded_clients_get_separate_buckets(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_ENABLED', True)
+    statuses = [login(client, '203.0.113.1', f'first-{n}').status_code for n in range(11)]
+    assert statuses[-1] == 429
+    assert 429 not in statuses[:-1]
+    assert login(client, '203.0.113.2', 'second').status_code != 429
+
+
+def test_metrics_allowlist_uses_the_forwarded_address(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICS_ALLOWLIST', ['203.0.113.9'])
+    assert client.get('/metrics', headers={'X-Forwarded-For': '203.0.113.9'}).status_code == 200
+    assert client.get('/metrics', headers={'X-Forwarded-For': '203.0.113.10'}).status_code == 302
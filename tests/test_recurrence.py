@@ -0,0 +1,49 @@
+import sqlite3
+
+import pytest
+
+import page_cache
+import recurrence
+
+
+def test_failed_extension_is_retried(conn, monkeypatch):
+    calls = []
+
+    def busy(conn, until_day=None):
+        calls.append(until_day)
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(recurrence, '_horizon_memo', recurrence._HorizonMemo())
+    monkeypatch.setattr(recurrence, 'extend', busy)
+    for _ in range(2):
+        with pytest.raises(sqlite3.OperationalError):
+            recurrence.ensure_horizon(conn)
+    assert len(calls) == 2
+
+    monkeypatch.setattr(recurrence, 'extend', lambda conn, until_day=None: calls.append(until_day))
+    recurrence.ensure_horizon(conn)
+    recurrence.ensure_horizon(conn)
+    assert len(calls) == 3
+    assert recurrence._horizon_memo.day == page_cache.today()
+
+
+def test_events_api_never_writes(app, client, conn):
+    event_id = conn.execute('''
+        INSERT INTO events (title, date, recurrence) VALUES ('Weekly prayer', date('now'), 'weekly')
+    ''').lastrowid
+    with app.test_request_context():
+        recurrence.sync_event(conn, event_id)
+    conn.commit()
+    horizon = recurrence.horizon_end()
+    before = page_cache.content_state(conn, ('events',)), conn.execute('SELECT COUNT(*) FROM event_occurrences').fetchone()[0]
+    start = horizon.replace(year=horizon.year + 2)
+    response = client.get(f'/api/events?from={start.isoformat()}&to={start.isoformat()}')
+    assert response.status_code == 200
+    assert response.get_json()['events'] == []
+    assert response.get_json()['horizon'] == horizon.isoformat()
+    after = page_cache.content_state(conn, ('events',)), conn.execute('SELECT COUNT(*) FROM event_occurrences').fetchone()[0]
+    assert after == before
+
+    conn.execute('DELETE FROM event_occurrences WHERE event_id = ?', (event_id,))
+    conn.execute('DELETE FROM events WHERE id = ?', (event_id,))
+    conn.commit()
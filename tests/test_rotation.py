@@ -0,0 +1,20 @@
+import pytest
+
+import rotation
+
+
+def test_public_pages_only_read_the_schedule(app, admin, client, conn, monkeypatch):
+    admin.post('/admin/inspiration/add', data={'scripture': 'Psalm 1:1', 'quote': 'Rotation test',
+                                               'author': 'Test', 'date': '1997-01-01'})
+    queued = conn.execute('''
+        SELECT COUNT(*) FROM jobs WHERE dedupe_key = 'inspiration.schedule' AND status = 'queued'
+    ''').fetchone()[0]
+    assert queued == 1
+
+    monkeypatch.setattr(rotation, 'ensure_schedule', lambda *args, **kwargs: pytest.fail('a GET rebuilt the schedule'))
+    assert client.get('/inspiration').status_code == 200
+    assert client.get('/').status_code == 200
+
+    conn.execute("DELETE FROM daily_inspiration WHERE quote = 'Rotation test'")
+    conn.execute("DELETE FROM jobs WHERE dedupe_key = 'inspiration.schedule'")
+    conn.commit()
@@ -0,0 +1,15 @@
+def test_a_full_default_page_streams(app, client, conn, monkeypatch):
+    conn.executemany("INSERT INTO sermons (title, speaker, date) VALUES (?, 'Stream', '1998-01-01')",
+                     [(f'Streamed {n}',) for n in range(app.config['PAGE_SIZE'])])
+    conn.commit()
+    monkeypatch.setitem(app.config, 'STREAM_TEMPLATES', True)
+    monkeypatch.setitem(app.config, 'PAGE_CACHE_ENABLED', False)
+    try:
+        full = client.get('/sermons')
+        short = client.get(f"/sermons?per_page={app.config['PAGE_SIZE'] - 1}")
+        assert full.status_code == short.status_code == 200
+        assert full.is_streamed and 'Content-Length' not in full.headers
+        assert 'Content-Length' in short.headers
+    finally:
+        conn.execute("DELETE FROM sermons WHERE speaker = 'Stream'")
+        conn.commit()
@@ -0,0 +1,59 @@
+import os
+import time
+
+from jinja2 import FileSystemBytecodeCache
+
+import assets
+from db import get_pool
+
+# Templates are the .html pages and the feed .xml files
+TEMPLATE_SUFFIXES = ('.html', '.xml')
+
+
+def install_bytecode_cache(app):
+    """Share compiled templates between workers and restarts through a folder of bytecode files
+
+    Jinja keys each file on the template's source checksum and replaces it
+    atomically, so workers can write it concurrently and edited templates
+    never load stale code.
+    """
+    folder = app.config['JINJA_CACHE_FOLDER']
+    if not folder:
+        return
+    os.makedirs(folder, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(folder)
+
+
+def compile_templates(app):
+    """Load every template into the environment's cache; returns how many"""
+    names = app.jinja_env.list_templates(filter_func=lambda name: name.endswith(TEMPLATE_SUFFIXES))
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def prime_pool(app):
+    """Open the pool's connections (migrating the schema first if needed); returns how many"""
+    pool = get_pool(app)
+    connections = [pool.acquire() for _ in range(pool.max_size)]
+    for conn in connections:
+        pool.release(conn)
+    return len(connections)
+
+
+def warm_up(app):
+    """Do the first-request work up front: templates, database connections, the asset manifest"""
+    started = time.perf_counter()
+    templates = compile_templates(app)
+    connections = prime_pool(app)
+    with app.app_context():
+        assets.get_manifest()
+    seconds = time.perf_counter() - started
+    app.logger.info(f'Warm-up: {templates} templates, {connections} connections in {seconds * 1000:.1f} ms')
+    return {'templates': templates, 'connections': connections, 'seconds': seconds}
+
+
+def init_app(app):
+    app.config.setdefault('WARM_UP', False)
+    app.config.setdefault('JINJA_CACHE_FOLDER',
+                          os.path.join(os.path.dirname(app.config['DATABASE']) or '.', 'jinja-cache'))